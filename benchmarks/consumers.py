@@ -0,0 +1,88 @@
+"""
+Microbenchmark of consuming a page of entries the way the ``oembed`` filter does for
+a list view. Compares constructing a consumer and loading resource templates for
+every entry with the shared consumers returned by :func:`monocle.consumers.get_consumer`
+and compiled templates kept by :mod:`monocle.resources`. Setup is also timed on its
+own, since rendering dominates whole pages. Run from the repository root::
+
+    $ DJANGO_SETTINGS_MODULE=monocle.tests.settings python benchmarks/consumers.py
+"""
+import sys
+import timeit
+
+from django.template.loader import get_template
+from mock import patch
+
+from monocle.consumers import Consumer, HTMLConsumer, get_consumer
+from monocle.providers import InternalProvider, registry
+
+
+ENTRIES = 50
+REPEAT = 5
+NUMBER = 20
+
+TEXT_CONTENT = 'Check this out http://bench.example.com/photo/1 and this http://example.org/'
+HTML_CONTENT = '<p>%s</p><p><a href="http://example.org/">http://example.org/</a></p>' % TEXT_CONTENT
+
+
+class BenchProvider(InternalProvider):
+    url_schemes = ['http://bench.example.com/photo/*']
+    resource_type = 'photo'
+    DIMENSIONS = [(100, 100), (200, 200)]
+    DEFAULT_WIDTH = DEFAULT_HEIGHT = 200
+
+    url = 'http://bench.example.com/photo.jpg'
+
+    @classmethod
+    def get_object(cls, url):
+        return cls()
+
+
+def per_call(cls, content):
+    # Templates were loaded on every render before they were kept compiled, and
+    # every consumer made sure providers were loaded when it was constructed
+    with patch('monocle.resources._get_template', get_template):
+        for i in xrange(ENTRIES):
+            consumer = cls()
+            registry.ensure_populated()
+            consumer.devour(content)
+
+
+def shared(html, content):
+    for i in xrange(ENTRIES):
+        get_consumer(html=html).devour(content)
+
+
+def setup_per_call(cls, content):
+    for i in xrange(ENTRIES):
+        cls()
+        registry.ensure_populated()
+        get_template('monocle/photo.html')
+
+
+def setup_shared(html, content):
+    for i in xrange(ENTRIES):
+        get_consumer(html=html)
+
+
+def report(name, func, *args):
+    timer = timeit.Timer(lambda: func(*args))
+    best = min(timer.repeat(repeat=REPEAT, number=NUMBER)) / NUMBER
+    sys.stdout.write('%-28s %8.3f ms/page %8.1f us/entry\n' % (name, best * 1000,
+                                                                 best * 1000000 / ENTRIES))
+
+
+def main():
+    registry.register(BenchProvider)
+
+    sys.stdout.write('%d entries per page, best of %d\n\n' % (ENTRIES, REPEAT))
+    report('text, consumer per call', per_call, Consumer, TEXT_CONTENT)
+    report('text, shared consumer', shared, False, TEXT_CONTENT)
+    report('html, consumer per call', per_call, HTMLConsumer, HTML_CONTENT)
+    report('html, shared consumer', shared, True, HTML_CONTENT)
+    report('setup per call', setup_per_call, HTMLConsumer, HTML_CONTENT)
+    report('setup shared', setup_shared, True, HTML_CONTENT)
+
+
+if __name__ == '__main__':
+    main()
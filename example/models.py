@@ -51,6 +51,19 @@ class EntryProvider(InternalProvider):
         except:
             return None
 
+    @classmethod
+    def get_objects(cls, urls):
+        # One query for all entries linked in a document
+        ids = {}
+        for url in urls:
+            found = re.findall(r'entry/([0-9]+)', url, re.I)
+            if found:
+                ids[url] = int(found[0])
+
+        entries = Entry.objects.in_bulk(ids.values())
+        return dict((url, EntryProvider(entry=entries[id])) for url, id in ids.items()
+                    if id in entries)
+
     @property
     def title(self):
         return self.entry.title
@@ -3,6 +3,7 @@ This module provides a single cache wrapper instance that can be used as follows
 
     from monocle.cache import cache
 """
+import hashlib
 import logging
 
 from django.core.cache import cache as _cache
@@ -23,15 +24,18 @@ class Cache(object):
     def make_key(self, *args):
         """
         Returns a consistent cache key that is the result of prefixing
-        ``CACHE_KEY_PREFIX`` from :mod:`monocle.settings` with method args
-        joined by a colon.
+        ``CACHE_KEY_PREFIX`` from :mod:`monocle.settings` with the MD5 hash of
+        method args joined by a colon. Keys are mostly request URLs, which may be
+        longer than memcached allows or contain characters it rejects. Hashed keys
+        are always short and safe.
 
         For example
 
         >>> make_key('foo', 'bar')
-        "MONOCLE:foo:bar"
+        "MONOCLE:4e99e8c12de7e01535248d2bac85e732"
         """
-        return '%s:%s' % (settings.CACHE_KEY_PREFIX, ':'.join(args))
+        key = ':'.join(arg.encode('utf-8') if isinstance(arg, unicode) else arg for arg in args)
+        return '%s:%s' % (settings.CACHE_KEY_PREFIX, hashlib.md5(key).hexdigest())
 
     def get_or_prime(self, key, primer=''):
         """
@@ -42,26 +46,34 @@ class Cache(object):
         :param primer: Specific value to prime the cache with if no key exists
         :returns: Two-tuple (value, primed) where primed indicates if cache was primed
         """
-        key = self.make_key(key)
+        hashed = self.make_key(key)
 
-        if _cache.add(key, primer, timeout=settings.CACHE_AGE):
+        if _cache.add(hashed, primer, timeout=settings.CACHE_AGE):
             logger.debug('Primed cache key %s with %s for age %s' % (key, primer, settings.CACHE_AGE))
-            cache_miss.send(sender=self, key=key)
+            if cache_miss.receivers:
+                cache_miss.send(sender=self, key=key)
             return primer, True
         else:
-            cache_hit.send(sender=self, key=key)
-            return _cache.get(key), False
+            if cache_hit.receivers:
+                cache_hit.send(sender=self, key=key)
+            return _cache.get(hashed), False
 
-    def set(self, key, value):
+    def set(self, key, value, timeout=None):
         """
         Wrapper for ``cache.set()`` to ensure that the cache key is properly
         formatted and setting value ``CACHE_AGE`` is specified as a timeout
 
         :param string key: Cache key
         :param value: Cache value
+        :param integer timeout: Optional timeout in seconds, at most ``CACHE_AGE``
         :returns: Result of Django ``cache.set()``
         """
-        _cache.set(self.make_key(key), value, timeout=settings.CACHE_AGE)
+        if timeout is None:
+            timeout = settings.CACHE_AGE
+        else:
+            timeout = min(timeout, settings.CACHE_AGE)
+
+        _cache.set(self.make_key(key), value, timeout=timeout)
 
     def get(self, key):
         """
@@ -72,15 +84,115 @@ class Cache(object):
         :param string key: Cache key to retrieve
         :returns: Result of Django ``cache.get()``
         """
-        key = self.make_key(key)
-        val = _cache.get(key)
+        val = _cache.get(self.make_key(key))
 
         # Django cache backend explicitly returns `None` on a miss
-        if val is None:
+        if val is None and cache_miss.receivers:
             cache_miss.send(sender=self, key=key)
 
         return val
 
+    def get_many(self, keys):
+        """
+        Retrieves many objects from cache in a single round trip. This sends
+        ``cache_hit`` or ``cache_miss`` signals for each key like :func:`get`.
+
+        :param list keys: Cache keys to retrieve
+        :returns: Dict of values found keyed by the specified keys
+        """
+        keys = dict((self.make_key(key), key) for key in keys)
+        found = _cache.get_many(keys.keys())
+
+        if cache_hit.receivers or cache_miss.receivers:
+            for hashed, key in keys.items():
+                if hashed in found:
+                    cache_hit.send(sender=self, key=key)
+                else:
+                    cache_miss.send(sender=self, key=key)
+
+        return dict((keys[key], value) for key, value in found.items())
+
+    def _dependents_prefix(self, key, generation):
+        return 'dependents:%s:%s' % (key, generation)
+
+    def _dependents_generation(self, key):
+        """
+        Returns the cache key of the current generation of dependents of ``key``,
+        making sure it exists
+        """
+        generation_key = self.make_key('dependents', key)
+        _cache.add(generation_key, 0, timeout=settings.CACHE_AGE)
+        return generation_key
+
+    def add_dependent(self, key, dependent, timeout=None):
+        """
+        Records that something depends on the object cached at ``key``, so that it
+        can be refreshed or invalidated when that object changes. Every dependent is
+        stored under a key of its own in a numbered slot, claimed with an atomic
+        ``incr``, so concurrent writers never overwrite each other. At most
+        ``CACHE_MAX_DEPENDENTS`` are recorded per key until they are popped.
+
+        :param string key: Cache key depended on
+        :param dependent: Any hashable, picklable value
+        :param integer timeout: Optional time in seconds to keep the dependent, at most
+                                ``CACHE_AGE``. Dependents that only live as long as
+                                some cached value should expire with it
+        :returns: False if the dependent could not be recorded, True otherwise
+        """
+        timeout = settings.CACHE_AGE if timeout is None else min(timeout, settings.CACHE_AGE)
+        generation = _cache.get(self._dependents_generation(key)) or 0
+        prefix = self._dependents_prefix(key, generation)
+
+        # Each dependent is recorded once per generation
+        marker = self.make_key(prefix, repr(dependent))
+        if not _cache.add(marker, True, timeout=timeout):
+            return True
+
+        count_key = self.make_key(prefix, 'count')
+        _cache.add(count_key, 0, timeout=settings.CACHE_AGE)
+
+        try:
+            slot = _cache.incr(count_key)
+        except ValueError:
+            slot = None
+
+        if slot is None or slot > settings.CACHE_MAX_DEPENDENTS:
+            logger.warning('Cannot record more dependents of cache key %s' % key)
+            _cache.delete(marker)
+            return False
+
+        _cache.set(self.make_key(prefix, str(slot)), dependent, timeout=timeout)
+        return True
+
+    def pop_dependents(self, key):
+        """
+        Removes and returns all dependents recorded for ``key``. The generation of
+        dependents is closed with an atomic ``incr`` first, so dependents added
+        meanwhile are kept for the next pop and concurrent pops never return the
+        same dependents.
+
+        :param string key: Cache key depended on
+        :returns: Set of dependents
+        """
+        generation_key = self._dependents_generation(key)
+
+        try:
+            generation = _cache.incr(generation_key) - 1
+        except ValueError:
+            return set()
+
+        prefix = self._dependents_prefix(key, generation)
+        count_key = self.make_key(prefix, 'count')
+        count = min(_cache.get(count_key) or 0, settings.CACHE_MAX_DEPENDENTS)
+
+        slots = [self.make_key(prefix, str(slot)) for slot in xrange(1, count + 1)]
+        if not slots:
+            return set()
+
+        dependents = set(_cache.get_many(slots).values())
+        _cache.delete_many(slots + [count_key])
+        return dependents
+
     def delete(self, key):
         return _cache.delete(self.make_key(key))
 
@@ -1,15 +1,25 @@
 import logging
 import re
+import threading
+import time
 
 from BeautifulSoup import BeautifulSoup
+from HTMLParser import HTMLParser
 
-from monocle.providers import registry, InternalProvider
+from monocle.cache import cache
+from monocle.providers import fetch_resources, registry, InternalProvider
 from monocle.settings import settings
-from monocle.signals import pre_consume, post_consume
+from monocle.signals import pre_consume, post_consume, resource_rendered
 
 
 logger = logging.getLogger(__name__)
 
+_unescape = HTMLParser().unescape
+
+# Shared consumer instances keyed by (class, skip_internal). See get_consumer
+_consumers = {}
+_consumers_lock = threading.Lock()
+
 
 class Consumer(object):
     """
@@ -17,6 +27,9 @@ class Consumer(object):
     interact with the provider framework to locate a corresponding resource. If a valid
     resource is returned from the provider framework, all occurrences of the URL matched
     will be replaced with the resource's response.
+
+    Consumers hold no per-call state, so a single instance can be shared between threads
+    (see :func:`get_consumer`). Subclasses should keep it that way.
     """
 
     # From https://github.com/worldcompany/djangoembed/blob/master/oembed/constants.py#L43
@@ -24,9 +37,38 @@ class Consumer(object):
 
     def __init__(self, skip_internal=False):
         self.skip_internal = skip_internal
+
+    def has_candidates(self, content):
+        """
+        A cheap pre-scan of content that is done before any parsing. Content is only
+        worth consuming if it contains at least one URL whose host a registered
+        provider could match (see :func:`monocle.providers.ProviderRegistry.may_match`).
+        Consumers are shared, so external providers are loaded here if they are not yet,
+        i.e. after the registry is cleared or if the database was not synced before.
+
+        :param string content: Content to scan
+        :returns: Bool
+        """
+        if not content or '://' not in content:
+            return False
+
         registry.ensure_populated()
 
-    def enrich(self, content, maxwidth=None, maxheight=None):
+        for match in self.url_regex.finditer(content):
+            if registry.may_match(match.group(0)):
+                return True
+        return False
+
+    def extract_urls(self, content):
+        """
+        Returns all URLs in content that are candidates for enrichment
+
+        :param string content: Content to scan
+        :returns: List of URLs in order of appearance
+        """
+        return self.url_regex.findall(content or '')
+
+    def enrich(self, content, maxwidth=None, maxheight=None, resources=None, providers=None):
         """
         Returns an enriched version of content that replaces all URLs that
         have a provider with valid resource data. By default, all providers
@@ -39,36 +81,129 @@ class Consumer(object):
         :param string content: Content to enrich
         :param integer maxwidth: Maximum width of resource
         :param integer maxheight: Maximum height of resource
+        :param list resources: Optional list that rendered resources are appended to
+                               (see :func:`render`)
+        :param dict providers: Optional providers already matched, keyed by URL
+                               (see :func:`render`)
         :returns: A version of specific content with matched URLs replaced with
                   rendered resources
         """
         for url in self.url_regex.findall(content):
-            provider = registry.match(url)
+            rendered = self.render(url, maxwidth=maxwidth, maxheight=maxheight,
+                                   resources=resources, providers=providers)
 
-            if not provider:
-                logger.debug('No provider match for %s' % url)
-                continue
+            if rendered is not None:
+                content = content.replace(url, rendered)
+        return content
 
-            # Bypass internal providers if they aren't cached
-            if (self.skip_internal and isinstance(provider, InternalProvider) and
-                    not settings.CACHE_INTERNAL_PROVIDERS):
-                logger.debug('Skipping uncached internal provider')
-                continue
+    def render(self, url, maxwidth=None, maxheight=None, resources=None, providers=None):
+        """
+        Renders the resource for a single URL, respecting ``skip_internal``.
+
+        If a ``resources`` list is given, the rendered resource is appended to it so
+        that callers can tell what their output depends on. None is appended instead
+        for output that can't be reused later, i.e. resources of uncached internal
+        providers or failed lookups.
 
-            # This is generally a safeguard against bad provider implementations
-            try:
-                resource = provider.get_resource(url, maxwidth=maxwidth, maxheight=maxheight)
-            except:
-                logger.exception('Failed to get resource from provider %s' % provider)
+        :param string url: Content URL
+        :param integer maxwidth: Maximum width of resource
+        :param integer maxheight: Maximum height of resource
+        :param list resources: Optional list that the rendered resource is appended to
+        :param dict providers: Optional providers already matched, keyed by URL, as
+                               returned by :func:`ProviderRegistry.match_many`. URLs
+                               missing from it are matched on their own
+        :returns: Rendered resource or None if the URL should be left as is
+        """
+        if providers is not None and url in providers:
+            provider = providers[url]
+        else:
+            provider = registry.match(url)
+
+        if not provider:
+            logger.debug('No provider match for %s' % url)
+            return None
+
+        # Bypass internal providers if they aren't cached
+        if (self.skip_internal and isinstance(provider, InternalProvider) and
+                not settings.CACHE_INTERNAL_PROVIDERS):
+            logger.debug('Skipping uncached internal provider')
+            return None
+
+        # Only time rendering if anyone is listening
+        started = time.time() if resource_rendered.receivers else None
+
+        # This is generally a safeguard against bad provider implementations
+        try:
+            resource = provider.get_resource(url, maxwidth=maxwidth, maxheight=maxheight)
+        except:
+            logger.exception('Failed to get resource from provider %s' % provider)
+            if resources is not None:
+                resources.append(None)
+            return None
+
+        if not resource.is_valid:
+            logger.warning('Provider %s returned a bad resource' % provider)
+
+        if resources is not None:
+            if isinstance(provider, InternalProvider) and not settings.CACHE_INTERNAL_PROVIDERS:
+                resources.append(None)
             else:
-                if not resource.is_valid:
-                    logger.warning('Provider %s returned a bad resource' % provider)
+                resources.append(resource)
 
-                logger.debug('Embedding %s for url %s' % (resource, url))
-                content = content.replace(url, resource.render())
-        return content
+        logger.debug('Embedding %s for url %s' % (resource, url))
+        rendered = resource.render(url)
+
+        if started is not None:
+            resource_rendered.send(sender=self, url=url, provider=provider, resource=resource,
+                                   latency=time.time() - started)
+        return rendered
+
+    def _pre_consume(self):
+        """
+        Sends ``pre_consume`` if it has receivers. Returns the start time if ``post_consume``
+        has receivers, otherwise None
+        """
+        if pre_consume.receivers:
+            pre_consume.send(sender=self)
+        return time.time() if post_consume.receivers else None
+
+    def _post_consume(self, started):
+        """
+        Sends ``post_consume`` with the time taken since ``started``, if consumption was timed
+        """
+        if started is not None:
+            post_consume.send(sender=self, latency=time.time() - started)
+
+    def fetch(self, urls, maxwidth=None, maxheight=None, timeout=None, providers=None):
+        """
+        Synchronously fetches any external resources for the given URLs that are not
+        yet cached, waiting at most ``timeout`` seconds overall. This is meant to be used
+        prior to :func:`enrich` so that a cold cache does not result in bare links.
+        Anything not fetched in time is requested asynchronously as usual.
 
-    def devour(self, content, maxwidth=None, maxheight=None):
+        :param list urls: Content URLs to fetch
+        :param integer maxwidth: Maximum width of resource
+        :param integer maxheight: Maximum height of resource
+        :param float timeout: Overall deadline in seconds
+        :param dict providers: Optional providers already matched, keyed by URL
+        """
+        if providers is None:
+            providers = registry.match_many(urls)
+
+        request_urls = []
+
+        for url in set(urls):
+            provider = providers.get(url)
+
+            # Internal providers are built directly, nothing to wait on
+            if provider and not provider._internal:
+                request_urls.append(provider.get_resource_url(url, maxwidth=maxwidth,
+                                                              maxheight=maxheight))
+
+        if request_urls:
+            fetch_resources(request_urls, timeout)
+
+    def devour(self, content, maxwidth=None, maxheight=None, timeout=None, resources=None):
         """
         Consumes all OEmbed content URLs in the content. Returns a new
         version of the content with URLs replaced with rich content. This
@@ -76,15 +211,37 @@ class Consumer(object):
         after enriching the specified content. Any subclasses should take
         note to honor this behavior.
 
+        Providers for all URLs in the content are matched at once, so internal
+        providers get a single :func:`InternalProvider.get_objects` call per document.
+        If a ``timeout`` is given, external resources missing from cache are
+        fetched synchronously first (see :func:`fetch`). Content without any
+        candidate URLs (see :func:`has_candidates`) is returned as is without
+        sending any signals.
+
         :param string content: Content to enrich
         :param integer maxwidth: Maximum width of resource
         :param integer maxheight: Maximum height of resource
+        :param float timeout: Optional deadline in seconds to wait for uncached resources
+        :param list resources: Optional list that rendered resources are appended to
+                               (see :func:`render`)
         :returns: A version of specific content with matched URLs replaced with
                   rendered resources
         """
-        pre_consume.send(sender=self)
-        content = self.enrich(content or '', maxwidth=maxwidth, maxheight=maxheight)
-        post_consume.send(sender=self)
+        if not self.has_candidates(content):
+            return content or ''
+
+        started = self._pre_consume()
+        content = content or ''
+        urls = self.extract_urls(content)
+        providers = registry.match_many(urls)
+
+        if timeout:
+            self.fetch(urls, maxwidth=maxwidth, maxheight=maxheight, timeout=timeout,
+                       providers=providers)
+
+        content = self.enrich(content, maxwidth=maxwidth, maxheight=maxheight,
+                              resources=resources, providers=providers)
+        self._post_consume(started)
         return content
 
 
@@ -109,73 +266,385 @@ class HTMLConsumer(Consumer):
         # TODO: This might need work if we want to go all the way up the tree
         return node.parent and node.parent.name == 'a'
 
-    def devour(self, content, maxwidth=None, maxheight=None):
-        pre_consume.send(sender=self)
-
+    def _soupify(self, content):
+        """
+        Parses html content returning the soup and a list of text elements
+        containing URLs that are not hyperlinked
+        """
         # Soupify with less aggressive entity conversion
         soup = BeautifulSoup(content or '', convertEntities=BeautifulSoup.HTML_ENTITIES)
+        elements = []
 
         for element in soup.findAll(text=self.url_regex):
             # Don't handle linked URLs
             if self._is_hyperlinked(element):
                 logger.debug('Skipping hyperlinked content: %s' % element)
                 continue
-            repl = self.enrich(str(element), maxwidth=maxwidth, maxheight=maxheight)
+            elements.append(element)
+
+        return soup, elements
+
+    def _element_urls(self, elements):
+        """
+        Returns all URLs in a list of text elements. Bare ampersands are escaped
+        in elements, so URLs are unescaped
+        """
+        return [_unescape(url) for element in elements for url in self.url_regex.findall(element)]
+
+    def extract_urls(self, content):
+        soup, elements = self._soupify(content)
+        return self._element_urls(elements)
+
+    def render(self, url, maxwidth=None, maxheight=None, resources=None, providers=None):
+        # Lookup the real URL rather than the escaped text
+        return super(HTMLConsumer, self).render(_unescape(url), maxwidth=maxwidth,
+                                                maxheight=maxheight, resources=resources,
+                                                providers=providers)
+
+    def devour(self, content, maxwidth=None, maxheight=None, timeout=None, resources=None):
+        if not self.has_candidates(content):
+            return content or ''
+
+        started = self._pre_consume()
+        soup, elements = self._soupify(content)
+        urls = self._element_urls(elements)
+        providers = registry.match_many(urls)
+
+        if timeout:
+            self.fetch(urls, maxwidth=maxwidth, maxheight=maxheight, timeout=timeout,
+                       providers=providers)
+
+        for element in elements:
+            repl = self.enrich(str(element), maxwidth=maxwidth, maxheight=maxheight,
+                               resources=resources, providers=providers)
             element.replaceWith(BeautifulSoup(repl, convertEntities=BeautifulSoup.HTML_ENTITIES))
 
-        post_consume.send(sender=self)
+        self._post_consume(started)
         return str(soup)
 
 
-def devour(content, html=False, maxwidth=None, maxheight=None, skip_internal=False):
+class StreamingHTMLConsumer(Consumer):
+    """
+    An alternative to :class:`HTMLConsumer` that never builds a document tree.
+    Content is tokenized incrementally into markup and text. Text that is not
+    inside a hyperlink, at any depth, is enriched in place and everything else is
+    written out byte-for-byte untouched. The contents of ``script`` and ``style``
+    elements are never enriched.
+
+    This is considerably cheaper than :class:`HTMLConsumer` for large documents and
+    can be made the default for html content with ``CONSUMER_STREAM_HTML``
+    in :mod:`monocle.settings`
+    """
+
+    # Starts of comments, CDATA, declarations, processing instructions and start/end tags
+    markup_regex = re.compile(r'<(?:(!--)|(!\[CDATA\[)|(!)|(\?)|(/)?([a-zA-Z][^\s/>"\'<]*))')
+
+    # Ends of markup other than tags, by the group that matched its start. Markup
+    # that is not closed by the first is closed by the next, like a declaration
+    markup_ends = {1: ('-->', '>'), 2: (']]>', '>'), 3: ('>',), 4: ('>',)}
+
+    # Attributes of a tag, which ends if a '>' follows them. Unquoted attributes can't
+    # contain '<' and no two alternatives start alike, so this never backtracks
+    attrs_regex = re.compile(r'(?:[^<>"\']+|"[^"]*"|\'[^\']*\')*')
+
+    # Elements whose contents are not html, mapped to a regex of their end tag
+    raw_text_tags = dict((tag, re.compile(r'</%s' % tag, re.I)) for tag in ('script', 'style'))
+
+    def _markup_end(self, content, match, missing):
+        """
+        Returns the end of the markup starting at a match of ``markup_regex``, or None
+        if it is not closed. Terminators once found missing are kept in ``missing``
+        so the rest of the content is only searched for each of them once.
+        """
+        ends = self.markup_ends.get(match.lastindex)
+
+        if ends is None:
+            attrs = self.attrs_regex.match(content, match.end())
+            if content.startswith('>', attrs.end()):
+                return attrs.end() + 1
+            return None
+
+        for terminator in ends:
+            if terminator not in missing:
+                close = content.find(terminator, match.end())
+                if close >= 0:
+                    return close + len(terminator)
+                missing.add(terminator)
+
+        return None
+
+    def tokenize(self, content):
+        """
+        Generates two-tuples of (chunk, enrichable) from html content, where chunks
+        joined together are exactly the original content and enrichable indicates
+        a text chunk that is not hyperlinked. A ``<`` that does not start
+        well-formed markup is text. Tokenizing takes linear time even for malformed
+        content.
+
+        :param string content: HTML content
+        """
+        pos = scan = 0
+        end = len(content)
+        linked = 0
+        missing = set()
+
+        while scan < end:
+            match = self.markup_regex.search(content, scan)
+            if not match:
+                break
+
+            start = match.start()
+            markup_end = self._markup_end(content, match, missing)
+
+            if markup_end is None:
+                scan = start + 1
+                continue
+
+            if start > pos:
+                yield content[pos:start], not linked
+
+            yield content[start:markup_end], False
+            pos = scan = markup_end
+
+            closing, tag = match.group(5, 6)
+            if not tag:
+                continue
+
+            tag = tag.lower()
+            if tag == 'a' and content[markup_end - 2:markup_end] != '/>':
+                linked = max(0, linked - 1) if closing else linked + 1
+            elif tag in self.raw_text_tags and not closing:
+                # Skip ahead to the end tag without looking at the contents
+                close = self.raw_text_tags[tag].search(content, pos)
+                close = close.start() if close else end
+                if close > pos:
+                    yield content[pos:close], False
+                pos = scan = close
+
+        if pos < end:
+            yield content[pos:], not linked
+
+    def _enrich_text(self, text, maxwidth=None, maxheight=None, rendered=None, resources=None,
+                     providers=None):
+        """
+        Replaces URLs in a text chunk with rendered resources. Entities in the
+        text are left alone, but URLs are unescaped before they are looked up.
+        """
+        if rendered is None:
+            rendered = {}
+
+        def _replace(match):
+            url = match.group(0)
+            if url not in rendered:
+                real_url = _unescape(url) if '&' in url else url
+                rendered[url] = self.render(real_url, maxwidth=maxwidth, maxheight=maxheight,
+                                            resources=resources, providers=providers)
+            return url if rendered[url] is None else rendered[url]
+
+        return self.url_regex.sub(_replace, text)
+
+    def extract_urls(self, content):
+        return self._chunk_urls(self.tokenize(content or ''))
+
+    def _chunk_urls(self, chunks):
+        """
+        Returns all URLs in enrichable chunks, unescaped
+        """
+        urls = []
+        for chunk, enrichable in chunks:
+            if enrichable:
+                urls.extend(map(_unescape, self.url_regex.findall(chunk)))
+        return urls
+
+    def devour(self, content, maxwidth=None, maxheight=None, timeout=None, resources=None):
+        if not self.has_candidates(content):
+            return content or ''
+
+        started = self._pre_consume()
+        chunks = list(self.tokenize(content or ''))
+        urls = self._chunk_urls(chunks)
+        providers = registry.match_many(urls)
+
+        if timeout:
+            self.fetch(urls, maxwidth=maxwidth, maxheight=maxheight, timeout=timeout,
+                       providers=providers)
+
+        # Each distinct URL is only rendered once per document
+        rendered = {}
+        output = []
+
+        for chunk, enrichable in chunks:
+            if enrichable:
+                chunk = self._enrich_text(chunk, maxwidth=maxwidth, maxheight=maxheight,
+                                          rendered=rendered, resources=resources,
+                                          providers=providers)
+            output.append(chunk)
+
+        self._post_consume(started)
+        return ''.join(output)
+
+
+def get_consumer(html=False, skip_internal=False):
+    """
+    Returns a consumer for text or html content. The type of html consumer
+    depends on ``CONSUMER_STREAM_HTML`` in :mod:`monocle.settings`. Consumers are
+    created once and shared, so repeated calls cost a single dict lookup.
+
+    :param boolean html: Whether to treat content as plain text or html
+    :param boolean skip_internal: Whether internal providers should be processed
+    :returns: :class:`Consumer` instance
+    """
+    if not html:
+        cls = Consumer
+    elif settings.CONSUMER_STREAM_HTML:
+        cls = StreamingHTMLConsumer
+    else:
+        cls = HTMLConsumer
+
+    key = (cls, skip_internal)
+
+    try:
+        return _consumers[key]
+    except KeyError:
+        with _consumers_lock:
+            if key not in _consumers:
+                _consumers[key] = cls(skip_internal=skip_internal)
+            return _consumers[key]
+
+
+def devour(content, html=False, maxwidth=None, maxheight=None, skip_internal=False, timeout=None,
+           resources=None):
     """
     Consume a string interpreting as text or html with optional max width/height.
-    Optionally indicate if internal providers should be skipped
+    Optionally indicate if internal providers should be skipped. If a ``timeout``
+    is given, external resources missing from cache are fetched synchronously
+    and concurrently, waiting at most that many seconds for all of them.
 
     :param string content: Content to enrich
     :param boolean html: Whether to treat content as plain text or html
     :param integer maxwidth: Maximum width of resource
     :param integer maxheight: Maximum height of resource
     :param integer skip_internal: Whether internal providers should be processed
+    :param float timeout: Optional deadline in seconds to wait for uncached resources
+    :param list resources: Optional list that rendered resources are appended to
+                           (see :func:`Consumer.render`)
     :returns: A version of specific content with matched URLs replaced with
               rendered resources
     """
-    if html:
-        c = HTMLConsumer(skip_internal=skip_internal)
-    else:
-        c = Consumer(skip_internal=skip_internal)
+    c = get_consumer(html=html, skip_internal=skip_internal)
+    return c.devour(content, maxwidth=maxwidth, maxheight=maxheight, timeout=timeout,
+                    resources=resources)
 
-    return c.devour(content, maxwidth=maxwidth, maxheight=maxheight)
 
+def _size_combinations(sizes):
+    """
+    Expands prefetch sizes to a list of (maxwidth, maxheight) two-tuples. The first
+    entry is always (None, None) meaning no explicit size. Tuples are used as is, as are
+    lists, which tuples become when they pass through a JSON task serializer. Integers
+    become (size, None), (None, size) and (size, size)
+    """
+    combinations = [(None, None)]
+
+    for size in (sizes or []):
+        # Explicit size
+        if isinstance(size, (tuple, list)):
+            expanded = [tuple(size)]
+
+        # All size combinations - (size, None), (None, size), (size, size)
+        elif isinstance(size, int):
+            expanded = [(size, None), (None, size), (size, size)]
+
+        else:
+            continue
 
-def prefetch(content, html=False, sizes=None):
+        for combination in expanded:
+            if combination not in combinations:
+                combinations.append(combination)
+
+    return combinations
+
+
+def prefetch_urls(urls, sizes=None):
     """
-    Performs a series of :func:`devour` calls for each entry in the ``sizes`` parameter.
-    By default, no explicit size will be passed to the providers. Sizes can be a
-    list of integer two-tuples or integers that are converted to size combinations
+    Ensures resources for every combination of URL and size are cached or being
+    fetched. Each URL is matched to a provider once and the cache is checked for
+    all combinations in a single lookup. Only resources that are missing or stale are
+    then requested from their provider. Nothing is rendered. All internal providers
+    are skipped if they are not cached
+
+    :param list urls: Content URLs
+    :param list sizes: Integer two-tuples or single integers (see :func:`prefetch`)
+    :returns: Number of resources requested from their providers
+    """
+    combinations = _size_combinations(sizes)
+    lookups = {}
+    requested = 0
+
+    for url, provider in registry.match_many(urls).items():
+        if not provider:
+            logger.debug('No provider match for %s' % url)
+            continue
+
+        if isinstance(provider, InternalProvider) and not settings.CACHE_INTERNAL_PROVIDERS:
+            logger.debug('Skipping uncached internal provider')
+            continue
+
+        for maxwidth, maxheight in combinations:
+            request_url = provider.get_resource_url(url, maxwidth=maxwidth, maxheight=maxheight)
+            lookups[request_url] = (provider, url, maxwidth, maxheight)
+
+    if not lookups:
+        return requested
+
+    cached = cache.get_many(lookups.keys())
+
+    for request_url, (provider, url, maxwidth, maxheight) in lookups.items():
+        resource = cached.get(request_url)
+
+        # Primed resources that are not yet fetched are not stale
+        if resource is not None and not resource.is_stale:
+            continue
+
+        # This is generally a safeguard against bad provider implementations
+        try:
+            provider.get_resource(url, maxwidth=maxwidth, maxheight=maxheight)
+        except:
+            logger.exception('Failed to get resource from provider %s' % provider)
+        else:
+            requested += 1
+
+    return requested
+
+
+def prefetch(content, html=False, sizes=None, previous=None):
+    """
+    Prefetches resources for all URLs in content for each entry in the ``sizes``
+    parameter. By default, no explicit size will be passed to the providers. Sizes
+    can be a list of integer two-tuples or integers that are converted to size combinations
     (i.e. 100 becomes (100, None), (None, 100) and (100, 100)). All internal providers
-    are skipped here if they are not cached
+    are skipped here if they are not cached.
 
-    :param string content: Content to enrich
+    Content is only scanned once regardless of the number of sizes; see :func:`prefetch_urls`.
+    If a ``previous`` version of the content is given, only URLs that are not also
+    in it are prefetched.
+
+    :param string content: Content to prefetch
     :param boolean html: Whether to treat content as plain text or html
     :param list sizes: Integer two-tuples or single integers
-    :returns: A version of specific content with matched URLs replaced with
-              rendered resources
+    :param string previous: Optional previous version of content already prefetched
     """
     logger.debug('Prefetching OEmbed content excluding uncached internal providers')
 
     # Get a consumer
-    c = HTMLConsumer(skip_internal=True) if html else Consumer(skip_internal=True)
-    c.devour(content)
+    c = get_consumer(html=html, skip_internal=True)
 
-    # Process size combinations
-    for size in (sizes or []):
-        # Explicit size
-        if isinstance(size, tuple):
-            c.devour(content, maxwidth=size[0], maxheight=size[1])
+    if not c.has_candidates(content):
+        return
 
-        # All size combinations - (size, None), (None, size), (size, size)
-        elif isinstance(size, int):
-            c.devour(content, maxwidth=size)
-            c.devour(content, maxheight=size)
-            c.devour(content, maxwidth=size, maxheight=size)
+    urls = set(c.extract_urls(content))
+
+    if c.has_candidates(previous):
+        urls.difference_update(c.extract_urls(previous))
+
+    if urls:
+        prefetch_urls(urls, sizes=sizes)
@@ -1,20 +1,91 @@
 """
 A collection of Django field extensions that handle OEmbed content prefetching
+and storage of pre-rendered OEmbed content
 """
 import logging
 
-from django.db.models import fields
+from django.db import transaction
+from django.db.models import fields, signals
 
-from monocle.consumers import prefetch
+from monocle.cache import cache
+from monocle.consumers import get_consumer, prefetch
+from monocle.providers import registry
 from monocle.settings import settings
+from monocle.signals import resource_updated
+from monocle.tasks import prefetch_oembed, render_oembed_field
+from monocle.util import canonical_content_url
 
 
 logger = logging.getLogger(__name__)
 
 
-class OEmbedCharField(fields.CharField):
+def _on_commit(func):
     """
-    An extension of ``CharField`` with two optional attributes
+    Calls func once the current transaction commits, on Django versions that support
+    it. Otherwise func is called immediately
+    """
+    on_commit = getattr(transaction, 'on_commit', None)
+
+    if on_commit is not None:
+        on_commit(func)
+    else:
+        func()
+
+
+def _prefetch(content, html=False, sizes=None, previous=None, deferred=False):
+    """
+    Prefetches content either directly or, if deferred, via a celery task. The task
+    is sent after commit on Django versions that support it and right away otherwise.
+    It is given the content itself so it does not depend on the saved row.
+    """
+    if not deferred:
+        prefetch(content, html=html, sizes=sizes, previous=previous)
+        return
+
+    # Don't bother the broker with content that can't contain URLs
+    if not content or '://' not in content:
+        return
+
+    logger.debug('Deferring OEmbed prefetch to celery task')
+    _on_commit(lambda: prefetch_oembed.apply_async((content, html, sizes, previous)))
+
+
+class _PrefetchFieldMixin(object):
+    """
+    Prefetching behavior common to all OEmbed fields. The value of the field is
+    tracked from the time a model instance is initialized, so that saving an
+    unchanged value prefetches nothing and saving a changed value only prefetches
+    URLs that were not in the previous value.
+    """
+
+    def contribute_to_class(self, cls, name):
+        super(_PrefetchFieldMixin, self).contribute_to_class(cls, name)
+        signals.post_init.connect(self._track_initial, sender=cls, weak=False,
+                                  dispatch_uid='monocle.fields.%s.%s.%s' % (cls._meta.app_label,
+                                                                            cls.__name__, name))
+
+    def _track_initial(self, sender, instance, **kwargs):
+        """Post-init signal callback"""
+        initial = instance.__dict__.setdefault('_oembed_initial', {})
+        initial[self.attname] = instance.__dict__.get(self.attname)
+
+    def _prefetch_on_save(self, model, add, html=False):
+        value = getattr(model, self.attname)
+        initial = model.__dict__.setdefault('_oembed_initial', {})
+        previous = None if add else initial.get(self.attname)
+
+        if not add and self.attname in initial and value == previous:
+            logger.debug('Value of %s is unchanged, skipping prefetch' % self.name)
+        else:
+            _prefetch(value, html=html, sizes=self.prefetch_sizes, previous=previous,
+                      deferred=self.prefetch_async)
+
+        initial[self.attname] = value
+
+
+class OEmbedCharField(_PrefetchFieldMixin, fields.CharField):
+    """
+    An extension of ``CharField`` with three optional attributes
 
     * ``contains_html``
 
@@ -27,6 +98,11 @@ class OEmbedCharField(fields.CharField):
         This has the effect of prefetching multiple size variations. These values
         translate to request arguments ``maxwidth`` and ``maxheight`` so tuples
         in the form ``(100, None)`` and ``(None, 100)`` are valid.
+
+    * ``prefetch_async``
+
+      * Bool indicating whether prefetching should be handed to a celery task rather
+        than done on save. Default is ``PREFETCH_ASYNC`` from :mod:`monocle.settings`.
     """
 
     description = 'CharField that transparently fetches OEmbed content on save'
@@ -34,16 +110,17 @@ class OEmbedCharField(fields.CharField):
     def __init__(self, *args, **kwargs):
         self.contains_html = kwargs.pop('contains_html', False)
         self.prefetch_sizes = kwargs.pop('prefetch_sizes', settings.RESOURCE_DEFAULT_DIMENSIONS)
+        self.prefetch_async = kwargs.pop('prefetch_async', settings.PREFETCH_ASYNC)
         super(OEmbedCharField, self).__init__(*args, **kwargs)
 
     def pre_save(self, model, add):
-        prefetch(getattr(model, self.attname), html=self.contains_html, sizes=self.prefetch_sizes)
+        self._prefetch_on_save(model, add, html=self.contains_html)
         return super(OEmbedCharField, self).pre_save(model, add)
 
 
-class OEmbedTextField(fields.TextField):
+class OEmbedTextField(_PrefetchFieldMixin, fields.TextField):
     """
-    An extension of ``TextField`` with two optional attributes
+    An extension of ``TextField`` with three optional attributes
 
     * ``contains_html``
 
@@ -56,6 +133,11 @@ class OEmbedTextField(fields.TextField):
         This has the effect of prefetching multiple size variations. These values
         translate to request arguments ``maxwidth`` and ``maxheight`` so tuples
         in the form ``(100, None)`` and ``(None, 100)`` are valid.
+
+    * ``prefetch_async``
+
+      * Bool indicating whether prefetching should be handed to a celery task rather
+        than done on save. Default is ``PREFETCH_ASYNC`` from :mod:`monocle.settings`.
     """
 
     description = 'TextField that transparently fetches OEmbed content on save'
@@ -63,16 +145,17 @@ class OEmbedTextField(fields.TextField):
     def __init__(self, *args, **kwargs):
         self.contains_html = kwargs.pop('contains_html', True)
         self.prefetch_sizes = kwargs.pop('prefetch_sizes', settings.RESOURCE_DEFAULT_DIMENSIONS)
+        self.prefetch_async = kwargs.pop('prefetch_async', settings.PREFETCH_ASYNC)
         super(OEmbedTextField, self).__init__(*args, **kwargs)
 
     def pre_save(self, model, add):
-        prefetch(getattr(model, self.attname), html=self.contains_html, sizes=self.prefetch_sizes)
+        self._prefetch_on_save(model, add, html=self.contains_html)
         return super(OEmbedTextField, self).pre_save(model, add)
 
 
-class OEmbedURLField(fields.URLField):
+class OEmbedURLField(_PrefetchFieldMixin, fields.URLField):
     """
-    An extension of ``URLField`` with optional attribute. Content is **always**
+    An extension of ``URLField`` with two optional attributes. Content is **always**
     parsed as plain text.
 
     * ``prefetch_sizes``
@@ -81,18 +164,161 @@ class OEmbedURLField(fields.URLField):
         This has the effect of prefetching multiple size variations. These values
         translate to request arguments ``maxwidth`` and ``maxheight`` so tuples
         in the form ``(100, None)`` and ``(None, 100)`` are valid.
+
+    * ``prefetch_async``
+
+      * Bool indicating whether prefetching should be handed to a celery task rather
+        than done on save. Default is ``PREFETCH_ASYNC`` from :mod:`monocle.settings`.
     """
 
     description = 'URLField that transparently fetches OEmbed content on save'
 
     def __init__(self, *args, **kwargs):
         self.prefetch_sizes = kwargs.pop('prefetch_sizes', settings.RESOURCE_DEFAULT_DIMENSIONS)
+        self.prefetch_async = kwargs.pop('prefetch_async', settings.PREFETCH_ASYNC)
         super(OEmbedURLField, self).__init__(*args, **kwargs)
 
     def pre_save(self, model, add):
-        prefetch(getattr(model, self.attname), html=False, sizes=self.prefetch_sizes)
+        self._prefetch_on_save(model, add)
         return super(OEmbedURLField, self).pre_save(model, add)
 
+
+class OEmbedRenderedField(fields.TextField):
+    """
+    A ``TextField`` that stores the fully enriched content of another OEmbed field on
+    the same model, rendered at the default size. Templates can output this value
+    directly and skip consumption entirely::
+
+        class Entry(models.Model):
+            content = OEmbedTextField()
+            content_html = OEmbedRenderedField(source='content')
+
+    Whenever the source value changes, this field is cleared on save and refreshed by a
+    celery task. The task is scheduled after commit on Django versions that support it.
+    Otherwise it is sent right away and retried until the saved row is visible to it.
+    It is refreshed again whenever any resource it embeds is
+    updated in cache, so content saved before its resources were fetched fills in once
+    they are. Until then the value is ``None``, so templates should fall back to the
+    ``oembed`` filter on the source field.
+
+    Only external resources are updated in cache. Resources of internal providers are
+    built from their objects, so rows are not rendered again when those objects
+    change. Call :func:`refresh` for rows that embed them, i.e. from a ``post_save``
+    handler of the embedded model. Requires attribute
+
+    * ``source``
+
+      * Name of the OEmbed field whose content is rendered
+    """
+
+    description = 'TextField that stores pre-rendered OEmbed content of another field'
+
+    def __init__(self, *args, **kwargs):
+        self.source = kwargs.pop('source', None)
+        if not self.source:
+            raise TypeError('OEmbedRenderedField requires a source field name')
+
+        kwargs.setdefault('editable', False)
+        kwargs.setdefault('blank', True)
+        kwargs.setdefault('null', True)
+        super(OEmbedRenderedField, self).__init__(*args, **kwargs)
+
+    def contribute_to_class(self, cls, name):
+        super(OEmbedRenderedField, self).contribute_to_class(cls, name)
+        uid = 'monocle.fields.%s.%s.%s' % (cls._meta.app_label, cls.__name__, name)
+        signals.post_init.connect(self._track_source, sender=cls, weak=False, dispatch_uid=uid)
+        signals.post_save.connect(self._schedule_render, sender=cls, weak=False, dispatch_uid=uid)
+
+    def get_source_field(self):
+        return self.model._meta.get_field(self.source)
+
+    def _track_source(self, sender, instance, **kwargs):
+        """Post-init signal callback"""
+        initial = instance.__dict__.setdefault('_oembed_rendered', {})
+        initial[self.attname] = instance.__dict__.get(self.get_source_field().attname)
+
+    def pre_save(self, model, add):
+        content = getattr(model, self.get_source_field().attname)
+        initial = model.__dict__.setdefault('_oembed_rendered', {})
+        pending = model.__dict__.setdefault('_oembed_render_pending', {})
+
+        if add or self.attname not in initial or content != initial[self.attname]:
+            # Content without URLs renders as itself. Otherwise clear the stale
+            # rendering until it is refreshed by the task
+            if not content or '://' not in content:
+                setattr(model, self.attname, content)
+            else:
+                setattr(model, self.attname, None)
+                pending[self.attname] = content
+
+            initial[self.attname] = content
+
+        return super(OEmbedRenderedField, self).pre_save(model, add)
+
+    def _schedule_render(self, sender, instance, **kwargs):
+        """Post-save signal callback"""
+        pending = instance.__dict__.get('_oembed_render_pending', {})
+        if self.attname not in pending:
+            return
+
+        args = (self.model._meta.app_label, self.model._meta.object_name,
+                instance.pk, self.name, pending.pop(self.attname))
+
+        logger.debug('Scheduling render of %s for %s' % (self.name, instance.pk))
+        _on_commit(lambda: render_oembed_field.apply_async(args))
+
+    def refresh(self, pk, content=None):
+        """
+        Renders source content and stores it for the row with primary key ``pk``. Every
+        URL in the content is recorded as a dependency so that the row is rendered again
+        when its resource is updated. Dependencies are recorded before rendering, so a
+        resource updated meanwhile renders the row again rather than being missed.
+
+        :param pk: Primary key of the row to refresh
+        :param content: Source content to render. If given, the row is only updated
+                        if its source still has this value. Otherwise it is read
+                        from the database
+        :returns: True if the row was updated
+        """
+        source = self.get_source_field()
+        queryset = self.model._default_manager.filter(pk=pk)
+
+        if content is None:
+            try:
+                content = queryset.values_list(source.attname, flat=True)[0]
+            except IndexError:
+                logger.warning('Cannot render %s, %s does not exist' % (self.name, pk))
+                return False
+        else:
+            queryset = queryset.filter(**{source.attname: content})
+
+        consumer = get_consumer(html=getattr(source, 'contains_html', False))
+
+        if consumer.has_candidates(content):
+            dependent = (self.model._meta.app_label, self.model._meta.object_name, pk, self.name)
+
+            # Updated resources are known by their canonical URL
+            for url, provider in registry.match_many(consumer.extract_urls(content)).items():
+                url = canonical_content_url(url) if provider is None else provider.canonicalize(url)
+                if not cache.add_dependent('rendered:%s' % url, dependent):
+                    logger.warning('%s of %s is not rendered again when %s is updated' % (
+                        self.name, pk, url))
+
+        rendered = consumer.devour(content)
+        return queryset.update(**{self.attname: rendered}) > 0
+
+
+def _refresh_rendered(sender, resource, **kwargs):
+    """
+    Resource updated signal callback. Schedules rendering of every row that embeds
+    the updated resource
+    """
+    for app_label, model_name, pk, name in cache.pop_dependents('rendered:%s' % resource.url):
+        render_oembed_field.apply_async((app_label, model_name, pk, name))
+
+resource_updated.connect(_refresh_rendered, dispatch_uid='monocle.fields.refresh_rendered')
+
+
 try:
     from south.modelsinspector import add_introspection_rules
 except ImportError:
@@ -100,7 +326,8 @@ except ImportError:
 else:
     _rule1 = ((OEmbedCharField, OEmbedTextField, OEmbedURLField), # Classes the rules apply to
              [],                     # Positional arguments -- not used
-             {'prefetch_sizes': ["prefetch_sizes", {'default':settings.RESOURCE_DEFAULT_DIMENSIONS}]
+             {'prefetch_sizes': ["prefetch_sizes", {'default':settings.RESOURCE_DEFAULT_DIMENSIONS}],
+              'prefetch_async': ["prefetch_async", {'default':settings.PREFETCH_ASYNC}],
               })
     _rule2 = ((OEmbedCharField, OEmbedTextField), # Classes the rules apply to
              [],                     # Positional arguments -- not used
@@ -108,3 +335,5 @@ else:
               })
 
     add_introspection_rules([_rule1, _rule2], ['^monocle\.fields\.OEmbed(Char|Text|URL)Field'])
+    add_introspection_rules([((OEmbedRenderedField,), [], {'source': ["source", {}]})],
+                            ['^monocle\.fields\.OEmbedRenderedField'])
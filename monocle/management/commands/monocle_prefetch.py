@@ -0,0 +1,232 @@
+"""
+Management command that warms the cache with resources for all existing content
+stored in OEmbed fields. This is useful after a cache flush or after adding a new
+provider, so that page views don't all start cold::
+
+    $ ./manage.py monocle_prefetch
+    $ ./manage.py monocle_prefetch blog.Entry --workers=8
+"""
+import time
+
+from multiprocessing import Pool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import get_app, get_model, get_models
+
+from monocle.consumers import get_consumer, prefetch_urls
+from monocle.fields import OEmbedCharField, OEmbedTextField, OEmbedURLField
+from monocle.providers import registry
+
+
+OEMBED_FIELDS = (OEmbedCharField, OEmbedTextField, OEmbedURLField)
+
+
+def _prefetch_batch(urls, sizes):
+    """
+    Prefetches a batch of URLs and returns the number of resources requested. This
+    is run in worker processes
+    """
+    return prefetch_urls(urls, sizes=sizes)
+
+
+def _close_connection():
+    """
+    Worker process initializer. Forked processes must not share the parent's
+    database connection
+    """
+    connection.close()
+
+
+class Command(BaseCommand):
+    args = '[app_label[.ModelName] ...]'
+    help = ('Prefetches OEmbed resources for every URL stored in OEmbed fields. '
+            'Optionally limited to specific apps or models.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', dest='workers', default=4,
+                    help='Number of worker processes. 0 prefetches in this process (default 4)'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=1000,
+                    help='Number of rows read from the database at a time (default 1000)'),
+        make_option('--batch-size', type='int', dest='batch_size', default=100,
+                    help='Number of unique URLs handed to a worker at a time (default 100)'),
+    )
+
+    def handle(self, *labels, **options):
+        self.verbosity = int(options.get('verbosity', 1))
+        self.chunk_size = options['chunk_size']
+        self.batch_size = options['batch_size']
+        workers = options['workers']
+
+        # Workers share providers and their indexes loaded before the fork. Fork
+        # before any other database access so that workers open their own connections
+        registry.warm()
+        connection.close()
+        self.pool = Pool(workers, _close_connection) if workers > 0 else None
+
+        self.started = time.time()
+        self.rows = self.queued = self.prefetched = self.failed = 0
+
+        # URLs seen and not yet queued, both keyed by prefetch sizes
+        self.seen = {}
+        self.pending = {}
+
+        # Two-tuples (number of URLs, AsyncResult) of batches handed to workers
+        self.results = []
+
+        try:
+            for model, fields in self.get_models(labels):
+                self.scan(model, fields)
+
+            for sizes in self.pending.keys():
+                self.flush(sizes)
+
+            if self.pool is not None:
+                self.pool.close()
+                self.collect(wait=True)
+                self.pool.join()
+        except KeyboardInterrupt:
+            if self.pool is not None:
+                self.pool.terminate()
+            raise
+
+        self.progress(final=True)
+
+        if self.failed:
+            raise CommandError('Prefetching failed for %d of %d URLs' % (self.failed, self.queued))
+
+    def get_models(self, labels):
+        """
+        Generates two-tuples (model, oembed fields) for all models, or only those
+        specified by labels, that have any OEmbed fields
+        """
+        if not labels:
+            models = get_models()
+        else:
+            models = []
+            for label in labels:
+                if '.' in label:
+                    model = get_model(*label.split('.', 1))
+                    if model is None:
+                        raise CommandError('Unknown model: %s' % label)
+                    models.append(model)
+                else:
+                    try:
+                        models.extend(get_models(get_app(label)))
+                    except Exception:
+                        raise CommandError('Unknown application: %s' % label)
+
+        for model in models:
+            if model._meta.proxy:
+                continue
+
+            fields = [f for f in model._meta.fields if isinstance(f, OEMBED_FIELDS)]
+            if fields:
+                yield model, fields
+
+    def iter_rows(self, model, fields):
+        """
+        Streams value tuples (pk, field values...) of a model in chunks ordered by pk
+        """
+        queryset = model._default_manager.order_by('pk')
+        queryset = queryset.values_list('pk', *[f.attname for f in fields])
+        last = None
+
+        while True:
+            chunk = queryset if last is None else queryset.filter(pk__gt=last)
+            count = 0
+
+            for row in chunk[:self.chunk_size].iterator():
+                count += 1
+                last = row[0]
+                yield row
+
+            if count < self.chunk_size:
+                break
+
+    def scan(self, model, fields):
+        """
+        Extracts URLs from all OEmbed fields of a model and queues those not seen before
+        """
+        if self.verbosity > 1:
+            self.stdout.write('Scanning %s.%s\n' % (model._meta.app_label, model.__name__))
+
+        consumers = [get_consumer(html=getattr(f, 'contains_html', False), skip_internal=True)
+                     for f in fields]
+        sizes = [tuple(f.prefetch_sizes or ()) for f in fields]
+
+        for row in self.iter_rows(model, fields):
+            self.rows += 1
+
+            for consumer, size, value in zip(consumers, sizes, row[1:]):
+                if not consumer.has_candidates(value):
+                    continue
+
+                seen = self.seen.setdefault(size, set())
+                pending = self.pending.setdefault(size, set())
+
+                for url in consumer.extract_urls(value):
+                    if url not in seen:
+                        seen.add(url)
+                        pending.add(url)
+
+                if len(pending) >= self.batch_size:
+                    self.flush(size)
+
+            if self.verbosity > 0 and self.rows % self.chunk_size == 0:
+                self.progress()
+
+    def flush(self, sizes):
+        """
+        Hands off all pending URLs for a set of sizes to the workers
+        """
+        urls = list(self.pending.pop(sizes, []))
+        if not urls:
+            return
+
+        self.queued += len(urls)
+
+        if self.pool is None:
+            try:
+                self.prefetched += _prefetch_batch(urls, list(sizes))
+            except Exception, e:
+                self.fail(len(urls), e)
+        else:
+            result = self.pool.apply_async(_prefetch_batch, (urls, list(sizes)))
+            self.results.append((len(urls), result))
+            self.collect()
+
+    def collect(self, wait=False):
+        """
+        Counts the resources requested by batches that workers finished, or by all
+        batches if ``wait`` is True, and reports batches that failed
+        """
+        pending = []
+
+        for count, result in self.results:
+            if not wait and not result.ready():
+                pending.append((count, result))
+                continue
+
+            try:
+                self.prefetched += result.get()
+            except Exception, e:
+                self.fail(count, e)
+
+        self.results = pending
+
+    def fail(self, count, error):
+        self.failed += count
+        self.stderr.write('Prefetching a batch of %d URLs failed: %s\n' % (count, error))
+
+    def progress(self, final=False):
+        if self.verbosity < 1:
+            return
+
+        elapsed = max(time.time() - self.started, 0.001)
+        self.stdout.write('%s%d rows scanned (%.1f/s), %d unique URLs queued, '
+                          '%d resources prefetched (%.1f/s)\n' % ('Done: ' if final else '',
+                                                                   self.rows, self.rows / elapsed,
+                                                                   self.queued, self.prefetched,
+                                                                   self.prefetched / elapsed))
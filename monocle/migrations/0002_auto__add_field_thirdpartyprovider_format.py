@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'ThirdPartyProvider.format'
+        db.add_column('monocle_thirdpartyprovider', 'format',
+                      self.gf('django.db.models.fields.CharField')(default='json', max_length=4),
+                      keep_default=False)
+
+
+    def backwards(self, orm):
+        # Deleting field 'ThirdPartyProvider.format'
+        db.delete_column('monocle_thirdpartyprovider', 'format')
+
+
+    models = {
+        'monocle.thirdpartyprovider': {
+            'Meta': {'ordering': "('api_endpoint', 'resource_type')", 'object_name': 'ThirdPartyProvider'},
+            'api_endpoint': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'expose': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'format': ('django.db.models.fields.CharField', [], {'default': "'json'", 'max_length': '4'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'db_index': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'resource_type': ('django.db.models.fields.CharField', [], {'max_length': '10'})
+        },
+        'monocle.urlscheme': {
+            'Meta': {'object_name': 'URLScheme'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'provider': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'_schemes'", 'to': "orm['monocle.ThirdPartyProvider']"}),
+            'scheme': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['monocle']
@@ -7,10 +7,13 @@ from django import get_version as django_version
 from django.core.exceptions import ValidationError
 from django.db import models
 
+from monocle.cache import cache
 from monocle.providers import Provider, registry
 from monocle.settings import settings
+from monocle.signals import resource_updated
 
 RESOURCE_CHOICES = [(x, x.capitalize()) for x in settings.RESOURCE_TYPES]
+FORMAT_CHOICES = [('json', 'JSON'), ('xml', 'XML')]
 
 
 class ThirdPartyProvider(models.Model, Provider):
@@ -25,6 +28,8 @@ class ThirdPartyProvider(models.Model, Provider):
     is_active = models.BooleanField(default=True, db_index=True)
     expose = models.BooleanField(default=False, db_index=True,
                                  help_text="Expose this resource to external requests")
+    format = models.CharField(choices=FORMAT_CHOICES, default='json', max_length=4,
+                              help_text="Response format to request from the API endpoint")
 
     # verify_exists deprecated in >= 1.4
     if LooseVersion(django_version()) < LooseVersion('1.4'):
@@ -123,6 +128,16 @@ def _invalidate_provider_schemes(sender, instance, created, **kwargs):
     # Invalidate the related object cache
     instance.provider.invalidate_scheme_cache()
 
+    # The registry holds its own instance, with its own scheme cache
+    registry.update(instance.provider)
+
+
+def _invalidate_rendered_content(sender, resource, **kwargs):
+    """Resource updated signal callback"""
+    # Cached template tag output embedding this resource (see monocle.templatetags)
+    for key in cache.pop_dependents('fragment:%s' % resource.url):
+        cache.delete(key)
+
 
 # Connect signals
 models.signals.post_save.connect(_update_provider, sender=ThirdPartyProvider)
@@ -130,6 +145,8 @@ models.signals.post_save.connect(_invalidate_provider_schemes, sender=URLScheme)
 
 models.signals.post_delete.connect(_unregister_provider, sender=ThirdPartyProvider)
 
+resource_updated.connect(_invalidate_rendered_content)
+
 
 # Prepopulate
 registry.ensure_populated()
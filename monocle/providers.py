@@ -1,17 +1,23 @@
+import copy
 import logging
 import re
+import threading
+import time
 import warnings
 
+from bisect import bisect_right
+from functools import partial
 from urllib import urlencode
+from urlparse import urlparse
 
 from django.template import Context
-from django.template.loader import get_template
 
 from monocle.cache import cache
-from monocle.resources import Resource
+from monocle.resources import Resource, _get_template
 from monocle.settings import settings
-from monocle.tasks import request_external_oembed
-from monocle.util import synced
+from monocle.signals import resource_updated
+from monocle.tasks import request_external_oembed, request_resource
+from monocle.util import canonical_content_url, canonical_url, extract_content_url, synced
 
 
 logger = logging.getLogger(__name__)
@@ -24,6 +30,45 @@ class InvalidProvider(Exception):
     pass
 
 
+class _DimensionIndex(object):
+    """
+    Allowed sizes of a provider, sorted so that the nearest size within a maximum is
+    found by bisecting on width. Sizes already found are memoized, up to ``MEMO_SIZE``
+    distinct maximums.
+    """
+    MEMO_SIZE = 1024
+
+    def __init__(self, dims):
+        self.dims = dims
+        self.sizes = sorted(tuple(d) for d in dims)
+        self.widths = [d[0] for d in self.sizes]
+        self.memo = {}
+
+    def nearest(self, maxdim):
+        """
+        :param tuple maxdim: Maximum (width, height)
+        :returns: The largest allowed size within maxdim, or None if there is none
+        """
+        try:
+            return self.memo[maxdim]
+        except KeyError:
+            pass
+
+        nearest = None
+
+        # Widest sizes first. The first one that fits is the largest
+        for i in xrange(bisect_right(self.widths, maxdim[0]) - 1, -1, -1):
+            if self.sizes[i][1] <= maxdim[1]:
+                nearest = self.sizes[i]
+                break
+
+        if len(self.memo) >= self.MEMO_SIZE:
+            self.memo.clear()
+
+        self.memo[maxdim] = nearest
+        return nearest
+
+
 class Provider(object):
     """
     A Provider is essentially an OEmbed endpoint that, well, provides
@@ -48,6 +93,7 @@ class Provider(object):
     resource_type = None
     is_active = True  # Enable this provider to serve content
     expose = False  # Expose this provider externally
+    format = 'json'  # Response format requested from the endpoint, json or xml
     _internal = False
 
     def get_resource(self, url, **kwargs):
@@ -60,19 +106,13 @@ class Provider(object):
         :returns: :class:`monocle.resources.Resource`
 
         .. note::
-            Currently only JSON-compatible requests are honored. If a request is
-            made for an XML resource, it will still return a JSON resource
+            Resources are requested from the endpoint in the provider's ``format``,
+            but are the same regardless and can be served in either format
         """
-        params = kwargs
-        params['url'] = url
-
-        # Only support JSON format
-        params['format'] = 'json'
-
-        request_url = self.get_request_url(**params)
+        request_url = self.get_resource_url(url, **kwargs)
         logger.info('Obtaining OEmbed resource at %s' % request_url)
 
-        cached, primed = cache.get_or_prime(request_url, primer=Resource(params['url']))
+        cached, primed = cache.get_or_prime(request_url, primer=Resource(url))
 
         if primed or cached.is_stale:
             # Prevent many tasks being issued
@@ -84,11 +124,42 @@ class Provider(object):
 
         return cached
 
+    def canonicalize(self, url):
+        """
+        Returns the canonical form of a content URL, so that all URLs of the same
+        content are requested and cached once. The default applies the built-in rules
+        of :func:`monocle.util.canonical_content_url`. Providers may override this
+        with their own rules. It must return canonical URLs unchanged.
+
+        :param string url: Content URL
+        :returns: Canonical content URL
+        """
+        return canonical_content_url(url)
+
+    def get_resource_url(self, url, **kwargs):
+        """
+        Constructs the endpoint request URL that identifies the resource for a content
+        URL. This is also the key under which the resource is cached. The content URL
+        is canonicalized first (see :func:`canonicalize`), so equivalent URLs share a
+        resource. Resources are still rendered with the URL as requested.
+
+        :param string url: Requested rich content URL
+        :param kwargs: Optional arguments along with this request.
+                       Currently only ``maxwidth`` and ``maxheight`` supported.
+        :returns: Escaped endpoint url
+        """
+        params = dict(kwargs)
+        params['url'] = self.canonicalize(url)
+        params['format'] = self.format
+
+        return self.get_request_url(**params)
+
     def get_request_url(self, **params):
         """
         Constructs a request URL to the provider API endpoint with kwargs
         as URL parameters. Removes maxwidth and maxheight if they are like
-        zero (i.e 0, '0' or None)
+        zero (i.e 0, '0' or None). The URL is canonical (see :func:`monocle.util.canonical_url`),
+        so equivalent requests share a single cache entry
 
         :returns: Escaped endpoint url
         """
@@ -99,7 +170,7 @@ class Provider(object):
             if param in params and params[param] in zeros:
                 del params[param]
 
-        return '%s?%s' % (self.api_endpoint, urlencode(params))
+        return canonical_url('%s?%s' % (self.api_endpoint, urlencode(params)))
 
     @classmethod
     def schemes_to_regex_str(cls, schemes):
@@ -162,18 +233,31 @@ class Provider(object):
             logger.debug('Height exceeds maxheight %s' % maxheight)
             maxdim = (maxdim[0], maxheight)
 
-        dims = getattr(self, 'DIMENSIONS', settings.RESOURCE_DEFAULT_DIMENSIONS)
-        smaller = lambda x, y: x[0] <= y[0] and x[1] <= y[1]
-        valid_sizes = [d for d in dims if smaller(d, maxdim)]
+        nearest = self._dimension_index().nearest(maxdim)
 
-        if valid_sizes:
-            valid_sizes.sort(reverse=True)
-            logger.debug('Nearest allowed size for %s: %s' % (maxdim, valid_sizes))
-            return valid_sizes[0]
+        if nearest:
+            logger.debug('Nearest allowed size for %s: %s' % (maxdim, nearest))
+            return nearest
         else:
             logger.debug('No appropriate size found. Returning default %s' % (maxdim,))
             return maxdim
 
+    def _dimension_index(self):
+        """
+        Returns the :class:`_DimensionIndex` of allowed sizes. It is built once per
+        provider class and rebuilt only if ``DIMENSIONS`` is replaced. Changing the
+        list in place is not picked up.
+        """
+        dims = getattr(self, 'DIMENSIONS', settings.RESOURCE_DEFAULT_DIMENSIONS)
+        cls = self.__class__
+        index = cls.__dict__.get('_dimensions')
+
+        if index is None or index.dims is not dims:
+            index = _DimensionIndex(dims)
+            cls._dimensions = index
+
+        return index
+
 
 class InternalProvider(Provider):
     """
@@ -185,6 +269,7 @@ class InternalProvider(Provider):
     Properly implemented providers should follow a basic contract
 
     * Implement :func:`get_object` as a means to convert a URL to an instance
+    * Optionally implement :func:`get_objects` to convert many URLs at once
     * Define attribute ``DIMENSIONS`` of integer two-tuples
     * Define attribute ``html_template`` that is a str template path used to render
       object specific HTML for embedding
@@ -192,6 +277,8 @@ class InternalProvider(Provider):
     * Define attribute ``resource_type`` that is a valid OEmbed type
     * Define attributes ``DEFAULT_WIDTH`` and ``DEFAULT_HEIGHT`` as fallback
       dimensions in case oembed consumers do not specify maximum dimensions
+    * Optionally define attribute ``LAZY_ATTRIBUTES`` listing optional resource
+      attributes that are expensive, so they are only computed if actually used
 
     Providers should also define properties or methods the correspond
     to names of OEmbed resource attributes. These are listed in :mod:`monocle.settings`
@@ -207,12 +294,16 @@ class InternalProvider(Provider):
     # A list of tuples of valid size dimensions: (width, height)
     DIMENSIONS = []
 
+    # Names of optional resource attributes that are computed only if used
+    LAZY_ATTRIBUTES = ()
+
     html_template = None
     expose = settings.EXPOSE_LOCAL_PROVIDERS
     api_endpoint = 'http://localhost/'
     _internal = True
 
-    # Internal providers are specific instances
+    # Internal providers are specific instances. Request parameters are only ever set
+    # on the copy made for a request by get_resource, never on a shared instance
     _params = {}
 
     @classmethod
@@ -229,6 +320,30 @@ class InternalProvider(Provider):
         """
         raise NotImplementedError
 
+    @classmethod
+    def get_objects(cls, urls):
+        """
+        Converts many URLs at once, as :func:`get_object` does for one. This is used
+        by consumers for all URLs of a document, so implementers may override it to
+        load all objects with a single query (i.e. with ``in_bulk``). The default
+        calls :func:`get_object` for each URL, so a URL that fails to convert does
+        not affect the others.
+
+        :param list urls: URLs to convert to provider instances
+        :returns: Dict of provider instances keyed by URL. URLs without a suitable
+                  provider may be missing or None
+        """
+        objects = {}
+
+        for url in urls:
+            try:
+                objects[url] = cls.get_object(url)
+            except Exception:
+                logger.exception('InternalProvider %s get_object failed for %s' % (cls, url))
+                objects[url] = None
+
+        return objects
+
     @classmethod
     def match(cls, url):
         if cls.url_schemes:
@@ -247,7 +362,7 @@ class InternalProvider(Provider):
         if not self.html_template:
             return ''
 
-        template = get_template(self.html_template)
+        template = _get_template(self.html_template)
         return template.render(Context(data))
 
     @property
@@ -258,15 +373,28 @@ class InternalProvider(Provider):
     def maxheight(self):
         return self._params.get('maxheight', None) or getattr(self, 'DEFAULT_HEIGHT', None)
 
+    @property
+    def size(self):
+        """
+        The nearest allowed size (width, height) for the requested maximum. Both
+        ``width`` and ``height`` are served from this. It is computed once per build
+        """
+        memo = self.__dict__.get('_attributes')
+
+        if memo is None:
+            return self.nearest_allowed_size(self.maxwidth, self.maxheight)
+
+        if 'size' not in memo:
+            memo['size'] = self.nearest_allowed_size(self.maxwidth, self.maxheight)
+        return memo['size']
+
     @property
     def width(self):
-        # TODO: Is this the right way to handle this? Expensive?
-        return self.nearest_allowed_size(self.maxwidth, self.maxheight)[0]
+        return self.size[0]
 
     @property
     def height(self):
-        # TODO: Is this the right way to handle this? Expensive?
-        return self.nearest_allowed_size(self.maxwidth, self.maxheight)[1]
+        return self.size[1]
 
     def _data_attribute(self, name, required=False):
         """
@@ -290,11 +418,22 @@ class InternalProvider(Provider):
                 @property
                 def height(self):
                     return 100
+
+        Values are memoized while a resource is built, so attributes that are read
+        again, i.e. by the template rendering ``html``, are computed once per build.
         """
-        attr = getattr(self, name, None)
+        memo = self.__dict__.get('_attributes')
+
+        if memo is not None and name in memo:
+            attr = memo[name]
+        else:
+            attr = getattr(self, name, None)
 
-        if callable(attr):
-            attr = attr()
+            if callable(attr):
+                attr = attr()
+
+            if memo is not None:
+                memo[name] = attr
 
         if attr is None and required:
             raise NotImplementedError
@@ -315,14 +454,20 @@ class InternalProvider(Provider):
     def _build_resource(self, **kwargs):
         """
         Constructs a valid JSON resource response complying to OEmbed spec based
-        on the attributes exposed by the provider
+        on the attributes exposed by the provider. Optional attributes listed in
+        ``LAZY_ATTRIBUTES`` are left for the resource to compute if they are used.
+        This is called on the copy of the provider made by :func:`get_resource`
         """
+        # Attribute values are memoized for this build
+        self._attributes = {}
+
         # These are always required
         url = kwargs.get('url')
         data = {
             'type': self.resource_type,
             'version': '1.0'
         }
+        lazy = {}
 
         # Apply required attributes by resource type
         for attr in settings.RESOURCE_REQUIRED_ATTRS.get(self.resource_type, []):
@@ -330,33 +475,47 @@ class InternalProvider(Provider):
 
         # Optional attributes
         for attr in settings.RESOURCE_OPTIONAL_ATTRS:
-            data[attr] = self._data_attribute(attr)
+            if attr in self.LAZY_ATTRIBUTES:
+                lazy[attr] = partial(self._data_attribute, attr)
+            else:
+                data[attr] = self._data_attribute(attr)
+
+        resource = Resource(url, data, lazy=lazy)
 
         # Raise a warning if width/height exceed maximum requested and scale
         # TODO: I'm still not convinced this is the right way to handle this
         if settings.RESOURCE_CHECK_INTERNAL_SIZE:
-            if 'width' in data and 'height' in data:
-                self._check_dimension(data['width'], data['height'],
+            if 'width' in resource and 'height' in resource:
+                self._check_dimension(resource['width'], resource['height'],
                                       maxwidth=kwargs.get('maxwidth'),
                                       maxheight=kwargs.get('maxheight'))
 
-            if 'thumbnail_width' in data and 'thumbnail_height' in data:
-                self._check_dimension(data['thumbnail_width'], data['thumbnail_height'],
+            if 'thumbnail_width' in resource and 'thumbnail_height' in resource:
+                self._check_dimension(resource['thumbnail_width'], resource['thumbnail_height'],
                                       maxwidth=kwargs.get('maxwidth'),
                                       maxheight=kwargs.get('maxheight'),
                                       message='Thumbnail size exceeds allowable dimensions')
 
-        return Resource(url, data)
+        return resource
 
     def get_resource(self, url, **kwargs):
-        self._params = kwargs
-        self._params['url'] = url
+        """
+        Obtains the resource for a URL, built by this provider or cached if
+        ``CACHE_INTERNAL_PROVIDERS`` is set in :mod:`monocle.settings`.
 
+        The resource is built by a shallow copy of this provider that holds the request
+        parameters, so concurrent requests never see each other's parameters and a
+        provider instance can be shared between threads. Implementations should not
+        modify the state of the instance while building resources.
+        """
         # Only support JSON format
-        self._params['format'] = 'json'
+        params = dict(kwargs, url=url, format='json')
+
+        provider = copy.copy(self)
+        provider._params = params
 
         if settings.CACHE_INTERNAL_PROVIDERS:
-            cache_key = self.get_request_url(**self._params)
+            cache_key = self.get_request_url(**dict(params, url=self.canonicalize(url)))
             logger.debug('Checking InternalProvider cache for key %s' % cache_key)
             cached, primed = cache.get_or_prime(cache_key, primer=Resource(url))
 
@@ -366,13 +525,13 @@ class InternalProvider(Provider):
                 if cached.is_stale:
                     cache.set(cache_key, cached.refresh())
 
-                cached = self._build_resource(**self._params)
+                cached = provider._build_resource(**params)
                 cache.set(cache_key, cached)
 
             return cached
 
         # No caching, build directly
-        return self._build_resource(**self._params)
+        return provider._build_resource(**params)
 
 
 class ProviderRegistry(object):
@@ -384,9 +543,25 @@ class ProviderRegistry(object):
 
         from monocle.providers import registry
         registry.register(MyProvider)
+
+    Registered providers are kept as an immutable snapshot that is replaced as a whole
+    on any change, so matching never takes a lock and never sees a change half done.
+    Indexes derived from a snapshot, such as compiled URL schemes, are built once per
+    snapshot. Prefork servers should call :func:`warm` before forking so that workers
+    share them.
     """
-    # Separate internal and external providers. Prefer internal first
-    _providers = {'internal': [], 'external': []}
+    # Separate internal and external providers. Prefer internal first. Never modified
+    # in place, only replaced
+    _providers = {'internal': (), 'external': ()}
+
+    # Serializes changes to providers. Readers never take it
+    _lock = threading.RLock()
+
+    # Incremented whenever providers change. Used to invalidate derived indexes
+    _version = 0
+
+    # Whether stored providers have been loaded
+    _populated = False
 
     def __contains__(self, provider):
         """
@@ -403,16 +578,53 @@ class ProviderRegistry(object):
         provider instances. This will run only if the internal cache of external
         providers is empty
         """
+        # Models have post_save/delete signals. We only need to ensure once
+        if self._populated or self._providers['external']:
+            return
+
         # BOO circular import prevention
         from monocle.models import ThirdPartyProvider
 
-        # Models have post_save/delete signals. We only need to ensure once
-        if self._providers['external']:
-            return
+        with self._lock:
+            if self._populated or self._providers['external']:
+                return
 
-        # Populate with things we know about: models - ONLY IF THE DB IS SYNCED
-        if synced(ThirdPartyProvider):
-            self._providers['external'] = list(ThirdPartyProvider.objects.all())
+            # Populate with things we know about: models - ONLY IF THE DB IS SYNCED
+            if synced(ThirdPartyProvider):
+                self._replace('external', ThirdPartyProvider.objects.all())
+                self._populated = True
+
+    def warm(self):
+        """
+        Populates the registry and builds all indexes derived from it up front. Prefork
+        servers should call this before forking, i.e. at the end of ``wsgi.py`` with
+        gunicorn's ``--preload``, so workers share the result rather than each building
+        their own on first use.
+        """
+        self.ensure_populated()
+        self._indexes()
+
+    def _replace(self, type, providers):
+        """
+        Swaps in a new snapshot with the providers of a type replaced. Callers must
+        hold the lock
+        """
+        snapshot = dict(self._providers)
+        snapshot[type] = tuple(providers)
+
+        # Registries share the class snapshot until they are cleared
+        if '_providers' in self.__dict__:
+            self._providers = snapshot
+        else:
+            ProviderRegistry._providers = snapshot
+
+        self._changed()
+
+    def _changed(self):
+        """
+        Marks the registry as modified so that any derived index is rebuilt
+        """
+        ProviderRegistry._version += 1
 
     def _provider_type(self, provider):
         """
@@ -428,7 +640,10 @@ class ProviderRegistry(object):
         """
         Clears the internal provider registry
         """
-        self._providers = {'internal': [], 'external': []}
+        with self._lock:
+            self._providers = {'internal': (), 'external': ()}
+            self._populated = False
+            self._changed()
 
     def update(self, provider):
         """
@@ -439,15 +654,20 @@ class ProviderRegistry(object):
         """
         type = self._provider_type(provider)
 
-        try:
-            idx = self._providers[type].index(provider)
-        except ValueError:
-            # Provider not in the registry
-            self._providers[type].append(provider)
-            logger.debug('Adding provider %s to %s registry' % (provider, type))
-        else:
-            self._providers[type][idx] = provider
-            logger.debug('Updating provider %s to %s registry' % (provider, type))
+        with self._lock:
+            providers = list(self._providers[type])
+
+            try:
+                idx = providers.index(provider)
+            except ValueError:
+                # Provider not in the registry
+                providers.append(provider)
+                logger.debug('Adding provider %s to %s registry' % (provider, type))
+            else:
+                providers[idx] = provider
+                logger.debug('Updating provider %s to %s registry' % (provider, type))
+
+            self._replace(type, providers)
 
     def unregister(self, provider):
         """
@@ -458,11 +678,140 @@ class ProviderRegistry(object):
         type = self._provider_type(provider)
         logger.debug('Removing provider %s to %s registry' % (provider, type))
 
-        try:
-            self._providers[type].remove(provider)
-        except ValueError:
-            # Provider not in the list
-            pass
+        with self._lock:
+            providers = list(self._providers[type])
+
+            try:
+                providers.remove(provider)
+            except ValueError:
+                # Provider not in the list
+                pass
+            else:
+                self._replace(type, providers)
+
+    def _indexes(self):
+        """
+        Returns a two-tuple (matchers, host index) for the current snapshot of
+        providers, building it only once per snapshot. Matchers are tuples of
+        (provider, match function) keyed by provider type (see :func:`_matcher`).
+        See :func:`_build_host_index` for the host index.
+        """
+        providers = self._providers
+        indexes = getattr(self, '_index', None)
+
+        if indexes is None or indexes[0] is not providers:
+            matchers = dict((type, tuple((provider, self._matcher(provider))
+                                         for provider in providers[type]))
+                            for type in ('internal', 'external'))
+            indexes = self._index = (providers, matchers, self._build_host_index(matchers))
+
+        return indexes[1], indexes[2]
+
+    def _overrides_match(self, provider):
+        """
+        Whether a provider implements its own ``match`` rather than matching its URL schemes
+        """
+        default = InternalProvider.match if isinstance(provider, type) else Provider.match
+        return getattr(provider.match, 'im_func', None) is not default.im_func
+
+    def _matcher(self, provider):
+        """
+        Returns a function that matches URLs for a provider, or None if it can't match
+        any. This is the provider's own ``match`` if it overrides it, otherwise the
+        match of its compiled URL schemes
+        """
+        if self._overrides_match(provider):
+            return provider.match
+
+        regex = self._compile_schemes(provider)
+        return regex.match if regex is not None else None
+
+    def _compile_schemes(self, provider):
+        """
+        Compiles the URL schemes of a provider into a single regex, or None if
+        it has none
+        """
+        if not provider.url_schemes:
+            logger.warning('No URL schemes defined for provider %s' % provider)
+            return None
+
+        return re.compile(provider.schemes_to_regex_str(provider.url_schemes), re.I)
+
+    def _build_host_index(self, matchers):
+        """
+        Builds an index of the hosts of all provider URL schemes. This is a three-tuple
+        of a set of exact hosts, a tuple of host suffixes for schemes with a leading
+        wildcard (i.e. ``*.flickr.com``) and a tuple of match functions of providers
+        that cannot be indexed this way. These are providers with a scheme host that
+        has any other wildcard (i.e. ``*yfrog.*``) or that implement their own ``match``.
+
+        :param dict matchers: Matchers of a snapshot of providers (see :func:`_indexes`)
+        """
+        hosts, suffixes, fallback = set(), set(), []
+
+        for type in ('internal', 'external'):
+            for provider, matcher in matchers[type]:
+                if matcher is None:
+                    continue
+
+                if self._overrides_match(provider):
+                    logger.debug('Provider %s matches URLs its own way' % provider)
+                    fallback.append(matcher)
+                    continue
+
+                schemes = dict((scheme, urlparse(scheme.lower()).netloc.split(':')[0])
+                               for scheme in provider.url_schemes)
+                unindexable = [scheme for scheme, host in schemes.items()
+                               if not host or '*' in host.lstrip('*')]
+
+                if unindexable:
+                    logger.debug('URL schemes %s cannot be indexed by host' % unindexable)
+                    fallback.append(matcher)
+                    continue
+
+                for host in schemes.values():
+                    if host.startswith('*'):
+                        suffixes.add(host.lstrip('*'))
+                    else:
+                        hosts.add(host)
+
+        return hosts, tuple(suffixes), tuple(fallback)
+
+    def may_match(self, url):
+        """
+        A cheap check of whether any provider could possibly match a URL based only
+        on its host. This never calls ``get_object``, so it is suitable for
+        pre-filtering content before doing any real matching. Only providers whose
+        URL schemes cannot be indexed by host are matched against the URL itself.
+
+        :param string url: URL to check
+        :returns: False if no provider can match the URL, True otherwise
+        """
+        hosts, suffixes, fallback = self._indexes()[1]
+        host = urlparse(url).hostname or ''
+
+        if host in hosts or host.endswith(suffixes):
+            return True
+
+        for matcher in fallback:
+            if matcher(url):
+                return True
+
+        return False
+
+    def exposed(self):
+        """
+        Lists all active providers that are exposed via :mod:`monocle.views`,
+        internal providers first
+
+        :returns: A list of provider instances and :class:`InternalProvider` subclasses
+        """
+        self.ensure_populated()
+        providers = self._providers
+
+        return [provider for type in ('internal', 'external')
+                for provider in providers[type]
+                if provider.expose and getattr(provider, 'is_active', True)]
 
     def match(self, url):
         """
@@ -475,6 +824,48 @@ class ProviderRegistry(object):
         logger.debug('Locating provider match for %s' % url)
         return self.match_type(url, 'internal') or self.match_type(url, 'external')
 
+    def match_many(self, urls):
+        """
+        Locates providers for many URLs at once, exactly as :func:`match` would for
+        each. Specific instances of internal providers are obtained with a single
+        :func:`InternalProvider.get_objects` call per provider rather than a
+        :func:`InternalProvider.get_object` call per URL.
+
+        :param list urls: URLs to match providers against
+        :returns: Dict of provider instances or None keyed by URL
+        """
+        matchers = self._indexes()[0]
+        matched = {}
+        internal = {}
+
+        for url in set(urls):
+            matched[url] = None
+
+            for provider, matcher in matchers['internal']:
+                if matcher is not None and matcher(url):
+                    internal.setdefault(provider, []).append(url)
+                    break
+
+        for provider, provider_urls in internal.items():
+            try:
+                objects = provider.get_objects(provider_urls)
+            except Exception:
+                # Don't let one bad URL drop every other URL of the batch
+                logger.exception('InternalProvider %s get_objects failed' % provider)
+                objects = dict((url, self._get_object(provider, url)) for url in provider_urls)
+
+            for url in provider_urls:
+                instance = objects.get(url)
+                if getattr(instance, 'is_active', True):
+                    matched[url] = instance
+
+        # Anything without an internal provider instance may still be external
+        for url, provider in matched.items():
+            if provider is None:
+                matched[url] = self._match_matchers(url, matchers['external'])
+
+        return matched
+
     def match_type(self, url, type):
         """
         Searches the internal provider registry for a matching
@@ -484,26 +875,40 @@ class ProviderRegistry(object):
         :param string type: The type of provider to check (either 'internal' or 'external')
         :returns: A provider instance or None if no match is found
         """
+        return self._match_matchers(url, self._indexes()[0][type])
+
+    def _match_matchers(self, url, matchers):
+        """
+        Returns the first provider of matchers (see :func:`_indexes`) that matches
+        the URL, or its specific instance if it is internal
+        """
         matched = None
 
-        for provider in self._providers[type]:
-            if provider.match(url):
+        for provider, matcher in matchers:
+            if matcher is not None and matcher(url):
                 matched = provider
                 break
 
         # If the match is internal, obtain specific instance
         if matched and hasattr(matched, 'get_object'):
-            try:
-                matched = matched.get_object(url)
-            except Exception:
-                logger.exception('InternalProvider %s get_object failed' % matched)
-                matched = None
+            matched = self._get_object(matched, url)
 
         if getattr(matched, 'is_active', True):
             return matched
         else:
             return None
 
+    def _get_object(self, provider, url):
+        """
+        Returns the specific instance of an internal provider for the URL, or None
+        if obtaining it fails
+        """
+        try:
+            return provider.get_object(url)
+        except Exception:
+            logger.exception('InternalProvider %s get_object failed' % provider)
+            return None
+
     def register(self, provider):
         """
         Adds an internal provider class to the registry.
@@ -521,8 +926,89 @@ class ProviderRegistry(object):
                 raise InvalidProvider('Object %s is not a valid Provider type' % provider)
 
         type = self._provider_type(provider)
-        self._providers[type].append(provider)
+
+        with self._lock:
+            self._replace(type, self._providers[type] + (provider,))
+
         logger.debug('Adding provider %s to %s registry' % (provider, type))
 
 
 registry = ProviderRegistry()
+
+
+def fetch_resources(request_urls, timeout):
+    """
+    Synchronously fetches external resources that are not yet in cache. Requests are
+    made concurrently by at most ``FETCH_MAX_WORKERS`` threads, and this waits no longer
+    than ``timeout`` seconds overall for all of them. Any request that is already cached
+    (or primed by someone else) is left alone. Requests that failed or were not started
+    by the deadline are handed off to the asynchronous task as :func:`Provider.get_resource`
+    would have done. Requests still in flight at the deadline are not waited on, but
+    still cache their resource once done, or hand off to the task if they fail.
+
+    :param list request_urls: Endpoint request URLs as from :func:`Provider.get_resource_url`
+    :param float timeout: Overall deadline in seconds
+    :returns: List of request URLs that were fetched and cached in time
+    """
+    deadline = time.time() + timeout
+    lock = threading.Lock()
+    queued = []
+    fetched = []
+    failed = []
+
+    # Whether the caller still waits for results. Once not, workers stop taking
+    # requests and hand off their own failures
+    state = {'waiting': True}
+
+    for request_url in set(request_urls):
+        # Priming claims the request so that nothing else schedules it
+        cached, primed = cache.get_or_prime(request_url, primer=Resource(extract_content_url(request_url)))
+        if primed:
+            queued.append(request_url)
+
+    def _schedule(request_url):
+        request_external_oembed.apply_async((request_url,))
+        logger.info('Scheduled external request for OEmbed resource %s' % request_url)
+
+    def _work():
+        while True:
+            with lock:
+                if not queued or not state['waiting']:
+                    return
+                request_url = queued.pop()
+
+            try:
+                resource = request_resource(request_url)
+            except Exception:
+                logger.exception('Synchronous request for OEmbed resource %s failed' % request_url)
+                with lock:
+                    late = not state['waiting']
+                    if not late:
+                        failed.append(request_url)
+                if late:
+                    _schedule(request_url)
+            else:
+                cache.set(request_url, resource)
+                with lock:
+                    fetched.append(request_url)
+                resource_updated.send(sender=fetch_resources, key=request_url, resource=resource)
+
+    workers = []
+    for i in xrange(min(settings.FETCH_MAX_WORKERS, len(queued))):
+        worker = threading.Thread(target=_work)
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+
+    for worker in workers:
+        worker.join(max(0, deadline - time.time()))
+
+    with lock:
+        state['waiting'] = False
+        handoff = failed + queued
+        fetched = list(fetched)
+
+    for request_url in handoff:
+        _schedule(request_url)
+
+    return fetched
@@ -1,7 +1,12 @@
 import json
 import os
+import re
 import time
 
+from xml.etree import ElementTree
+from xml.parsers.expat import ExpatError
+from xml.sax.saxutils import escape
+
 from django.template import Context
 from django.template.loader import get_template
 from django.utils.safestring import mark_safe
@@ -9,31 +14,128 @@ from django.utils.safestring import mark_safe
 from monocle.settings import settings
 
 
+# Compiled resource templates keyed by template name
+_templates = {}
+
+
+def _get_template(template_name):
+    """
+    Returns a compiled template, loading it only the first time it is requested
+    """
+    try:
+        return _templates[template_name]
+    except KeyError:
+        template = _templates[template_name] = get_template(template_name)
+        return template
+
+
+# Valid XML element names for resource attributes
+_xml_name = re.compile(r'^[A-Za-z_][\w.-]*$')
+
+# Resource attributes that are integers
+_xml_integers = ('width', 'height', 'thumbnail_width', 'thumbnail_height', 'cache_age')
+
+
+def _forbid_doctype(*args):
+    raise ValueError('Invalid XML OEmbed response: document type declarations are not allowed')
+
+
+def parse_xml(content):
+    """
+    Parses an XML OEmbed response into a dict of resource data. Integer attributes
+    are converted as they would be in JSON. Responses come from untrusted providers,
+    so any document type declaration is rejected, and with it entity expansion and
+    external entities.
+
+    :param string content: XML response
+    :returns: dict
+    :raises: ``ValueError`` if content is not a valid XML OEmbed response
+    """
+    parser = ElementTree.XMLParser()
+    parser.parser.StartDoctypeDeclHandler = _forbid_doctype
+    parser.parser.EntityDeclHandler = _forbid_doctype
+
+    try:
+        parser.feed(content)
+        root = parser.close()
+    except (ExpatError, SyntaxError), e:
+        raise ValueError('Invalid XML OEmbed response: %s' % e)
+
+    if root.tag != 'oembed':
+        raise ValueError('Invalid XML OEmbed response: root element is %s' % root.tag)
+
+    data = {}
+
+    for element in root:
+        value = element.text or ''
+        if element.tag in _xml_integers and value.strip().isdigit():
+            value = int(value)
+        data[element.tag] = value
+
+    return data
+
+
 class Resource(object):
     """
-    A JSON compatible response from an OEmbed provider
+    A JSON compatible response from an OEmbed provider. Resources can be
+    serialized as JSON or XML. Serialized forms are kept and stored in cache along
+    with the resource, so they are not serialized again on each request.
     """
 
-    def __init__(self, url, data=None):
+    def __init__(self, url, data=None, lazy=None):
         self.url = url
         self.created = time.time()
         self._data = data or {}
 
+        # Callables of values that are only computed once needed. See resolve
+        if lazy:
+            self._lazy = dict(lazy)
+
     def __getitem__(self, key):
         if key == 'cache_age':
             return self.ttl
+        self.resolve(key)
         return self._data.get(key, '')
 
     def __setitem__(self, key, value):
+        self.__dict__.get('_lazy', {}).pop(key, None)
+
         if key == 'cache_age':
             self.ttl = value
         else:
             self._data[key] = value
+            self._serialized = None
+
+    def __getstate__(self):
+        # Lazy values can't be pickled. Serialize before being cached so that every
+        # reader benefits
+        self.resolve()
+        if self.is_valid:
+            self.json
+            self.xml
+        return self.__dict__
 
     def __contains__(self, key):
-        return key in self._data
+        return key in self._data or key in self.__dict__.get('_lazy', ())
 
-    def render(self):
+    def resolve(self, key=None):
+        """
+        Computes values of data that were given as lazy callables, so that they are
+        only computed if needed. Values are computed once and then kept as regular data.
+
+        :param string key: Key of the value to compute. If None, all are computed
+        """
+        lazy = self.__dict__.get('_lazy')
+        if not lazy:
+            return
+
+        for key in ([key] if key is not None else lazy.keys()):
+            func = lazy.pop(key, None)
+            if func is not None:
+                self._data[key] = func()
+                self._serialized = None
+
+    def render(self, url=None):
         """
         Renders this resource to the template corresponding to this resource type.
         The template is rendered with variables ``url`` and ``resource`` that represent
@@ -43,18 +145,22 @@ class Resource(object):
         requested URL is returned unless ``RESOURCE_URLIZE_INVALID`` is configured
         in :mod:`monocle.settings`. If so, then the original URL is returned hyperlinked
 
+        :param string url: Requested URL, which may differ from the canonical URL of
+                           a resource shared by equivalent URLs. Defaults to its own
         :returns: Rendered oembed content
         """
+        url = url or self.url
+
         if not self.is_valid:
             if settings.RESOURCE_URLIZE_INVALID:
                 template_name = 'monocle/link.html'
             else:
-                return self.url
+                return url
         else:
             template_name = os.path.join('monocle', '%s.html' % self._data['type'])
 
-        template = get_template(template_name)
-        return mark_safe(template.render(Context({'url': self.url, 'resource': self})))
+        template = _get_template(template_name)
+        return mark_safe(template.render(Context({'url': url, 'resource': self})))
 
     @property
     def is_valid(self):
@@ -100,12 +206,55 @@ class Resource(object):
         self.created = time.time()
         return self
 
+    @property
+    def data(self):
+        """
+        A dict of resource data without any empty or null keys
+        """
+        self.resolve()
+        return dict([(k, v) for k, v in self._data.items() if v])
+
+    def _serialize(self, format, serializer):
+        """
+        Returns the data serialized in a format, serializing only if data has changed
+        since the last time. Replacing data entirely also counts as a change
+        """
+        serialized = self.__dict__.get('_serialized')
+
+        if serialized is None or serialized[0] is not self._data:
+            serialized = self._serialized = (self._data, {})
+
+        try:
+            return serialized[1][format]
+        except KeyError:
+            value = serialized[1][format] = serializer()
+            return value
+
     @property
     def json(self):
         """
         A JSON string without any empty or null keys
         """
-        return json.dumps(dict([(k, v) for k, v in self._data.items() if v]))
+        return self._serialize('json', lambda: json.dumps(self.data))
+
+    @property
+    def xml(self):
+        """
+        An XML string as per the OEmbed spec without any empty or null keys
+        """
+        return self._serialize('xml', self._to_xml)
+
+    def _to_xml(self):
+        parts = ['<?xml version="1.0" encoding="utf-8" standalone="yes"?>\n<oembed>']
+
+        for key, value in sorted(self.data.items()):
+            # Attributes that can't be represented as elements are left out
+            if not _xml_name.match(key) or isinstance(value, (dict, list, tuple)):
+                continue
+            parts.append(u'<%s>%s</%s>' % (key, escape(unicode(value)), key))
+
+        parts.append('</oembed>')
+        return u''.join(parts).encode('utf-8')
 
     def get_ttl(self):
         """
@@ -118,6 +267,8 @@ class Resource(object):
 
         :returns: TTL in seconds
         """
+        self.resolve('cache_age')
+
         try:
             return max(settings.RESOURCE_MIN_TTL,
                        int(self._data.get('cache_age', settings.RESOURCE_DEFAULT_TTL)))
@@ -135,5 +286,6 @@ class Resource(object):
         except (ValueError, TypeError):
             value = settings.RESOURCE_DEFAULT_TTL
         self._data['cache_age'] = value
+        self._serialized = None
 
     ttl = property(get_ttl, set_ttl)
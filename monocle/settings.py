@@ -7,12 +7,32 @@ instance of :class:`Settings`::
 from django.conf import settings as _settings
 
 
+def _setting_changed_signal():
+    """
+    Returns Django's ``setting_changed`` signal, or None on versions without it
+    """
+    try:
+        from django.core.signals import setting_changed
+    except ImportError:
+        try:
+            # Only sent by the test utilities before it moved to django.core
+            from django.test.signals import setting_changed
+        except ImportError:
+            return None
+    return setting_changed
+
+
 class Settings(object):
     """
-    Django settings proxy used by monocle in such a way that value retrieval
-    is performed on-demand. Most settings are entirely configurable via
+    Django settings proxy used by monocle. Most settings are entirely configurable via
     ``DJANGO_SETTINGS_MODULE`` and should be prefixed with ``MONOCLE_``. For example
     ``RESOURCE_DEFAULT_TTL`` can be customized with setting ``MONOCLE_RESOURCE_DEFAULT_TTL``.
+
+    All settings are resolved together on first access and kept as plain attributes,
+    so reading a setting costs no more than any attribute lookup. They are resolved
+    again after Django's ``setting_changed`` signal, i.e. with ``override_settings``
+    in tests, where Django sends it. Changing Django settings any other way at runtime
+    is not picked up unless :func:`resolve` is called.
     """
     _SETTINGS_PREFIX = 'MONOCLE_'
     _DEFAULTS = {
@@ -40,6 +60,36 @@ class Settings(object):
         # Default timeout in seconds for external HTTP requests
         'HTTP_TIMEOUT': 3,
 
+        # Overall time in seconds template tags wait for uncached external resources.
+        # None will not wait at all and leaves fetching to async tasks
+        'CONSUMER_SYNC_TIMEOUT': None,
+
+        # Maximum number of concurrent requests when fetching uncached external resources
+        # synchronously. Requests not started in time are left to async tasks
+        'FETCH_MAX_WORKERS': 8,
+
+        # Use the tokenizing html consumer rather than building a BeautifulSoup tree
+        'CONSUMER_STREAM_HTML': False,
+
+        # Should output of the oembed template tags and filters be cached
+        'CACHE_RENDERED_CONTENT': False,
+
+        # Should OEmbed fields prefetch in a celery task rather than on save
+        'PREFETCH_ASYNC': False,
+
+        # Maximum number of URLs accepted by one batch provider endpoint request
+        'BATCH_MAX_URLS': 50,
+
+        # API keys required by the provider endpoints. None leaves them open to anyone
+        'API_KEYS': None,
+
+        # Requests allowed per client (API key or address) in THROTTLE_PERIOD seconds,
+        # which is also the allowed burst. None does not throttle at all
+        'THROTTLE_RATE': None,
+
+        # Period in seconds over which THROTTLE_RATE requests are allowed
+        'THROTTLE_PERIOD': 60,
+
         # Celery queue for monocle tasks
         'TASK_QUEUE': 'monocle',
 
@@ -49,92 +99,117 @@ class Settings(object):
         # Max number of retries for async external request tasks
         'TASK_EXTERNAL_MAX_RETRIES': 3,
 
+        # Delay between retries for rendering tasks of rows that are not yet committed
+        'TASK_RENDER_RETRY_DELAY': 5,
+
+        # Max number of retries for rendering tasks of rows that are not yet committed
+        'TASK_RENDER_MAX_RETRIES': 3,
+
         # Prefix string for monocle cached objects
         'CACHE_KEY_PREFIX': 'MONOCLE',
 
         # Default cache age
         'CACHE_AGE': 60*60*24*30,
 
+        # Maximum number of dependents recorded per cached object until it changes
+        'CACHE_MAX_DEPENDENTS': 1000,
+
         # Default user-agent for requests to external providers
         'USER_AGENT': 'Mozilla/5.0',
     }
 
+    _connected = False
+
     def __getattr__(self, attr):
         """
-        Django settings access with fallback to preconfigured defaults.
+        Django settings access with fallback to preconfigured defaults. This is only
+        called for settings that are not yet resolved.
         """
         if attr in self._DEFAULTS:
-            django_key = '%s%s' % (self._SETTINGS_PREFIX, attr)
-            return getattr(_settings, django_key, self._DEFAULTS[attr])
+            self.resolve()
+            return self.__dict__[attr]
         else:
             raise AttributeError('%s is not a valid setting' % attr)
 
-    @property
-    def RESOURCE_TYPES(self):
+    def resolve(self):
         """
-        Valid OEmbed Resource Types. This is a tuple of the strings
+        Resolves all settings from Django settings or defaults at once
+        """
+        if not self._connected:
+            setting_changed = _setting_changed_signal()
+            if setting_changed is not None:
+                setting_changed.connect(self._setting_changed)
+            self._connected = True
 
-        * link
-        * photo
-        * rich
-        * video
+        for attr, default in self._DEFAULTS.items():
+            django_key = '%s%s' % (self._SETTINGS_PREFIX, attr)
+            self.__dict__[attr] = getattr(_settings, django_key, default)
 
-        .. note::
-           This settings is **NOT** configurable
-        """
-        return ('link', 'photo', 'rich', 'video')
+    def _setting_changed(self, sender, setting, **kwargs):
+        """Setting changed signal callback"""
+        if setting.startswith(self._SETTINGS_PREFIX):
+            self.resolve()
 
-    @property
-    def RESOURCE_REQUIRED_ATTRS(self):
-        """
-        Resource attributes that are required by resource type. Resources
-        of type `link` require no additional attributes. Others do:
+    RESOURCE_TYPES = ('link', 'photo', 'rich', 'video')
+    """
+    Valid OEmbed Resource Types. This is a tuple of the strings
 
-        * ``photo`` types
+    * link
+    * photo
+    * rich
+    * video
 
-            * ``url``
-            * ``width``
-            * ``height``
+    .. note::
+       This settings is **NOT** configurable
+    """
 
-        * ``rich`` and ``video`` types
+    RESOURCE_REQUIRED_ATTRS = {
+        'link': (),
+        'photo': ('url', 'width', 'height'),
+        'rich': ('html', 'width', 'height'),
+        'video': ('html', 'width', 'height')
+    }
+    """
+    Resource attributes that are required by resource type. Resources
+    of type `link` require no additional attributes. Others do:
 
-            * ``html``
-            * ``width``
-            * ``height``
+    * ``photo`` types
 
-        .. note::
-           This settings is **NOT** configurable
-        """
-        return {
-            'link': (),
-            'photo': ('url', 'width', 'height'),
-            'rich': ('html', 'width', 'height'),
-            'video': ('html', 'width', 'height')
-        }
-
-    @property
-    def RESOURCE_OPTIONAL_ATTRS(self):
-        """
-        Full list of OEmbed resource attributes that are considered optional as
-        per the `OEmbed Spec <http://oembed.com>`_.
-
-        * ``title``
-        * ``author_name``
-        * ``author_url``
-        * ``cache_age``
-        * ``provider_name``
-        * ``provider_url``
-        * ``thumbnail_url``
-        * ``thumbnail_height``
-        * ``thumbnail_width``
-
-        .. note::
-           This settings is **NOT** configurable
-        """
-        return (
-            'title', 'author_name', 'author_url', 'cache_age', 'provider_name',
-            'provider_url', 'thumbnail_url', 'thumbnail_width', 'thumbnail_height'
-        )
+        * ``url``
+        * ``width``
+        * ``height``
+
+    * ``rich`` and ``video`` types
+
+        * ``html``
+        * ``width``
+        * ``height``
+
+    .. note::
+       This settings is **NOT** configurable
+    """
+
+    RESOURCE_OPTIONAL_ATTRS = (
+        'title', 'author_name', 'author_url', 'cache_age', 'provider_name',
+        'provider_url', 'thumbnail_url', 'thumbnail_width', 'thumbnail_height'
+    )
+    """
+    Full list of OEmbed resource attributes that are considered optional as
+    per the `OEmbed Spec <http://oembed.com>`_.
+
+    * ``title``
+    * ``author_name``
+    * ``author_url``
+    * ``cache_age``
+    * ``provider_name``
+    * ``provider_url``
+    * ``thumbnail_url``
+    * ``thumbnail_height``
+    * ``thumbnail_width``
+
+    .. note::
+       This settings is **NOT** configurable
+    """
 
 
 settings = Settings()
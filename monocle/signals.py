@@ -5,7 +5,18 @@ signals are exposed
 * ``cache_miss`` - sent when a request for cached resource returns None
 * ``cache_hit`` - sent when a request for cached resource returns not None
 * ``pre_consume`` - sent on request to consume content, prior to enrichment
-* ``post_consume`` - sent before returning enriched content from consumption
+* ``post_consume`` - sent before returning enriched content from consumption,
+  with the time taken in seconds as ``latency``
+* ``resource_rendered`` - sent for each URL a consumer renders, with the ``url``,
+  ``provider``, ``resource`` and the time taken to get and render it as ``latency``
+* ``resource_updated`` - sent when a fetched resource has been stored in cache
+
+Cache signals carry the ``key`` as requested, i.e. a request URL, rather than the
+hashed key it is stored under.
+
+Signals are sent on every request for content, so they are only sent, and any
+payload only computed, if they have receivers connected. Signals with no receivers
+cost a single attribute check.
 """
 from django.dispatch import Signal
 
@@ -17,4 +28,9 @@ cache_hit = Signal(providing_args=['key'])
 
 # Consumer Signals
 pre_consume = Signal()
-post_consume = Signal()
+post_consume = Signal(providing_args=['latency'])
+resource_rendered = Signal(providing_args=['url', 'provider', 'resource', 'latency'])
+
+
+# Resource Signals
+resource_updated = Signal(providing_args=['key', 'resource'])
@@ -2,20 +2,60 @@ import json
 import urllib2
 
 from celery import registry
+from celery.exceptions import MaxRetriesExceededError
 from celery.task import Task
 
 from monocle.cache import cache
-from monocle.resources import Resource
+from monocle.resources import Resource, parse_xml
 from monocle.settings import settings
+from monocle.signals import resource_updated
 from monocle.util import extract_content_url
 
 
+def request_resource(url, timeout=None):
+    """
+    Performs a blocking request to an external provider endpoint URL and returns
+    the response as a :class:`monocle.resources.Resource` of the original content URL.
+    Nothing is cached here; that is left to the caller.
+
+    Responses are parsed as XML if the provider says so with its content type or
+    the request URL contains ``format=xml``, and as JSON otherwise.
+
+    :param string url: Full provider endpoint request URL
+    :param timeout: Socket timeout in seconds. Defaults to ``HTTP_TIMEOUT``
+    :returns: :class:`monocle.resources.Resource`
+    :raises: ``urllib2.HTTPError`` on a non-200 response, ``urllib2.URLError`` if the
+             request could not be made and ``ValueError`` if the response is not valid
+             JSON or XML
+    """
+    # The user agent needs to be spoofed here because some services,
+    # like Vimeo, block requests that look like they came from a bot
+    req = urllib2.Request(url, headers={'User-agent': settings.USER_AGENT})
+    request = urllib2.urlopen(req, timeout=timeout or settings.HTTP_TIMEOUT)
+
+    try:
+        if request.getcode() != 200:
+            raise urllib2.HTTPError(url, request.getcode(), 'Unexpected HTTP status', None, None)
+
+        content_type = request.info().get('Content-Type', '')
+
+        # TODO: Any validation that should happen here?
+        # Do we store invalid data? If invalid do we clear the cache?
+        if 'xml' in content_type or 'format=xml' in url:
+            data = parse_xml(request.read())
+        else:
+            data = json.loads(request.read())
+    finally:
+        request.close()
+
+    return Resource(extract_content_url(url), data)
+
+
 class RequestExternalOEmbedTask(Task):
     """
     A celery task that is meant to perform asynchronous requests to external
-    providers so as not to block anything. Results are explicitly expected
-    to be valid JSON, meaning the URL provided must contain ``format=json``.
-    XML formatted responses are currently unsupported
+    providers so as not to block anything. Results are expected to be valid
+    JSON or XML (see :func:`request_resource`)
     """
     name = 'request_external_oembed'
     ignore_result = True
@@ -26,11 +66,9 @@ class RequestExternalOEmbedTask(Task):
     def run(self, url):
         logger = self.get_logger()
         logger.info('Requesting OEmbed Resource %s' % url)
-        # The user agent needs to be spoofed here because some services,
-        # like Vimeo, block requests that look like they came from a bot
-        req = urllib2.Request(url, headers={'User-agent': settings.USER_AGENT})
+
         try:
-            request = urllib2.urlopen(req, timeout=settings.HTTP_TIMEOUT)
+            resource = request_resource(url)
         except urllib2.HTTPError, e:
             logger.error('Failed to obtain %s : Status %s' % (url, e.code))
         except urllib2.URLError, e:
@@ -39,23 +77,67 @@ class RequestExternalOEmbedTask(Task):
                 self.retry(args=[url], exc=e)
             else:
                 logger.exception('Unexeped error when retrieving OEmbed %s' % url)
+        except ValueError:
+            logger.error('OEmbed response from %s could not be parsed' % url)
         else:
-            if request.getcode() != 200:
-                logger.error('URL %s resulted in unexpected HTTP status' % (url, request.getcode()))
-            else:
-                original_url = extract_content_url(url)
+            # Update the cache with this data
+            cache.set(url, resource)
+            resource_updated.send(sender=self, key=url, resource=resource)
+
+
+class PrefetchOEmbedTask(Task):
+    """
+    A celery task that performs :func:`monocle.consumers.prefetch` of content
+    outside of the process that saved it. This is used by the OEmbed fields
+    when configured to prefetch asynchronously.
+    """
+    name = 'prefetch_oembed'
+    ignore_result = True
+    queue = settings.TASK_QUEUE
+
+    def run(self, content, html=False, sizes=None, previous=None):
+        # BOO circular import prevention
+        from monocle.consumers import prefetch
+
+        self.get_logger().info('Prefetching OEmbed content')
+        prefetch(content, html=html, sizes=sizes, previous=previous)
+
+
+class RenderOEmbedFieldTask(Task):
+    """
+    A celery task that refreshes the stored value of an
+    :class:`monocle.fields.OEmbedRenderedField` for a single row.
 
-                try:
-                    # TODO: Any validation that should happen here?
-                    # Do we store invalid data? If invalid do we clear the cache?
-                    data = json.loads(request.read())
-                except ValueError:
-                    logger.error('OEmbed response from %s contains invalid JSON' % url)
-                else:
-                    # Update the cache with this data
-                    cache.set(url, Resource(original_url, data))
-                finally:
-                    request.close()
+    If the row does not have the given source content, the task is retried. On Django
+    versions without ``transaction.on_commit`` the task is sent before the saving
+    transaction commits, so the row may not be visible yet.
+    """
+    name = 'render_oembed_field'
+    ignore_result = True
+    queue = settings.TASK_QUEUE
+    max_retries = settings.TASK_RENDER_MAX_RETRIES
+    default_retry_delay = settings.TASK_RENDER_RETRY_DELAY
+
+    def run(self, app_label, model_name, pk, field_name, content=None):
+        from django.db.models import get_model
+
+        model = get_model(app_label, model_name)
+        if model is None:
+            self.get_logger().error('Unknown model %s.%s' % (app_label, model_name))
+            return
+
+        self.get_logger().info('Rendering %s.%s.%s for %s' % (app_label, model_name, field_name, pk))
+        if model._meta.get_field(field_name).refresh(pk, content=content) or content is None:
+            return
+
+        try:
+            self.retry(args=[app_label, model_name, pk, field_name, content])
+        except MaxRetriesExceededError:
+            # Most likely the source changed again, which renders on its own
+            self.get_logger().warning('Gave up rendering %s.%s.%s for %s' % (app_label, model_name,
+                                                                            field_name, pk))
 
 
 request_external_oembed = registry.tasks[RequestExternalOEmbedTask.name]
+prefetch_oembed = registry.tasks[PrefetchOEmbedTask.name]
+render_oembed_field = registry.tasks[RenderOEmbedFieldTask.name]
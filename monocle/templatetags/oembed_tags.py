@@ -1,19 +1,89 @@
+import hashlib
+import time
+
 from django import template
 from django.utils.safestring import mark_safe
 
+from monocle.cache import cache
 from monocle.consumers import devour
+from monocle.settings import settings
 
 
 register = template.Library()
 
 
+def _fragment_ttl(resources):
+    """
+    Returns the number of seconds output rendered from resources can be cached, which
+    is the least remaining TTL among them. Returns 0 if there is nothing to cache
+    or anything rendered is not reusable, stale or not yet fetched
+    """
+    if not resources or None in resources:
+        return 0
+
+    now = time.time()
+    ttl = None
+
+    for resource in resources:
+        if not resource.is_valid or resource.is_stale:
+            return 0
+
+        remaining = int(resource.created + resource.ttl - now)
+        ttl = remaining if ttl is None else min(ttl, remaining)
+
+    return max(ttl, 0)
+
+
+def _devour(content, html=True, maxwidth=None, maxheight=None, timeout=None):
+    """
+    Consumes content for the tags and filters. If ``CACHE_RENDERED_CONTENT`` is
+    set in :mod:`monocle.settings`, output is cached by a hash of content, size and
+    html flag until the first of its resources expires or is updated
+    """
+    if not settings.CACHE_RENDERED_CONTENT:
+        return devour(content, html=html, maxwidth=maxwidth, maxheight=maxheight, timeout=timeout)
+
+    raw = content.encode('utf-8') if isinstance(content, unicode) else str(content or '')
+    digest = hashlib.md5('%s:%s:%s:%s:%s' % (html, settings.CONSUMER_STREAM_HTML,
+                                             maxwidth, maxheight, raw)).hexdigest()
+    key = 'fragment:%s' % digest
+
+    rendered = cache.get(key)
+    if rendered is not None:
+        return rendered
+
+    resources = []
+    rendered = devour(content, html=html, maxwidth=maxwidth, maxheight=maxheight,
+                      timeout=timeout, resources=resources)
+
+    # Dependents expire with the output. It is only cached if all of them are recorded
+    ttl = _fragment_ttl(resources)
+    if ttl > 0 and all([cache.add_dependent('fragment:%s' % url, key, timeout=ttl)
+                        for url in set(resource.url for resource in resources)]):
+        cache.set(key, rendered, timeout=ttl)
+
+    return rendered
+
+
 def _args_to_dim(args):
     """Converts args list to width, height if it exists"""
-    if len(args) >= 2:
-        return _value_to_dim(args[1])
+    sizes = [arg for arg in args[1:] if '=' not in arg]
+    if sizes:
+        return _value_to_dim(sizes[0])
     return None, None
 
 
+def _args_to_timeout(args):
+    """Converts a timeout=[seconds] arg to a float if it exists"""
+    for arg in args[1:]:
+        if arg.startswith('timeout='):
+            try:
+                return float(arg.split('=', 1)[1])
+            except ValueError:
+                raise template.TemplateSyntaxError('OEmbed tag timeout must be a number of seconds')
+    return None
+
+
 def _value_to_dim(value):
     """Converts an arg string to width,height"""
     if value:
@@ -32,43 +102,50 @@ def _value_to_dim(value):
 
 class OEmbedNode(template.Node):
 
-    def __init__(self, nodelist, width=None, height=None, html=True):
+    def __init__(self, nodelist, width=None, height=None, html=True, timeout=None):
         self.nodelist = nodelist
         self.width = width
         self.height = height
         self.html = html
+        self.timeout = timeout
 
     def render(self, context):
         content = self.nodelist.render(context)
-        return mark_safe(devour(content, html=self.html, maxwidth=self.width, maxheight=self.height))
+        timeout = settings.CONSUMER_SYNC_TIMEOUT if self.timeout is None else self.timeout
+        return mark_safe(_devour(content, html=self.html, maxwidth=self.width, maxheight=self.height,
+                                 timeout=timeout))
 
 
 def oembed_tag(parser, token):
     """
     Replaces OEmbed URLs with rich content. This treats content as HTML.
-    Tag may specify maxwidth and maxheight like {% oembed 600x400 %}
+    Tag may specify maxwidth and maxheight like {% oembed 600x400 %} and the
+    number of seconds to wait for uncached resources like {% oembed timeout=0.3 %}
     """
     args = token.split_contents()
     width, height = _args_to_dim(args)
+    timeout = _args_to_timeout(args)
 
     nodelist = parser.parse(('endoembed',))
     parser.delete_first_token()
 
-    return OEmbedNode(nodelist, width, height)
+    return OEmbedNode(nodelist, width, height, timeout=timeout)
 
 
 def oembed_text_tag(parser, token):
     """
     Replaces OEmbed URLs with rich content. This treats content as plain text.
-    Tag may specify maxwidth and maxheight like {% oembed 600x400 %}
+    Tag may specify maxwidth and maxheight like {% oembed 600x400 %} and the
+    number of seconds to wait for uncached resources like {% oembed timeout=0.3 %}
     """
     args = token.split_contents()
     width, height = _args_to_dim(args)
+    timeout = _args_to_timeout(args)
 
     nodelist = parser.parse(('endoembed_text',))
     parser.delete_first_token()
 
-    return OEmbedNode(nodelist, width, height, html=False)
+    return OEmbedNode(nodelist, width, height, html=False, timeout=timeout)
 
 
 def oembed_filter(input, size=None):
@@ -76,7 +153,8 @@ def oembed_filter(input, size=None):
     Filter that parses content as html for OEmbed URLs
     """
     width, height = _value_to_dim(size)
-    return mark_safe(devour(input, html=True, maxwidth=width, maxheight=height))
+    return mark_safe(_devour(input, html=True, maxwidth=width, maxheight=height,
+                             timeout=settings.CONSUMER_SYNC_TIMEOUT))
 
 
 def oembed_text_filter(input, size=None):
@@ -85,7 +163,8 @@ def oembed_text_filter(input, size=None):
     """
     width, height = _value_to_dim(size)
 
-    return mark_safe(devour(input, html=False, maxwidth=width, maxheight=height))
+    return mark_safe(_devour(input, html=False, maxwidth=width, maxheight=height,
+                             timeout=settings.CONSUMER_SYNC_TIMEOUT))
 
 
 register.tag('oembed', oembed_tag)
@@ -1,6 +1,9 @@
+from mock import patch
 from unittest2 import TestCase
 
 from monocle.cache import cache
+from monocle.settings import settings
+from monocle.tests.utils import override_settings
 
 
 class CacheTestCase(TestCase):
@@ -24,3 +27,58 @@ class CacheTestCase(TestCase):
         cached, primed = cache.get_or_prime('foo', primer='baz')
         self.assertFalse(primed)
         self.assertEqual(cached, 'bar')
+
+    def test_make_key_is_safe(self):
+        for args in [('foo',), ('http://foo.com/oembed?url=%s' % ('x' * 500),),
+                     ('foo bar\n',), (u'http://foo.com/caf\xe9', 'bar')]:
+            key = cache.make_key(*args)
+            self.assertEqual(len(settings.CACHE_KEY_PREFIX) + 33, len(key))
+            self.assertTrue(key.startswith(settings.CACHE_KEY_PREFIX + ':'))
+            self.assertNotIn(' ', key)
+
+        self.assertNotEqual(cache.make_key('foo', 'bar'), cache.make_key('foo:baz'))
+        self.assertEqual(cache.make_key('foo', 'bar'), cache.make_key('foo:bar'))
+
+    def test_dependents(self):
+        cache.pop_dependents('foo')
+
+        cache.add_dependent('foo', 'bar')
+        cache.add_dependent('foo', 'baz')
+        cache.add_dependent('foo', 'bar')
+
+        self.assertEqual(cache.pop_dependents('foo'), set(['bar', 'baz']))
+        self.assertEqual(cache.pop_dependents('foo'), set())
+
+        # Popped dependents can be recorded again
+        cache.add_dependent('foo', 'bar')
+        self.assertEqual(cache.pop_dependents('foo'), set(['bar']))
+
+    @override_settings(MONOCLE_CACHE_MAX_DEPENDENTS=2)
+    def test_dependents_bounded(self):
+        cache.pop_dependents('foo')
+
+        self.assertTrue(cache.add_dependent('foo', 'a'))
+        self.assertTrue(cache.add_dependent('foo', 'b'))
+        self.assertFalse(cache.add_dependent('foo', 'c'))
+        self.assertFalse(cache.add_dependent('foo', 'c'))
+
+        self.assertEqual(cache.pop_dependents('foo'), set(['a', 'b']))
+        self.assertTrue(cache.add_dependent('foo', 'c'))
+        self.assertEqual(cache.pop_dependents('foo'), set(['c']))
+
+    @patch('monocle.cache._cache')
+    def test_dependents_expire(self, _cache):
+        _cache.add.return_value = True
+        _cache.get.return_value = 0
+        _cache.incr.return_value = 1
+
+        cache.add_dependent('foo', 'bar', timeout=10)
+        self.assertEqual(10, _cache.set.call_args[1]['timeout'])
+
+    @patch('monocle.cache._cache')
+    def test_set_timeout_capped(self, _cache):
+        cache.set('foo', 'bar', timeout=10)
+        _cache.set.assert_called_with(cache.make_key('foo'), 'bar', timeout=10)
+
+        cache.set('foo', 'bar', timeout=10 ** 10)
+        _cache.set.assert_called_with(cache.make_key('foo'), 'bar', timeout=settings.CACHE_AGE)
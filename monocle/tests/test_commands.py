@@ -0,0 +1,105 @@
+from StringIO import StringIO
+
+from mock import patch
+from unittest2 import TestCase
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from monocle.management.commands.monocle_prefetch import Command
+from monocle.models import ThirdPartyProvider
+from monocle.tests.test_fields import Post, RenderedPost
+
+
+class PrefetchCommandTestCase(TestCase):
+
+    def setUp(self):
+        # Any URL could be embedded, whatever providers are stored
+        may_match = patch('monocle.consumers.registry.may_match', return_value=True)
+        may_match.start()
+        self.addCleanup(may_match.stop)
+
+    def rows(self, *values):
+        return lambda model, fields: iter([(i, v) for i, v in enumerate(values)])
+
+    def test_get_models(self):
+        models = dict(Command().get_models(['monocle']))
+        self.assertEqual(set([Post, RenderedPost]), set(models.keys()))
+        self.assertEqual(['content'], [f.name for f in models[Post]])
+
+        # Rendered fields are not prefetched themselves
+        self.assertEqual(['content'], [f.name for f in models[RenderedPost]])
+
+    def test_iter_rows_chunks(self):
+        self.addCleanup(lambda: ThirdPartyProvider.objects.filter(
+            api_endpoint__startswith='http://example.com/').delete())
+
+        for i in range(5):
+            ThirdPartyProvider.objects.create(api_endpoint='http://example.com/%s' % i,
+                                              resource_type='rich')
+
+        command = Command()
+        command.chunk_size = 2
+        fields = [ThirdPartyProvider._meta.get_field('api_endpoint')]
+        rows = list(command.iter_rows(ThirdPartyProvider, fields))
+
+        expected = list(ThirdPartyProvider.objects.order_by('pk').values_list('pk', 'api_endpoint'))
+        self.assertEqual(expected, rows)
+
+    @patch('monocle.management.commands.monocle_prefetch.prefetch_urls')
+    def test_prefetches_unique_urls(self, prefetch_urls):
+        prefetch_urls.return_value = 4
+        rows = self.rows('http://foo.com http://bar.com', 'No URLs', 'Again http://foo.com')
+
+        with patch.object(Command, 'iter_rows', side_effect=rows):
+            stdout = StringIO()
+            call_command('monocle_prefetch', 'monocle.Post', workers=0, stdout=stdout)
+
+        self.assertEqual(1, prefetch_urls.call_count)
+
+        urls = prefetch_urls.call_args[0][0]
+        self.assertEqual(['http://bar.com', 'http://foo.com'], sorted(urls))
+        self.assertIn('3 rows scanned', stdout.getvalue())
+        self.assertIn('2 unique URLs queued', stdout.getvalue())
+        self.assertIn('4 resources prefetched', stdout.getvalue())
+
+    @patch('monocle.management.commands.monocle_prefetch.prefetch_urls')
+    def test_batches(self, prefetch_urls):
+        prefetch_urls.return_value = 0
+        rows = self.rows(*['http://foo.com/%s' % i for i in range(5)])
+
+        with patch.object(Command, 'iter_rows', side_effect=rows):
+            call_command('monocle_prefetch', 'monocle.Post', workers=0, batch_size=2,
+                         stdout=StringIO())
+
+        self.assertEqual(3, prefetch_urls.call_count)
+
+    @patch('monocle.management.commands.monocle_prefetch.prefetch_urls')
+    def test_failed_batches(self, prefetch_urls):
+        prefetch_urls.side_effect = [1, ValueError('Boom'), 1]
+        rows = self.rows(*['http://foo.com/%s' % i for i in range(5)])
+
+        with patch.object(Command, 'iter_rows', side_effect=rows):
+            stdout, stderr = StringIO(), StringIO()
+
+            # Older Djangos exit rather than raise CommandError from call_command
+            with self.assertRaises((CommandError, SystemExit)):
+                call_command('monocle_prefetch', 'monocle.Post', workers=0, batch_size=2,
+                             stdout=stdout, stderr=stderr)
+
+        self.assertEqual(3, prefetch_urls.call_count)
+        self.assertIn('2 resources prefetched', stdout.getvalue())
+        self.assertIn('Boom', stderr.getvalue())
+        self.assertIn('failed for 2 of 5 URLs', stderr.getvalue())
+
+    @patch('monocle.management.commands.monocle_prefetch.prefetch_urls')
+    def test_workers_report_results(self, prefetch_urls):
+        prefetch_urls.side_effect = lambda urls, sizes: len(urls) * 2
+        rows = self.rows(*['http://foo.com/%s' % i for i in range(5)])
+
+        with patch.object(Command, 'iter_rows', side_effect=rows):
+            stdout = StringIO()
+            call_command('monocle_prefetch', 'monocle.Post', workers=2, batch_size=2,
+                         stdout=stdout)
+
+        self.assertIn('10 resources prefetched', stdout.getvalue())
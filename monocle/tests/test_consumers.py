@@ -1,11 +1,15 @@
 import re
+import time
 
 from mock import Mock, patch
 from unittest2 import TestCase
 
 from BeautifulSoup import BeautifulSoup
 
-from monocle.consumers import Consumer, HTMLConsumer, prefetch
+from monocle.consumers import (Consumer, HTMLConsumer, StreamingHTMLConsumer, get_consumer,
+                                prefetch, prefetch_urls)
+from monocle.providers import InternalProvider
+from monocle.resources import Resource
 
 
 TEXT_CONTENT = """
@@ -39,6 +43,27 @@ class ConsumerTestCase(TestCase):
 
         self.assertEqual(expected, urls)
 
+    @patch('monocle.consumers.registry')
+    def test_has_candidates(self, registry):
+        registry.may_match.return_value = True
+
+        self.assertFalse(self.consumer.has_candidates(None))
+        self.assertFalse(self.consumer.has_candidates('No URLs here'))
+        self.assertTrue(self.consumer.has_candidates(TEXT_CONTENT))
+
+    @patch('monocle.consumers.registry')
+    def test_has_candidates_no_host_match(self, registry):
+        registry.may_match.return_value = False
+
+        self.assertFalse(self.consumer.has_candidates(TEXT_CONTENT))
+
+    @patch('monocle.consumers.registry')
+    def test_devour_returns_content_without_candidates(self, registry):
+        registry.may_match.return_value = False
+
+        self.assertEqual(TEXT_CONTENT, self.consumer.devour(TEXT_CONTENT))
+        self.assertFalse(registry.match.called)
+
     @patch('monocle.consumers.registry')
     def test_enrich(self, registry):
         provider = Mock()
@@ -51,12 +76,94 @@ class ConsumerTestCase(TestCase):
 
         self.assertIn('RESOURCE, RESOURCE, and (RESOURCE)', result)
 
+    @patch('monocle.consumers.registry')
+    def test_enrich_collects_resources(self, registry):
+        provider = Mock()
+        provider.get_resource.return_value = provider
+        provider.render.return_value = 'RESOURCE'
+
+        registry.match.return_value = provider
+
+        resources = []
+        self.consumer.enrich(TEXT_CONTENT, resources=resources)
+
+        self.assertEqual([provider] * 3, resources)
+
+    @patch('monocle.consumers.registry')
+    def test_render_collects_unreusable_resources_as_none(self, registry):
+        provider = Mock(spec=InternalProvider)
+        provider.get_resource.return_value = Mock()
+        registry.match.return_value = provider
+
+        resources = []
+        self.consumer.render('http://foo.com', resources=resources)
+
+        provider = Mock()
+        provider.get_resource.side_effect = Exception
+        registry.match.return_value = provider
+
+        self.consumer.render('http://foo.com', resources=resources)
+
+        self.assertEqual([None, None], resources)
+
+    @patch('monocle.consumers.fetch_resources')
+    @patch('monocle.consumers.registry')
+    def test_devour_with_timeout_fetches_external(self, registry, fetch_resources):
+        provider = Mock()
+        provider._internal = False
+        provider.get_resource_url.side_effect = lambda url, **kwargs: 'REQUEST %s' % url
+        provider.get_resource.return_value = provider
+        provider.render.return_value = 'RESOURCE'
+
+        registry.match.return_value = provider
+        registry.match_many.side_effect = lambda urls: dict((url, provider) for url in urls)
+
+        result = self.consumer.devour(TEXT_CONTENT, timeout=0.3)
+
+        self.assertIn('RESOURCE, RESOURCE, and (RESOURCE)', result)
+        self.assertEqual(1, fetch_resources.call_count)
+
+        request_urls, timeout = fetch_resources.call_args[0]
+        self.assertEqual(0.3, timeout)
+        self.assertEqual(sorted(request_urls), ['REQUEST http://bar.com',
+                                                'REQUEST http://baz.com/foo?a=b&x=y',
+                                                'REQUEST http://foo.com'])
+
+    @patch('monocle.consumers.registry')
+    def test_devour_matches_once(self, registry):
+        provider = Mock()
+        provider.get_resource.return_value = provider
+        provider.render.return_value = 'RESOURCE'
+        registry.match_many.side_effect = lambda urls: dict((url, provider) for url in urls)
+
+        self.assertIn('RESOURCE, RESOURCE, and (RESOURCE)', self.consumer.devour(TEXT_CONTENT))
+        self.assertEqual(1, registry.match_many.call_count)
+        self.assertFalse(registry.match.called)
+
+    @patch('monocle.consumers.fetch_resources')
+    @patch('monocle.consumers.registry')
+    def test_devour_with_timeout_skips_internal(self, registry, fetch_resources):
+        provider = Mock()
+        provider._internal = True
+        provider.get_resource.return_value = provider
+        provider.render.return_value = 'RESOURCE'
+
+        registry.match.return_value = provider
+
+        self.consumer.devour(TEXT_CONTENT, timeout=0.3)
+        self.assertFalse(fetch_resources.called)
+
 
 class HTMLConsumerTestCase(TestCase):
 
     def setUp(self):
         self.consumer = HTMLConsumer()
 
+    def test_extract_urls(self):
+        urls = self.consumer.extract_urls(HTML_CONTENT)
+        self.assertEqual(['http://foo.com', 'http://foo.com', 'http://bar.com',
+                          'http://baz.com/foo?a=b&x=y'], urls)
+
     def test_is_hyperlinked(self):
         soup = BeautifulSoup('NOTLINK <a>LINKED</a>')
         nodes = soup.findAll(text=re.compile(r'LINK'))
@@ -77,46 +184,275 @@ class HTMLConsumerTestCase(TestCase):
         self.assertIn('<p>URL content RESOURCE</p>', result)
         self.assertIn('<p>URL content RESOURCE, RESOURCE, and (RESOURCE)</p>', result)
         self.assertIn('<p>Link content <a>http://foo.com</a>', result)
+        registry.match.assert_any_call('http://baz.com/foo?a=b&x=y')
 
 
-class PrefetchTestCase(TestCase):
+class StreamingHTMLConsumerTestCase(TestCase):
 
-    def mock_provider_and_registry(self, registry):
+    def setUp(self):
+        self.consumer = StreamingHTMLConsumer()
+
+    def mock_registry(self, registry):
         provider = Mock()
         provider.get_resource.return_value = provider
         provider.render.return_value = 'RESOURCE'
 
         registry.match.return_value = provider
+        return provider
+
+    def test_tokenize_is_lossless(self):
+        content = HTML_CONTENT + '<!-- http://foo.com --><script>if (a<b) {}</script>'
+        chunks = [chunk for chunk, enrichable in self.consumer.tokenize(content)]
+        self.assertEqual(content, ''.join(chunks))
+
+    def test_tokenize_malformed(self):
+        # Unclosed markup is text, and tokenizing is linear rather than backtracking
+        started = time.time()
+
+        for content in ['<a ' + 'x' * 4000, '<p' * 400, '<a' * 20000, '<a "' * 20000,
+                        '<!--' * 20000, '<?' * 20000, '<![CDATA[' * 20000]:
+            chunks = list(self.consumer.tokenize(content))
+            self.assertEqual(content, ''.join(chunk for chunk, enrichable in chunks))
+            self.assertTrue(all(enrichable for chunk, enrichable in chunks))
+
+        self.assertLess(time.time() - started, 5)
+
+    def test_tokenize_closes_markup(self):
+        content = '<a<b title="x<y">http://foo.com</b> <!-- a > b --> <!x> <?y?>'
+        chunks = list(self.consumer.tokenize(content))
+
+        self.assertEqual([('<a', True), ('<b title="x<y">', False), ('http://foo.com', True),
+                          ('</b>', False), (' ', True), ('<!-- a > b -->', False), (' ', True),
+                          ('<!x>', False), (' ', True), ('<?y?>', False)], chunks)
+
+    @patch('monocle.consumers.registry')
+    def test_devour(self, registry):
+        self.mock_registry(registry)
+
+        result = self.consumer.devour(HTML_CONTENT)
+
+        self.assertIn('<p>URL content RESOURCE</p>', result)
+        self.assertIn('<p>URL content RESOURCE, RESOURCE, and (RESOURCE)</p>', result)
+        self.assertIn('<p>Link content <a>http://foo.com</a>', result)
+
+    @patch('monocle.consumers.registry')
+    def test_devour_skips_nested_links(self, registry):
+        self.mock_registry(registry)
+
+        content = '<a href="http://foo.com"><b class="x">http://foo.com</b></a> http://bar.com'
+        result = self.consumer.devour(content)
+
+        self.assertEqual('<a href="http://foo.com"><b class="x">http://foo.com</b></a> RESOURCE', result)
+
+    @patch('monocle.consumers.registry')
+    def test_devour_leaves_markup_untouched(self, registry):
+        self.mock_registry(registry)
+
+        content = ("<!DOCTYPE html><P CLASS='a>b'>&nbsp;http://foo.com<br/></P>"
+                   "<!-- http://foo.com --><script>var u = 'http://foo.com';</script>")
+        result = self.consumer.devour(content)
+
+        self.assertEqual(content.replace('&nbsp;http://foo.com', '&nbsp;RESOURCE'), result)
+
+    @patch('monocle.consumers.registry')
+    def test_devour_unescapes_urls(self, registry):
+        self.mock_registry(registry)
+
+        result = self.consumer.devour('<p>http://foo.com/?a=1&amp;b=2</p>')
+
+        self.assertEqual('<p>RESOURCE</p>', result)
+        registry.match.assert_called_with('http://foo.com/?a=1&b=2')
+
+    @patch('monocle.consumers.registry')
+    def test_devour_renders_once_per_url(self, registry):
+        provider = self.mock_registry(registry)
+
+        self.consumer.devour('<p>http://foo.com</p><p>http://foo.com</p>')
+
+        self.assertEqual(1, provider.get_resource.call_count)
+        provider.render.assert_called_with('http://foo.com')
+
+
+class GetConsumerTestCase(TestCase):
+
+    def test_consumers_are_shared(self):
+        self.assertIs(get_consumer(), get_consumer())
+        self.assertIs(get_consumer(html=True), get_consumer(html=True))
+        self.assertIsNot(get_consumer(), get_consumer(skip_internal=True))
+        self.assertTrue(get_consumer(skip_internal=True).skip_internal)
+
+    @patch('monocle.consumers.registry')
+    def test_shared_consumers_populate_registry(self, registry):
+        registry.may_match.return_value = False
+        consumer = get_consumer()
+
+        consumer.devour('No URLs here')
+        self.assertFalse(registry.ensure_populated.called)
+
+        # Providers cleared after the consumer was created are loaded again
+        consumer.devour('http://foo.com')
+        consumer.devour('http://foo.com')
+        self.assertEqual(2, registry.ensure_populated.call_count)
+
+    @patch('monocle.consumers.settings')
+    def test_consumer_types(self, settings):
+        settings.CONSUMER_STREAM_HTML = False
+        self.assertIs(type(get_consumer()), Consumer)
+        self.assertIs(type(get_consumer(html=True)), HTMLConsumer)
+
+        settings.CONSUMER_STREAM_HTML = True
+        self.assertIs(type(get_consumer(html=True)), StreamingHTMLConsumer)
+
+
+class PrefetchTestCase(TestCase):
+
+    def mock_provider_and_registry(self, registry):
+        provider = Mock()
+        provider.get_resource_url.side_effect = lambda url, **kwargs: (url, kwargs['maxwidth'],
+                                                                       kwargs['maxheight'])
+
+        registry.match.return_value = provider
+        registry.match_many.side_effect = lambda urls: dict((url, provider) for url in urls)
 
         return provider, registry
 
+    def assert_fetched(self, provider, expected):
+        calls = [(args[0], kwargs['maxwidth'], kwargs['maxheight'])
+                 for args, kwargs in provider.get_resource.call_args_list]
+        self.assertEqual(sorted(expected), sorted(calls))
+
+    @patch('monocle.consumers.cache')
     @patch('monocle.consumers.registry')
-    @patch.object(Consumer, 'enrich')
-    def test_prefetch_no_sizes(self, enrich_fn, registry):
+    def test_prefetch_no_sizes(self, registry, cache):
         provider, registry = self.mock_provider_and_registry(registry)
+        cache.get_many.return_value = {}
         prefetch(TEXT_CONTENT)
 
-        enrich_fn.assert_called_once_with(TEXT_CONTENT, maxwidth=None, maxheight=None)
+        self.assert_fetched(provider, [
+            ('http://foo.com', None, None),
+            ('http://bar.com', None, None),
+            ('http://baz.com/foo?a=b&x=y', None, None),
+        ])
 
+    @patch('monocle.consumers.cache')
     @patch('monocle.consumers.registry')
-    @patch.object(Consumer, 'enrich')
-    def test_prefetch_tuple_sizes(self, enrich_fn, registry):
+    def test_prefetch_tuple_sizes(self, registry, cache):
         provider, registry = self.mock_provider_and_registry(registry)
-        prefetch(TEXT_CONTENT, sizes=[(100, 200), (300, 400)])
+        cache.get_many.return_value = {}
+        prefetch('http://foo.com', sizes=[(100, 200), (300, 400)])
+
+        self.assert_fetched(provider, [
+            ('http://foo.com', None, None),
+            ('http://foo.com', 100, 200),
+            ('http://foo.com', 300, 400),
+        ])
+
+    @patch('monocle.consumers.cache')
+    @patch('monocle.consumers.registry')
+    def test_prefetch_list_sizes(self, registry, cache):
+        # Tuples become lists when task arguments are serialized as JSON
+        provider, registry = self.mock_provider_and_registry(registry)
+        cache.get_many.return_value = {}
+        prefetch('http://foo.com', sizes=[[100, 200], [300, 400]])
+
+        self.assert_fetched(provider, [
+            ('http://foo.com', None, None),
+            ('http://foo.com', 100, 200),
+            ('http://foo.com', 300, 400),
+        ])
+
+    @patch('monocle.consumers.cache')
+    @patch('monocle.consumers.registry')
+    def test_prefetch_int_sizes(self, registry, cache):
+        provider, registry = self.mock_provider_and_registry(registry)
+        cache.get_many.return_value = {}
+        prefetch('http://foo.com', sizes=[100])
+
+        self.assert_fetched(provider, [
+            ('http://foo.com', None, None),
+            ('http://foo.com', 100, None),
+            ('http://foo.com', None, 100),
+            ('http://foo.com', 100, 100),
+        ])
+
+    @patch('monocle.consumers.cache')
+    @patch('monocle.consumers.registry')
+    def test_prefetch_urls_counts_requests(self, registry, cache):
+        provider, registry = self.mock_provider_and_registry(registry)
+        cache.get_many.return_value = {}
+
+        self.assertEqual(3, prefetch_urls(['http://foo.com'], sizes=[(100, 200), (300, 400)]))
+
+        provider.get_resource.side_effect = Exception
+        self.assertEqual(0, prefetch_urls(['http://foo.com']))
+
+    @patch('monocle.consumers.cache')
+    @patch('monocle.consumers.registry')
+    def test_prefetch_scans_once(self, registry, cache):
+        provider, registry = self.mock_provider_and_registry(registry)
+        cache.get_many.return_value = {}
+        prefetch(TEXT_CONTENT + TEXT_CONTENT, sizes=range(100, 1000, 100))
+
+        self.assertEqual(1, registry.match_many.call_count)
+        self.assertEqual(3, len(set(registry.match_many.call_args[0][0])))
+        self.assertEqual(1, cache.get_many.call_count)
+        self.assertEqual(3 * 28, provider.get_resource.call_count)
+
+    @patch('monocle.consumers.cache')
+    @patch('monocle.consumers.registry')
+    def test_prefetch_only_new_urls(self, registry, cache):
+        provider, registry = self.mock_provider_and_registry(registry)
+        cache.get_many.return_value = {}
+        prefetch('http://foo.com http://bar.com', previous='http://foo.com')
+
+        self.assert_fetched(provider, [('http://bar.com', None, None)])
+
+    @patch('monocle.consumers.cache')
+    @patch('monocle.consumers.registry')
+    def test_prefetch_no_new_urls(self, registry, cache):
+        provider, registry = self.mock_provider_and_registry(registry)
+        prefetch('Still http://foo.com', previous='http://foo.com')
+
+        self.assertFalse(registry.match.called)
+        self.assertFalse(cache.get_many.called)
+
+    @patch('monocle.consumers.cache')
+    @patch('monocle.consumers.registry')
+    def test_prefetch_skips_cached(self, registry, cache):
+        provider, registry = self.mock_provider_and_registry(registry)
+        cache.get_many.return_value = {
+            ('http://foo.com', None, None): Resource('http://foo.com'),
+        }
+        prefetch('http://foo.com', sizes=[(100, 200)])
+
+        self.assert_fetched(provider, [('http://foo.com', 100, 200)])
+
+    @patch('monocle.consumers.cache')
+    @patch('monocle.consumers.registry')
+    def test_prefetch_refreshes_stale(self, registry, cache):
+        provider, registry = self.mock_provider_and_registry(registry)
+        resource = Resource('http://foo.com')
+        resource.created = resource.created - (60*60*24*365*10)
+        cache.get_many.return_value = {('http://foo.com', None, None): resource}
+        prefetch('http://foo.com')
+
+        self.assert_fetched(provider, [('http://foo.com', None, None)])
+
+    @patch('monocle.consumers.cache')
+    @patch('monocle.consumers.registry')
+    def test_prefetch_skips_uncached_internal(self, registry, cache):
+        registry.match.return_value = InternalProvider()
+        prefetch('http://foo.com')
 
-        self.assertEqual(enrich_fn.call_count, 3)
-        enrich_fn.assert_any_call(TEXT_CONTENT, maxwidth=None, maxheight=None)
-        enrich_fn.assert_any_call(TEXT_CONTENT, maxwidth=100, maxheight=200)
-        enrich_fn.assert_any_call(TEXT_CONTENT, maxwidth=300, maxheight=400)
+        self.assertFalse(cache.get_many.called)
 
+    @patch('monocle.consumers.cache')
     @patch('monocle.consumers.registry')
     @patch.object(Consumer, 'enrich')
-    def test_prefetch_int_sizes(self, enrich_fn, registry):
+    def test_prefetch_does_not_render(self, enrich_fn, registry, cache):
         provider, registry = self.mock_provider_and_registry(registry)
+        cache.get_many.return_value = {}
         prefetch(TEXT_CONTENT, sizes=[100])
 
-        self.assertEqual(enrich_fn.call_count, 4)
-        enrich_fn.assert_any_call(TEXT_CONTENT, maxwidth=None, maxheight=None)
-        enrich_fn.assert_any_call(TEXT_CONTENT, maxwidth=100, maxheight=None)
-        enrich_fn.assert_any_call(TEXT_CONTENT, maxwidth=None, maxheight=100)
-        enrich_fn.assert_any_call(TEXT_CONTENT, maxwidth=100, maxheight=100)
+        self.assertFalse(enrich_fn.called)
+        self.assertFalse(provider.get_resource.return_value.render.called)
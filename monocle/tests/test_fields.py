@@ -0,0 +1,218 @@
+from mock import Mock, patch
+from unittest2 import TestCase
+
+from celery.exceptions import MaxRetriesExceededError
+from django.db import models
+
+from monocle.fields import (OEmbedCharField, OEmbedTextField, OEmbedURLField,
+                            OEmbedRenderedField, _refresh_rendered)
+from monocle.tasks import render_oembed_field
+
+
+class Post(models.Model):
+    content = OEmbedTextField()
+
+    class Meta:
+        app_label = 'monocle'
+        managed = False
+
+
+class RenderedPost(models.Model):
+    content = OEmbedTextField(prefetch_async=True)
+    content_html = OEmbedRenderedField(source='content')
+
+    class Meta:
+        app_label = 'monocle'
+        managed = False
+
+
+class FieldsTestCase(TestCase):
+
+    def make_field(self, cls, **kwargs):
+        field = cls(**kwargs)
+        field.set_attributes_from_name('content')
+        return field
+
+    def make_model(self, content):
+        model = Mock()
+        model.content = content
+        return model
+
+    @patch('monocle.fields.prefetch_oembed')
+    @patch('monocle.fields.prefetch')
+    def test_pre_save_prefetches(self, prefetch, task):
+        field = self.make_field(OEmbedTextField, prefetch_sizes=[100])
+        field.pre_save(self.make_model('http://foo.com'), True)
+
+        prefetch.assert_called_with('http://foo.com', html=True, sizes=[100], previous=None)
+        self.assertFalse(task.apply_async.called)
+
+    @patch('monocle.fields.prefetch_oembed')
+    @patch('monocle.fields.prefetch')
+    def test_pre_save_defers_prefetch(self, prefetch, task):
+        for cls, html in ((OEmbedCharField, False), (OEmbedTextField, True), (OEmbedURLField, False)):
+            task.reset_mock()
+            field = self.make_field(cls, prefetch_sizes=[100], prefetch_async=True)
+            field.pre_save(self.make_model('http://foo.com'), True)
+
+            task.apply_async.assert_called_with(('http://foo.com', html, [100], None))
+
+        self.assertFalse(prefetch.called)
+
+    @patch('monocle.fields.prefetch_oembed')
+    @patch('monocle.fields.prefetch')
+    def test_pre_save_deferred_skips_content_without_urls(self, prefetch, task):
+        field = self.make_field(OEmbedTextField, prefetch_async=True)
+        field.pre_save(self.make_model('No URLs here'), True)
+
+        self.assertFalse(task.apply_async.called)
+        self.assertFalse(prefetch.called)
+
+
+class ChangeAwareFieldsTestCase(TestCase):
+
+    def setUp(self):
+        self.field = Post._meta.get_field('content')
+
+    @patch('monocle.fields.prefetch')
+    def test_unchanged_value_skips_prefetch(self, prefetch):
+        post = Post(id=1, content='http://foo.com')
+        self.field.pre_save(post, False)
+
+        self.assertFalse(prefetch.called)
+
+    @patch('monocle.fields.prefetch')
+    def test_added_prefetches_everything(self, prefetch):
+        post = Post(content='http://foo.com')
+        self.field.pre_save(post, True)
+
+        prefetch.assert_called_with('http://foo.com', html=True, sizes=self.field.prefetch_sizes,
+                                    previous=None)
+
+    @patch('monocle.fields.prefetch')
+    def test_changed_value_passes_previous(self, prefetch):
+        post = Post(id=1, content='http://foo.com')
+        post.content = 'http://foo.com http://bar.com'
+        self.field.pre_save(post, False)
+
+        prefetch.assert_called_with('http://foo.com http://bar.com', html=True,
+                                    sizes=self.field.prefetch_sizes, previous='http://foo.com')
+
+        # Saved values become the new baseline
+        prefetch.reset_mock()
+        self.field.pre_save(post, False)
+        self.assertFalse(prefetch.called)
+
+
+class RenderedFieldTestCase(TestCase):
+
+    def setUp(self):
+        self.field = RenderedPost._meta.get_field('content_html')
+
+    def test_requires_source(self):
+        self.assertRaises(TypeError, OEmbedRenderedField)
+
+    def test_not_editable(self):
+        self.assertFalse(self.field.editable)
+        self.assertTrue(self.field.null)
+
+    @patch('monocle.fields.render_oembed_field')
+    def test_changed_source_clears_and_schedules(self, task):
+        post = RenderedPost(id=1, content='http://foo.com', content_html='<old>')
+        post.content = 'http://bar.com'
+
+        self.assertIsNone(self.field.pre_save(post, False))
+        self.assertIsNone(post.content_html)
+
+        self.field._schedule_render(RenderedPost, post)
+        task.apply_async.assert_called_with(('monocle', 'RenderedPost', 1, 'content_html',
+                                             'http://bar.com'))
+
+        # Only scheduled once per save
+        task.reset_mock()
+        self.field._schedule_render(RenderedPost, post)
+        self.assertFalse(task.apply_async.called)
+
+    @patch('monocle.fields.render_oembed_field')
+    def test_unchanged_source_keeps_rendering(self, task):
+        post = RenderedPost(id=1, content='http://foo.com', content_html='<old>')
+
+        self.assertEqual(self.field.pre_save(post, False), '<old>')
+        self.field._schedule_render(RenderedPost, post)
+        self.assertFalse(task.apply_async.called)
+
+    @patch('monocle.fields.render_oembed_field')
+    def test_source_without_urls_renders_as_itself(self, task):
+        post = RenderedPost(content='No URLs here')
+
+        self.assertEqual(self.field.pre_save(post, True), 'No URLs here')
+        self.field._schedule_render(RenderedPost, post)
+        self.assertFalse(task.apply_async.called)
+
+    @patch('monocle.fields.cache')
+    @patch('monocle.fields.get_consumer')
+    def test_refresh(self, get_consumer, cache):
+        consumer = get_consumer.return_value
+        consumer.has_candidates.return_value = True
+        consumer.extract_urls.return_value = ['http://foo.com', 'http://foo.com']
+
+        # Dependents are recorded before rendering, so an update meanwhile is not missed
+        def devour(content):
+            self.assertTrue(cache.add_dependent.called)
+            return '<embed>'
+        consumer.devour.side_effect = devour
+
+        with patch.object(RenderedPost, '_default_manager') as manager:
+            queryset = manager.filter.return_value.filter.return_value
+            queryset.update.return_value = 1
+            self.assertTrue(self.field.refresh(1, content='http://foo.com'))
+
+            manager.filter.assert_called_with(pk=1)
+            manager.filter.return_value.filter.assert_called_with(content='http://foo.com')
+            queryset.update.assert_called_with(content_html='<embed>')
+
+        get_consumer.assert_called_with(html=True)
+        cache.add_dependent.assert_called_once_with(
+            'rendered:http://foo.com/', ('monocle', 'RenderedPost', 1, 'content_html'))
+
+    @patch('monocle.fields.get_consumer')
+    def test_refresh_missing_row(self, get_consumer):
+        with patch.object(RenderedPost, '_default_manager') as manager:
+            manager.filter.return_value.values_list.return_value = []
+            self.assertFalse(self.field.refresh(1))
+
+            self.assertFalse(manager.filter.return_value.update.called)
+
+        self.assertFalse(get_consumer.called)
+
+    def test_render_task_retries_until_visible(self):
+        args = ['monocle', 'RenderedPost', 1, 'content_html', 'http://foo.com']
+
+        with patch.object(render_oembed_field, 'retry') as retry:
+            with patch.object(OEmbedRenderedField, 'refresh', Mock(return_value=False)) as refresh:
+                render_oembed_field.run(*args)
+                refresh.assert_called_with(1, content='http://foo.com')
+                retry.assert_called_with(args=args)
+
+                # Rendering for an updated resource reads the row and is not retried
+                retry.reset_mock()
+                render_oembed_field.run(*args[:4])
+                self.assertFalse(retry.called)
+
+            with patch.object(OEmbedRenderedField, 'refresh', Mock(return_value=True)):
+                render_oembed_field.run(*args)
+                self.assertFalse(retry.called)
+
+    def test_render_task_gives_up(self):
+        with patch.object(render_oembed_field, 'retry', Mock(side_effect=MaxRetriesExceededError)):
+            with patch.object(OEmbedRenderedField, 'refresh', Mock(return_value=False)):
+                render_oembed_field.run('monocle', 'RenderedPost', 1, 'content_html', 'foo')
+
+    @patch('monocle.fields.render_oembed_field')
+    @patch('monocle.fields.cache')
+    def test_resource_updated_renders_dependents(self, cache, task):
+        cache.pop_dependents.return_value = set([('monocle', 'RenderedPost', 1, 'content_html')])
+        _refresh_rendered(sender=None, key='foo', resource=Mock(url='http://foo.com'))
+
+        cache.pop_dependents.assert_called_with('rendered:http://foo.com')
+        task.apply_async.assert_called_with(('monocle', 'RenderedPost', 1, 'content_html'))
@@ -1,6 +1,10 @@
 from unittest import TestCase
 
+from mock import Mock
+
+from monocle.cache import cache
 from monocle.models import ThirdPartyProvider, URLScheme
+from monocle.signals import resource_updated
 
 
 class ModelsTestCase(TestCase):
@@ -45,3 +49,10 @@ class ModelsTestCase(TestCase):
 
         self.scheme.save()
         assert not hasattr(self.provider, '_url_schemes')
+
+    def test_resource_updated_invalidates_rendered_content(self):
+        cache.set('fragment:foo', 'FOO')
+        cache.add_dependent('fragment:http://foo.com', 'fragment:foo')
+
+        resource_updated.send(sender=None, key='foo', resource=Mock(url='http://foo.com'))
+        self.assertIsNone(cache.get('fragment:foo'))
@@ -1,12 +1,16 @@
+import threading
+import time
+
+from django.core.management import call_command
 from mock import Mock, patch
 from unittest2 import TestCase
 from urllib import urlencode
 
-from django.conf import settings
-
 from monocle.models import ThirdPartyProvider, URLScheme
-from monocle.providers import Provider, InternalProvider, ProviderRegistry
+from monocle.providers import Provider, InternalProvider, ProviderRegistry, fetch_resources
 from monocle.resources import Resource
+from monocle.tasks import request_resource
+from monocle.tests.utils import override_settings
 
 
 class ProviderTestCase(TestCase):
@@ -25,6 +29,28 @@ class ProviderTestCase(TestCase):
         self.assertIn(urlencode({'url': self.resource_url}), request_url)
         self.assertIn('format=json', request_url)
 
+    def test_get_request_url_canonical(self):
+        self.provider.api_endpoint = 'HTTP://Foo.com:80/oembed'
+        request_url = self.provider.get_request_url(url=self.resource_url, format='json', maxwidth=100)
+
+        self.assertEqual('http://foo.com/oembed?format=json&maxwidth=100&url=' +
+                         'http%3A%2F%2Fexample.com%2Fresource', request_url)
+
+    def test_get_resource_url_canonical(self):
+        self.provider.api_endpoint = 'http://www.youtube.com/oembed'
+        urls = ['http://www.youtube.com/watch?v=fWNaR-rxAic',
+                'http://youtu.be/fWNaR-rxAic',
+                'http://youtube.com/watch?v=fWNaR-rxAic&feature=share']
+
+        request_urls = set(self.provider.get_resource_url(url) for url in urls)
+        self.assertEqual(1, len(request_urls))
+
+    def test_canonicalize_override(self):
+        self.provider.canonicalize = lambda url: url.lower()
+        request_url = self.provider.get_resource_url('http://example.com/RESOURCE')
+
+        self.assertIn(urlencode({'url': 'http://example.com/resource'}), request_url)
+
     def test_get_request_url_filters_zeros(self):
         params = {
             'url': self.resource_url,
@@ -67,6 +93,18 @@ class ProviderTestCase(TestCase):
         resource = self.provider.get_resource(self.resource_url)
         self.assertTrue(mock_task.called)
 
+    @patch('monocle.providers.request_external_oembed')
+    @patch('monocle.providers.cache')
+    def test_get_resource_primes_requested_url(self, mock_cache, mock_task):
+        mock_cache.get_or_prime.side_effect = lambda key, primer: (primer, True)
+        self.provider.api_endpoint = 'http://www.youtube.com/oembed'
+
+        resource = self.provider.get_resource('https://youtu.be/foo?utm_source=share')
+
+        self.assertEqual('https://youtu.be/foo?utm_source=share', resource.url)
+        request_url = mock_cache.get_or_prime.call_args[0][0]
+        self.assertIn(urlencode({'url': 'https://www.youtube.com/watch?v=foo'}), request_url)
+
     @patch('monocle.providers.request_external_oembed')
     @patch('monocle.providers.cache')
     def test_get_resource_no_task(self, mock_cache, mock_task):
@@ -88,6 +126,163 @@ class ProviderTestCase(TestCase):
         self.assertFalse(self.provider.match('http://youtube.com/video'))
 
 
+class RequestResourceTestCase(TestCase):
+
+    def mock_response(self, urlopen, content, content_type):
+        response = urlopen.return_value
+        response.getcode.return_value = 200
+        response.info.return_value = {'Content-Type': content_type}
+        response.read.return_value = content
+
+    @patch('monocle.tasks.urllib2.urlopen')
+    def test_json(self, urlopen):
+        self.mock_response(urlopen, '{"type": "link"}', 'application/json')
+        resource = request_resource('http://foo.com/oembed?url=http%3A%2F%2Fbar.com&format=json')
+
+        self.assertEqual('http://bar.com', resource.url)
+        self.assertEqual({'type': 'link'}, resource.data)
+
+    @patch('monocle.tasks.urllib2.urlopen')
+    def test_xml(self, urlopen):
+        content = '<?xml version="1.0"?><oembed><type>photo</type><width>10</width></oembed>'
+        self.mock_response(urlopen, content, 'text/xml; charset=utf-8')
+        resource = request_resource('http://foo.com/oembed?url=http%3A%2F%2Fbar.com&format=json')
+
+        self.assertEqual({'type': 'photo', 'width': 10}, resource.data)
+
+    @patch('monocle.tasks.urllib2.urlopen')
+    def test_xml_format(self, urlopen):
+        self.mock_response(urlopen, '<oembed><type>link</type></oembed>', 'text/plain')
+        resource = request_resource('http://foo.com/oembed?url=http%3A%2F%2Fbar.com&format=xml')
+
+        self.assertEqual({'type': 'link'}, resource.data)
+
+    def test_provider_format(self):
+        provider = Provider()
+        provider.api_endpoint = 'http://foo.com/oembed'
+        self.assertIn('format=json', provider.get_resource_url('http://bar.com'))
+
+        provider.format = 'xml'
+        self.assertIn('format=xml', provider.get_resource_url('http://bar.com'))
+
+
+class FetchResourcesTestCase(TestCase):
+
+    def setUp(self):
+        self.request_url = 'http://foo.com/oembed?url=http%3A%2F%2Ffoo.com%2Fbar&format=json'
+
+    @patch('monocle.providers.request_external_oembed')
+    @patch('monocle.providers.request_resource')
+    @patch('monocle.providers.cache')
+    def test_fetches_primed(self, mock_cache, mock_request, mock_task):
+        resource = Resource('http://foo.com/bar')
+        mock_cache.get_or_prime.return_value = (Resource('http://foo.com/bar'), True)
+        mock_request.return_value = resource
+
+        fetched = fetch_resources([self.request_url], 1)
+
+        self.assertEqual([self.request_url], fetched)
+        mock_cache.set.assert_called_with(self.request_url, resource)
+        self.assertFalse(mock_task.apply_async.called)
+
+    @patch('monocle.providers.request_external_oembed')
+    @patch('monocle.providers.request_resource')
+    @patch('monocle.providers.cache')
+    def test_skips_cached(self, mock_cache, mock_request, mock_task):
+        mock_cache.get_or_prime.return_value = (Resource('http://foo.com/bar'), False)
+
+        fetched = fetch_resources([self.request_url], 1)
+
+        self.assertEqual([], fetched)
+        self.assertFalse(mock_request.called)
+        self.assertFalse(mock_task.apply_async.called)
+
+    @patch('monocle.providers.request_external_oembed')
+    @patch('monocle.providers.request_resource')
+    @patch('monocle.providers.cache')
+    def test_deadline_leaves_in_flight(self, mock_cache, mock_request, mock_task):
+        resource = Resource('http://foo.com/bar')
+        finished = threading.Event()
+        mock_cache.get_or_prime.return_value = (resource, True)
+
+        def _request(url):
+            time.sleep(0.2)
+            finished.set()
+            return resource
+
+        mock_request.side_effect = _request
+        fetched = fetch_resources([self.request_url], 0.01)
+
+        # The request is not fetched again, but is cached once done
+        self.assertEqual([], fetched)
+        self.assertFalse(mock_task.apply_async.called)
+        finished.wait(1)
+        time.sleep(0.05)
+        mock_cache.set.assert_called_with(self.request_url, resource)
+        self.assertFalse(mock_task.apply_async.called)
+
+    @patch('monocle.providers.request_external_oembed')
+    @patch('monocle.providers.request_resource')
+    @patch('monocle.providers.cache')
+    def test_late_failure_falls_back_to_task(self, mock_cache, mock_request, mock_task):
+        failed = threading.Event()
+        mock_cache.get_or_prime.return_value = (Resource('http://foo.com/bar'), True)
+
+        def _request(url):
+            time.sleep(0.2)
+            failed.set()
+            raise ValueError
+
+        mock_request.side_effect = _request
+        self.assertEqual([], fetch_resources([self.request_url], 0.01))
+        self.assertFalse(mock_task.apply_async.called)
+
+        failed.wait(1)
+        time.sleep(0.05)
+        mock_task.apply_async.assert_called_once_with((self.request_url,))
+
+    @patch('monocle.providers.request_external_oembed')
+    @patch('monocle.providers.request_resource')
+    @patch('monocle.providers.cache')
+    @override_settings(MONOCLE_FETCH_MAX_WORKERS=2)
+    def test_bounded_workers(self, mock_cache, mock_request, mock_task):
+        active, peak = [], []
+        lock = threading.Lock()
+        release = threading.Event()
+        mock_cache.get_or_prime.return_value = (Resource('http://foo.com/bar'), True)
+
+        def _request(url):
+            with lock:
+                active.append(url)
+                peak.append(len(active))
+            release.wait(1)
+            with lock:
+                active.remove(url)
+            return Resource('http://foo.com/bar')
+
+        mock_request.side_effect = _request
+        urls = ['%s&maxwidth=%d' % (self.request_url, i) for i in range(6)]
+        self.assertEqual([], fetch_resources(urls, 0.05))
+        release.set()
+
+        # Only requests that were never started are handed off
+        self.assertEqual(2, max(peak))
+        self.assertEqual(4, mock_task.apply_async.call_count)
+
+    @patch('monocle.providers.request_external_oembed')
+    @patch('monocle.providers.request_resource')
+    @patch('monocle.providers.cache')
+    def test_failure_falls_back_to_task(self, mock_cache, mock_request, mock_task):
+        mock_cache.get_or_prime.return_value = (Resource('http://foo.com/bar'), True)
+        mock_request.side_effect = ValueError
+
+        fetched = fetch_resources([self.request_url], 1)
+
+        self.assertEqual([], fetched)
+        self.assertFalse(mock_cache.set.called)
+        mock_task.apply_async.assert_called_with((self.request_url,))
+
+
 class InternalProviderTestCase(TestCase):
 
     def setUp(self):
@@ -142,8 +337,7 @@ class InternalProviderTestCase(TestCase):
         # Ensure that we do the right thing for types we know about
         self.provider.resource_type = 'video'
         self.provider.html = 'FooBar'
-        self.provider._params['maxwidth'] = 100
-        self.provider._params['maxheight'] = 100
+        self.provider._params = {'maxwidth': 100, 'maxheight': 100}
         self.provider.author_name = 'John Galt'
 
         resource = self.provider._build_resource(**{'url': self.resource_url})
@@ -159,11 +353,71 @@ class InternalProviderTestCase(TestCase):
         # Optional param
         self.assertEqual('John Galt', resource['author_name'])
 
+    def test_build_resource_memoizes_attributes(self):
+        provider = CountingProvider()
+        resource = provider.get_resource(self.resource_url, maxwidth=150)
+
+        self.assertEqual('100x100', resource['html'])
+        self.assertEqual(100, resource['width'])
+        self.assertEqual(1, provider.calls['size'])
+        self.assertEqual(1, provider.calls['html'])
+
+        # Memoized values are per build
+        self.assertEqual('200x200', provider.get_resource(self.resource_url)['html'])
+        self.assertEqual(2, provider.calls['size'])
+
+    def test_build_resource_lazy_attributes(self):
+        provider = CountingProvider()
+        resource = provider.get_resource(self.resource_url, maxwidth=150)
+
+        self.assertIn('thumbnail_url', resource)
+        self.assertEqual(0, provider.calls['thumbnail_url'])
+
+        resource.render()
+        self.assertEqual(0, provider.calls['thumbnail_url'])
+
+        self.assertEqual('thumb-100', resource['thumbnail_url'])
+        self.assertEqual('thumb-100', resource.data['thumbnail_url'])
+        self.assertEqual(1, provider.calls['thumbnail_url'])
+
+    def test_build_resource_lazy_attributes_of_previous_build(self):
+        provider = CountingProvider()
+        resource = provider.get_resource(self.resource_url, maxwidth=150)
+        provider.get_resource(self.resource_url, maxwidth=250)
+
+        # Computed with the parameters it was built with
+        self.assertEqual('thumb-100', resource['thumbnail_url'])
+
+    def test_get_resource_concurrent(self):
+        provider = SlowProvider()
+        sizes = [100, 200, 300, 400] * 25
+        results = {}
+        errors = []
+
+        def _build(i, size):
+            try:
+                results[i] = provider.get_resource(self.resource_url, maxwidth=size, maxheight=size)
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=_build, args=(i, size)) for i, size in enumerate(sizes)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        for i, size in enumerate(sizes):
+            self.assertEqual('%sx%s' % (size, size), results[i]['html'])
+            self.assertEqual(size, results[i]['width'])
+
+        # Nothing is left on the shared instance
+        self.assertEqual({}, provider._params)
+        self.assertNotIn('_attributes', provider.__dict__)
+
+    @override_settings(MONOCLE_CACHE_INTERNAL_PROVIDERS=True)
     @patch('monocle.providers.cache')
     def test_get_resource_cached_is_stale(self, mock_cache):
-        # Update django settings
-        setattr(settings, 'MONOCLE_CACHE_INTERNAL_PROVIDERS', True)
-
         resource = Resource(self.resource_url)
         resource.created = resource.created - (60*60*24*365*10)
 
@@ -176,11 +430,9 @@ class InternalProviderTestCase(TestCase):
         self.assertFalse(resource.is_stale)
         self.assertTrue(self.provider._build_resource.called)
 
+    @override_settings(MONOCLE_CACHE_INTERNAL_PROVIDERS=True)
     @patch('monocle.providers.cache')
     def test_get_resource_cached_is_primed(self, mock_cache):
-        # Update django settings
-        setattr(settings, 'MONOCLE_CACHE_INTERNAL_PROVIDERS', True)
-
         resource = Resource(self.resource_url)
 
         mock_cache.get_or_prime = mock_cache
@@ -210,6 +462,69 @@ class InternalProviderTestCase(TestCase):
 
         self.assertEqual((100, 100), nearest)
 
+    def test_nearest_allowed_size_mixed_sizes(self):
+        self.provider.DIMENSIONS = [(400, 100), (100, 400), (300, 300), (300, 200), (50, 50)]
+
+        for maxdim, expected in [((500, 500), (400, 100)), ((350, 350), (300, 300)),
+                                 ((350, 250), (300, 200)), ((200, 500), (100, 400)),
+                                 ((200, 200), (50, 50)), ((40, 500), (40, 500))]:
+            self.assertEqual(expected, self.provider.nearest_allowed_size(1000, 1000, *maxdim))
+
+    def test_dimension_index_built_once(self):
+        self.provider.DIMENSIONS = [(50, 50), (100, 100)]
+        index = self.provider._dimension_index()
+        self.assertIs(index, self.provider._dimension_index())
+
+        self.provider.nearest_allowed_size(100, 100, maxwidth=75, maxheight=75)
+        self.assertEqual((50, 50), index.memo[(75, 75)])
+
+        self.provider.DIMENSIONS = [(10, 10)]
+        self.assertIsNot(index, self.provider._dimension_index())
+
+    def test_size(self):
+        self.provider.DIMENSIONS = [(50, 50), (100, 100)]
+        self.provider._params = {'maxwidth': 75, 'maxheight': 200}
+
+        self.assertEqual((50, 50), self.provider.size)
+        self.assertEqual(50, self.provider.width)
+        self.assertEqual(50, self.provider.height)
+
+
+class CountingProvider(InternalProvider):
+    resource_type = 'rich'
+    DIMENSIONS = [(100, 100), (200, 200)]
+    DEFAULT_WIDTH = DEFAULT_HEIGHT = 200
+    LAZY_ATTRIBUTES = ('thumbnail_url',)
+
+    def __init__(self):
+        self.calls = {'size': 0, 'html': 0, 'thumbnail_url': 0}
+
+    def nearest_allowed_size(self, *args, **kwargs):
+        self.calls['size'] += 1
+        return super(CountingProvider, self).nearest_allowed_size(*args, **kwargs)
+
+    @property
+    def html(self):
+        self.calls['html'] += 1
+        return '%sx%s' % (self.width, self.height)
+
+    @property
+    def thumbnail_url(self):
+        self.calls['thumbnail_url'] += 1
+        return 'thumb-%s' % self.width
+
+
+class SlowProvider(InternalProvider):
+    resource_type = 'rich'
+    DIMENSIONS = [(x, x) for x in range(100, 500, 100)]
+
+    @property
+    def html(self):
+        # Give other threads every chance to interleave
+        width = self.width
+        time.sleep(0.001)
+        return '%sx%s' % (width, self.height)
+
 
 class TestInternalProvider(InternalProvider):
     url_schemes = ['http://test.biz/*']
@@ -219,6 +534,13 @@ class TestInternalProvider(InternalProvider):
         return cls()
 
 
+class CustomMatchProvider(TestInternalProvider):
+
+    @classmethod
+    def match(cls, url):
+        return 'custom=1' in url
+
+
 class ProviderRegistryTestCase(TestCase):
 
     def setUp(self):
@@ -245,6 +567,21 @@ class ProviderRegistryTestCase(TestCase):
         self.registry.ensure_populated()
         self.assertIn(self.stored, self.registry)
 
+    @patch('monocle.providers.synced')
+    def test_ensure_populated_once(self, synced):
+        synced.return_value = True
+
+        self.registry.clear()
+        self.registry.ensure_populated()
+        self.registry._providers['external'] = []
+        self.registry.ensure_populated()
+        self.assertEqual(1, synced.call_count)
+
+        # Clearing requires populating again
+        self.registry.clear()
+        self.registry.ensure_populated()
+        self.assertEqual(2, synced.call_count)
+
     def test_update_adds_missing_from_signal(self):
         provider = ThirdPartyProvider(api_endpoint='http://example.com',
                                       resource_type='photo')
@@ -293,12 +630,187 @@ class ProviderRegistryTestCase(TestCase):
 
         self.assertTrue(isinstance(self.registry.match('http://test.biz/foo'), TestInternalProvider))
 
+    def test_match_many(self):
+        self.registry.clear()
+        self.registry.ensure_populated()
+        self.registry.register(TestInternalProvider)
+
+        urls = ['http://test.biz/1', 'http://test.biz/2', 'http://www.youtube.com/foo', 'FOO']
+
+        get_objects = Mock(wraps=TestInternalProvider.get_objects)
+        with patch.object(TestInternalProvider, 'get_objects', get_objects):
+            matched = self.registry.match_many(urls + urls)
+
+        self.assertEqual(1, get_objects.call_count)
+        self.assertEqual(sorted(get_objects.call_args[0][0]), urls[:2])
+        self.assertEqual(set(urls), set(matched))
+        self.assertTrue(isinstance(matched['http://test.biz/1'], TestInternalProvider))
+        self.assertTrue(isinstance(matched['http://test.biz/2'], TestInternalProvider))
+        self.assertEqual(self.stored, matched['http://www.youtube.com/foo'])
+        self.assertIsNone(matched['FOO'])
+
+    def _get_object(self, url):
+        if url.endswith('bad'):
+            raise Exception
+        return TestInternalProvider()
+
+    def test_match_many_failed_objects(self):
+        self.registry.clear()
+        self.registry.register(TestInternalProvider)
+
+        # A failed batch falls back to get_object per URL
+        with patch.object(TestInternalProvider, 'get_objects', side_effect=Exception):
+            with patch.object(TestInternalProvider, 'get_object', side_effect=self._get_object):
+                matched = self.registry.match_many(['http://test.biz/1', 'http://test.biz/bad'])
+
+        self.assertTrue(isinstance(matched['http://test.biz/1'], TestInternalProvider))
+        self.assertIsNone(matched['http://test.biz/bad'])
+
+    def test_get_objects_failed_object(self):
+        with patch.object(TestInternalProvider, 'get_object', side_effect=self._get_object):
+            objects = TestInternalProvider.get_objects(['http://test.biz/1', 'http://test.biz/bad'])
+
+        self.assertTrue(isinstance(objects['http://test.biz/1'], TestInternalProvider))
+        self.assertIsNone(objects['http://test.biz/bad'])
+
     def test_match_has_no_match(self):
         self.assertIsNone(self.registry.match('FOO'))
 
+    def test_may_match(self):
+        self.registry.clear()
+        self.registry.ensure_populated()
+        self.registry.register(TestInternalProvider)
+
+        self.assertTrue(self.registry.may_match('http://test.biz/foo'))
+        self.assertTrue(self.registry.may_match('http://www.youtube.com/watch?v=foo'))
+        self.assertFalse(self.registry.may_match('http://youtube.com.example.com/watch'))
+        self.assertFalse(self.registry.may_match('http://example.com/foo'))
+
+    def test_may_match_unindexable_scheme(self):
+        self.registry.clear()
+        self.registry.ensure_populated()
+        URLScheme.objects.create(scheme='http://www.*.com/foo', provider=self.stored)
+
+        self.assertTrue(self.registry.may_match('http://www.example.com/foo'))
+        self.assertTrue(self.registry.may_match('http://www.youtube.com/watch?v=foo'))
+        self.assertFalse(self.registry.may_match('http://example.com/foo'))
+
+    def test_may_match_fixtures(self):
+        # Unindexable schemes of some providers don't disable the index for the others
+        call_command('loaddata', 'initial_data', verbosity=0)
+        self.registry.clear()
+        self.registry.ensure_populated()
+
+        self.assertTrue(self.registry.may_match('http://www.flickr.com/photos/foo/1'))
+        self.assertTrue(self.registry.may_match('http://twitter.yfrog.com/foo'))
+        self.assertTrue(self.registry.may_match('http://i1.photobucket.com/albums/foo'))
+
+        self.assertFalse(self.registry.may_match('http://example.com/foo'))
+
+        hosts, suffixes, fallback = self.registry._indexes()[1]
+        self.assertIn('www.flickr.com', hosts)
+        self.assertEqual(2, len(fallback))
+
+    def test_may_match_reindexes_on_change(self):
+        self.registry.clear()
+        self.registry.ensure_populated()
+        self.assertFalse(self.registry.may_match('http://test.biz/foo'))
+
+        self.registry.register(TestInternalProvider)
+        self.assertTrue(self.registry.may_match('http://test.biz/foo'))
+
     def test_match_inactive(self):
         self.registry.clear()
         self.registry.ensure_populated()
         TestInternalProvider.is_active = False
         self.assertIsNone(self.registry.match('http://test.biz/foo'))
         TestInternalProvider.is_active = True
+
+    def test_exposed(self):
+        self.registry.clear()
+        self.registry.ensure_populated()
+        self.registry.register(TestInternalProvider)
+
+        hidden = ThirdPartyProvider.objects.create(api_endpoint='http://vimeo.com/oembed',
+                                                   resource_type='video')
+        hidden.is_active = False
+        hidden.expose = True
+        self.registry.update(hidden)
+
+        with patch.object(TestInternalProvider, 'expose', False):
+            self.assertEqual([], self.registry.exposed())
+
+        self.stored.expose = True
+        self.registry.update(self.stored)
+
+        with patch.object(TestInternalProvider, 'expose', True):
+            self.assertEqual([TestInternalProvider, self.stored], self.registry.exposed())
+
+    def test_changes_replace_snapshot(self):
+        self.registry.clear()
+        snapshot = self.registry._providers
+
+        self.registry.register(TestInternalProvider)
+        self.assertEqual((), snapshot['internal'])
+        self.assertEqual((TestInternalProvider,), self.registry._providers['internal'])
+
+        snapshot = self.registry._providers
+        self.registry.unregister(TestInternalProvider)
+        self.assertEqual((TestInternalProvider,), snapshot['internal'])
+        self.assertEqual((), self.registry._providers['internal'])
+
+    def test_warm(self):
+        self.registry.clear()
+
+        with patch.object(self.registry, '_compile_schemes') as compile_schemes:
+            self.registry.warm()
+            self.assertEqual(1, compile_schemes.call_count)
+
+            self.registry.match('http://www.youtube.com/foo')
+            self.registry.may_match('http://www.youtube.com/foo')
+            self.assertEqual(1, compile_schemes.call_count)
+
+        self.registry.register(TestInternalProvider)
+        self.assertTrue(isinstance(self.registry.match('http://test.biz/foo'), TestInternalProvider))
+
+    def test_custom_match(self):
+        self.registry.clear()
+        self.registry.register(CustomMatchProvider)
+
+        self.assertFalse(self.registry._overrides_match(TestInternalProvider))
+        self.assertFalse(self.registry._overrides_match(self.stored))
+        self.assertTrue(self.registry._overrides_match(CustomMatchProvider))
+
+        url = 'http://other.biz/?custom=1'
+        self.assertTrue(self.registry.may_match(url))
+        self.assertTrue(isinstance(self.registry.match(url), CustomMatchProvider))
+        self.assertTrue(isinstance(self.registry.match_many([url])[url], CustomMatchProvider))
+        self.assertIsNone(self.registry.match('http://test.biz/foo'))
+
+    def test_match_during_changes(self):
+        self.registry.clear()
+        self.registry.register(TestInternalProvider)
+        errors = []
+        done = threading.Event()
+
+        def _match():
+            try:
+                while not done.is_set():
+                    if not isinstance(self.registry.match('http://test.biz/foo'), TestInternalProvider):
+                        errors.append('No match')
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=_match) for i in range(4)]
+        for thread in threads:
+            thread.start()
+
+        for i in range(200):
+            self.registry.update(Provider())
+            self.registry.unregister(self.registry._providers['external'][-1])
+
+        done.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
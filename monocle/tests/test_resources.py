@@ -1,9 +1,12 @@
-from unittest2 import TestCase
+import json
+import pickle
 
-from django.conf import settings as _settings
+from mock import patch
+from unittest2 import TestCase
 
-from monocle.resources import Resource
+from monocle.resources import Resource, _get_template, parse_xml
 from monocle.settings import settings
+from monocle.tests.utils import override_settings
 
 
 class ResourceTestCase(TestCase):
@@ -12,33 +15,29 @@ class ResourceTestCase(TestCase):
         self.resource_url = 'http://example.com'
         self.resource = Resource(self.resource_url)
 
-    def _set_ttl_settings(self, min=100, default=1000):
-        setattr(_settings, 'MONOCLE_RESOURCE_MIN_TTL', min)
-        setattr(_settings, 'MONOCLE_RESOURCE_DEFAULT_TTL', default)
-
+    @override_settings(MONOCLE_RESOURCE_MIN_TTL=100, MONOCLE_RESOURCE_DEFAULT_TTL=1000)
     def test_get_ttl_uses_min_ttl(self):
-        self._set_ttl_settings()
         self.resource['cache_age'] = 1
         self.assertEqual(settings.RESOURCE_MIN_TTL, self.resource.get_ttl())
 
+    @override_settings(MONOCLE_RESOURCE_MIN_TTL=100, MONOCLE_RESOURCE_DEFAULT_TTL=1000)
     def test_get_ttl_uses_default_ttl(self):
         if 'cache_age' in self.resource:
             del self.resource._data['cache_age']
-        self._set_ttl_settings()
         self.assertEqual(settings.RESOURCE_DEFAULT_TTL, self.resource.get_ttl())
 
+    @override_settings(MONOCLE_RESOURCE_MIN_TTL=100, MONOCLE_RESOURCE_DEFAULT_TTL=1000)
     def test_get_ttl_uses_default_ttl_on_error(self):
-        self._set_ttl_settings()
         self.resource['cache_age'] = 'FOO'
         self.assertEqual(settings.RESOURCE_DEFAULT_TTL, self.resource.get_ttl())
 
+    @override_settings(MONOCLE_RESOURCE_MIN_TTL=100, MONOCLE_RESOURCE_DEFAULT_TTL=1000)
     def test_set_ttl_uses_min_ttl(self):
-        self._set_ttl_settings()
         self.resource.set_ttl(settings.RESOURCE_MIN_TTL - 1)
         self.assertEqual(self.resource.ttl, settings.RESOURCE_MIN_TTL)
 
+    @override_settings(MONOCLE_RESOURCE_MIN_TTL=100, MONOCLE_RESOURCE_DEFAULT_TTL=1000)
     def test_set_ttl_uses_default_ttl_on_error(self):
-        self._set_ttl_settings()
         self.resource.set_ttl('FOO')
         self.assertEqual(self.resource.ttl, settings.RESOURCE_DEFAULT_TTL)
 
@@ -72,14 +71,18 @@ class ResourceTestCase(TestCase):
         }
         self.assertFalse(self.resource.is_valid)
 
+    @override_settings(MONOCLE_RESOURCE_URLIZE_INVALID=True)
     def test_render_urlizes(self):
-        setattr(_settings, 'MONOCLE_RESOURCE_URLIZE_INVALID', True)
         self.assertIn('href="%s"' % self.resource.url, self.resource.render())
 
+    @override_settings(MONOCLE_RESOURCE_URLIZE_INVALID=False)
     def test_render_does_not_urlize(self):
-        setattr(_settings, 'MONOCLE_RESOURCE_URLIZE_INVALID', False)
         self.assertEqual(self.resource.url, self.resource.render())
 
+    @override_settings(MONOCLE_RESOURCE_URLIZE_INVALID=False)
+    def test_render_requested_url(self):
+        self.assertEqual('http://youtu.be/foo', self.resource.render('http://youtu.be/foo'))
+
     def test_render_correct_for_type(self):
         # Photo render <img/>
         self.resource._data = {
@@ -98,3 +101,94 @@ class ResourceTestCase(TestCase):
             'height': 100
         }
         self.assertIn('FooBar HTML Content', self.resource.render())
+
+    @patch('monocle.resources.get_template')
+    def test_templates_loaded_once(self, get_template):
+        self.assertIs(get_template.return_value, _get_template('monocle/test-loaded-once.html'))
+        self.assertIs(get_template.return_value, _get_template('monocle/test-loaded-once.html'))
+        self.assertEqual(1, get_template.call_count)
+
+    def make_valid(self):
+        self.resource._data = {'type': 'photo', 'url': 'http://foo.com/a.jpg?a=1&b=2',
+                               'width': 100, 'height': 50, 'title': u'\xe9t\xe9', 'author_name': ''}
+
+    def test_xml(self):
+        self.make_valid()
+        xml = self.resource.xml
+
+        self.assertTrue(xml.startswith('<?xml version="1.0" encoding="utf-8" standalone="yes"?>'))
+        self.assertIn('<url>http://foo.com/a.jpg?a=1&amp;b=2</url>', xml)
+        self.assertIn('<width>100</width>', xml)
+        self.assertIn(u'<title>\xe9t\xe9</title>'.encode('utf-8'), xml)
+        self.assertNotIn('author_name', xml)
+
+    def test_xml_round_trip(self):
+        self.make_valid()
+        data = parse_xml(self.resource.xml)
+
+        self.assertEqual(self.resource.data, data)
+
+    def test_parse_xml_invalid(self):
+        self.assertRaises(ValueError, parse_xml, 'foo')
+        self.assertRaises(ValueError, parse_xml, '<foo><type>photo</type></foo>')
+
+    def test_parse_xml_rejects_doctype(self):
+        entities = ('<?xml version="1.0"?>'
+                    '<!DOCTYPE oembed [<!ENTITY a "aaaaaaaaaa"><!ENTITY b "&a;&a;&a;">]>'
+                    '<oembed><title>&b;</title></oembed>')
+        external = ('<?xml version="1.0"?>'
+                    '<!DOCTYPE oembed [<!ENTITY e SYSTEM "file:///etc/passwd">]>'
+                    '<oembed><title>&e;</title></oembed>')
+
+        self.assertRaises(ValueError, parse_xml, entities)
+        self.assertRaises(ValueError, parse_xml, external)
+        self.assertRaises(ValueError, parse_xml, '<!DOCTYPE oembed><oembed></oembed>')
+
+    def test_serialized_forms_kept(self):
+        self.make_valid()
+        self.assertIs(self.resource.json, self.resource.json)
+        self.assertIs(self.resource.xml, self.resource.xml)
+
+    def test_serialized_forms_updated(self):
+        self.make_valid()
+        self.resource.json, self.resource.xml
+
+        self.resource['title'] = 'Foo'
+        self.assertEqual('Foo', json.loads(self.resource.json)['title'])
+        self.assertIn('<title>Foo</title>', self.resource.xml)
+
+        self.resource._data = {'type': 'link'}
+        self.assertEqual('{"type": "link"}', self.resource.json)
+
+    def test_serialized_forms_pickled(self):
+        self.make_valid()
+        resource = pickle.loads(pickle.dumps(self.resource))
+
+        with patch('monocle.resources.json') as mock_json:
+            self.assertEqual(self.resource.json, resource.json)
+            self.assertEqual(self.resource.xml, resource.xml)
+            self.assertFalse(mock_json.dumps.called)
+
+    def test_lazy(self):
+        calls = []
+        func = lambda: calls.append(1) or 'Foo'
+        resource = Resource('foo', {'type': 'link'}, lazy={'title': func})
+
+        self.assertIn('title', resource)
+        self.assertEqual([], calls)
+
+        self.assertEqual('Foo', resource['title'])
+        self.assertEqual('Foo', resource['title'])
+        self.assertEqual([1], calls)
+
+    def test_lazy_resolved_for_data_and_pickling(self):
+        resource = Resource('foo', {'type': 'link'}, lazy={'title': lambda: 'Foo'})
+        self.assertEqual('Foo', resource.data['title'])
+
+        resource = Resource('foo', {'type': 'link'}, lazy={'title': lambda: 'Foo'})
+        self.assertEqual('Foo', pickle.loads(pickle.dumps(resource))['title'])
+
+    def test_lazy_overwritten(self):
+        resource = Resource('foo', {'type': 'link'}, lazy={'title': lambda: 'Foo'})
+        resource['title'] = 'Bar'
+        self.assertEqual('Bar', resource['title'])
@@ -0,0 +1,41 @@
+from mock import Mock, patch
+from unittest2 import TestCase, skipIf
+
+from monocle.settings import Settings, _setting_changed_signal
+from monocle.tests.utils import override_settings
+
+
+class SettingsTestCase(TestCase):
+
+    def setUp(self):
+        self.settings = Settings()
+
+    def test_defaults(self):
+        self.assertEqual('MONOCLE', self.settings.CACHE_KEY_PREFIX)
+
+    def test_resolved_once(self):
+        self.settings.HTTP_TIMEOUT
+        self.assertIn('HTTP_TIMEOUT', self.settings.__dict__)
+        self.assertIn('CACHE_AGE', self.settings.__dict__)
+
+    @skipIf(_setting_changed_signal() is None, 'setting_changed is not available')
+    def test_refreshed_on_setting_changed(self):
+        from django.test.utils import override_settings
+
+        self.assertEqual(3, self.settings.HTTP_TIMEOUT)
+
+        with override_settings(MONOCLE_HTTP_TIMEOUT=10):
+            self.assertEqual(10, self.settings.HTTP_TIMEOUT)
+
+        self.assertEqual(3, self.settings.HTTP_TIMEOUT)
+
+    def test_resolve_without_signal(self):
+        with patch('monocle.settings._setting_changed_signal', Mock(return_value=None)):
+            self.assertEqual(3, self.settings.HTTP_TIMEOUT)
+
+        with override_settings(MONOCLE_HTTP_TIMEOUT=10):
+            self.settings.resolve()
+            self.assertEqual(10, self.settings.HTTP_TIMEOUT)
+
+    def test_invalid_setting(self):
+        self.assertRaises(AttributeError, getattr, self.settings, 'FOO')
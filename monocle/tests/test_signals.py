@@ -6,7 +6,8 @@ from monocle.consumers import Consumer, HTMLConsumer
 from monocle.signals import (cache_miss,
                              cache_hit,
                              pre_consume,
-                             post_consume)
+                             post_consume,
+                             resource_rendered)
 
 
 def mock_receiver():
@@ -23,7 +24,25 @@ class CacheSignalTestCase(TestCase):
         cached, primed = cache.get_or_prime('foo', 'bar')
 
         self.assertTrue(primed)
-        self.assertTrue(cb.called)
+        self.assertEqual('foo', cb.call_args[1]['key'])
+
+        cache.get('baz')
+        self.assertEqual('baz', cb.call_args[1]['key'])
+
+        cache.get_many(['qux'])
+        self.assertEqual('qux', cb.call_args[1]['key'])
+        cache_miss.disconnect(cb)
+
+    @patch('monocle.cache.cache_miss')
+    def test_cache_signals_not_sent_without_receivers(self, cache_miss):
+        cache_miss.receivers = []
+
+        cache.delete('foo')
+        cache.get('foo')
+        cache.get_or_prime('foo', 'bar')
+        cache.get_many(['baz'])
+
+        self.assertFalse(cache_miss.send.called)
 
     def test_cache_hit_signal(self):
         cb = mock_receiver()
@@ -33,7 +52,11 @@ class CacheSignalTestCase(TestCase):
         cached, primed = cache.get_or_prime('foo', 'bar')
 
         self.assertFalse(primed)
-        self.assertTrue(cb.called)
+        self.assertEqual('foo', cb.call_args[1]['key'])
+
+        cache.get_many(['foo'])
+        self.assertEqual('foo', cb.call_args[1]['key'])
+        cache_hit.disconnect(cb)
 
 
 class ConsumerSignalTestCase(TestCase):
@@ -44,26 +67,79 @@ class ConsumerSignalTestCase(TestCase):
 
     @patch('monocle.consumers.registry')
     def test_base_consumer_signal(self, registry):
+        registry.match.return_value = None
         pre_cb = mock_receiver()
         post_cb = mock_receiver()
 
         pre_consume.connect(pre_cb)
         post_consume.connect(post_cb)
 
-        self.consumer.devour('')
+        self.consumer.devour('http://foo.com')
 
         self.assertTrue(pre_cb.called)
         self.assertTrue(post_cb.called)
 
     @patch('monocle.consumers.registry')
     def test_html_consumer_signals_once(self, registry):
+        registry.match.return_value = None
         pre_cb = mock_receiver()
         post_cb = mock_receiver()
 
         pre_consume.connect(pre_cb)
         post_consume.connect(post_cb)
 
-        self.consumer.devour('')
+        self.html_consumer.devour('<p>http://foo.com http://bar.com</p>')
 
         self.assertEqual(pre_cb.call_count, 1)
         self.assertEqual(post_cb.call_count, 1)
+
+    @patch('monocle.consumers.registry')
+    def test_no_signals_without_candidates(self, registry):
+        pre_cb = mock_receiver()
+        pre_consume.connect(pre_cb)
+
+        self.consumer.devour('Nothing to see here')
+        self.html_consumer.devour('<p>Nothing to see here</p>')
+
+        self.assertFalse(pre_cb.called)
+
+    @patch('monocle.consumers.registry')
+    def test_post_consume_latency(self, registry):
+        registry.match.return_value = None
+        post_cb = mock_receiver()
+        post_consume.connect(post_cb)
+
+        self.consumer.devour('http://foo.com')
+
+        self.assertTrue(post_cb.call_args[1]['latency'] >= 0)
+
+    @patch('monocle.consumers.registry')
+    def test_resource_rendered_signal(self, registry):
+        provider = Mock()
+        provider.get_resource.return_value.render.return_value = 'FOO'
+        registry.match.return_value = provider
+
+        cb = mock_receiver()
+        resource_rendered.connect(cb)
+
+        self.assertEqual('FOO', self.consumer.devour('http://foo.com'))
+
+        kwargs = cb.call_args[1]
+        self.assertEqual('http://foo.com', kwargs['url'])
+        self.assertEqual(provider, kwargs['provider'])
+        self.assertEqual(provider.get_resource.return_value, kwargs['resource'])
+        self.assertTrue(kwargs['latency'] >= 0)
+
+    @patch('monocle.consumers.resource_rendered')
+    @patch('monocle.consumers.post_consume')
+    @patch('monocle.consumers.pre_consume')
+    @patch('monocle.consumers.registry')
+    def test_consumer_signals_not_sent_without_receivers(self, registry, pre, post, rendered):
+        registry.match.return_value.get_resource.return_value.render.return_value = 'FOO'
+        pre.receivers = post.receivers = rendered.receivers = []
+
+        self.consumer.devour('http://foo.com')
+
+        self.assertFalse(pre.send.called)
+        self.assertFalse(post.send.called)
+        self.assertFalse(rendered.send.called)
@@ -1,8 +1,13 @@
-from mock import patch
+import time
+
+from mock import Mock, patch
 from unittest2 import TestCase
 
 from django.template import Context, Template, TemplateSyntaxError
 
+from monocle.templatetags.oembed_tags import _devour, _fragment_ttl
+from monocle.tests.utils import override_settings
+
 
 class TagTestCase(TestCase):
 
@@ -13,7 +18,7 @@ class TagTestCase(TestCase):
         result = tpl.render(Context())
 
         self.assertEqual('FOO', result)
-        devour.assert_called_with('http://foo.com', html=True, maxwidth=None, maxheight=None)
+        devour.assert_called_with('http://foo.com', html=True, maxwidth=None, maxheight=None, timeout=None)
 
     @patch('monocle.templatetags.oembed_tags.devour')
     def test_oembed_tag_with_size(self, devour):
@@ -22,7 +27,31 @@ class TagTestCase(TestCase):
         result = tpl.render(Context())
 
         self.assertEqual('FOO', result)
-        devour.assert_called_with('http://foo.com', html=True, maxwidth=100, maxheight=900)
+        devour.assert_called_with('http://foo.com', html=True, maxwidth=100, maxheight=900, timeout=None)
+
+    @patch('monocle.templatetags.oembed_tags.devour')
+    def test_oembed_tag_with_timeout(self, devour):
+        tpl = Template('{% load oembed_tags %}{% oembed 100x900 timeout=0.3 %}http://foo.com{% endoembed %}')
+        devour.return_value = 'FOO'
+        result = tpl.render(Context())
+
+        self.assertEqual('FOO', result)
+        devour.assert_called_with('http://foo.com', html=True, maxwidth=100, maxheight=900, timeout=0.3)
+
+    @patch('monocle.templatetags.oembed_tags.devour')
+    @override_settings(MONOCLE_CONSUMER_SYNC_TIMEOUT=0.5)
+    def test_oembed_tag_timeout_overrides_setting(self, devour):
+        Template('{% load oembed_tags %}{% oembed %}http://foo.com{% endoembed %}').render(Context())
+        devour.assert_called_with('http://foo.com', html=True, maxwidth=None, maxheight=None, timeout=0.5)
+
+        # Zero opts out of waiting
+        tpl = Template('{% load oembed_tags %}{% oembed timeout=0 %}http://foo.com{% endoembed %}')
+        tpl.render(Context())
+        devour.assert_called_with('http://foo.com', html=True, maxwidth=None, maxheight=None, timeout=0)
+
+    def test_oembed_tag_with_timeout_raises(self):
+        with self.assertRaises(TemplateSyntaxError):
+            Template('{% load oembed_tags %}{% oembed timeout=foo %}http://foo.com{% endoembed %}')
 
     def test_oembed_tag_with_size_raises(self):
         with self.assertRaises(TemplateSyntaxError):
@@ -35,7 +64,7 @@ class TagTestCase(TestCase):
         result = tpl.render(Context())
 
         self.assertEqual('FOO', result)
-        devour.assert_called_with('http://foo.com', html=False, maxwidth=None, maxheight=None)
+        devour.assert_called_with('http://foo.com', html=False, maxwidth=None, maxheight=None, timeout=None)
 
     @patch('monocle.templatetags.oembed_tags.devour')
     def test_oembed_text_tag_with_size(self, devour):
@@ -44,7 +73,7 @@ class TagTestCase(TestCase):
         result = tpl.render(Context())
 
         self.assertEqual('FOO', result)
-        devour.assert_called_with('http://foo.com', html=False, maxwidth=100, maxheight=900)
+        devour.assert_called_with('http://foo.com', html=False, maxwidth=100, maxheight=900, timeout=None)
 
     def test_oembed_text_tag_with_size_raises(self):
         with self.assertRaises(TemplateSyntaxError):
@@ -57,7 +86,7 @@ class TagTestCase(TestCase):
         result = tpl.render(Context({'content': 'http://foo.com'}))
 
         self.assertEqual('FOO', result)
-        devour.assert_called_width('http://foo.com', html=True, maxwidth=None, maxheight=None)
+        devour.assert_called_width('http://foo.com', html=True, maxwidth=None, maxheight=None, timeout=None)
 
     @patch('monocle.templatetags.oembed_tags.devour')
     def test_oembed_filter_with_size(self, devour):
@@ -80,7 +109,7 @@ class TagTestCase(TestCase):
         result = tpl.render(Context({'content': 'http://foo.com'}))
 
         self.assertEqual('FOO', result)
-        devour.assert_called_width('http://foo.com', html=True, maxwidth=None, maxheight=None)
+        devour.assert_called_width('http://foo.com', html=True, maxwidth=None, maxheight=None, timeout=None)
 
     @patch('monocle.templatetags.oembed_tags.devour')
     def test_oembed_text_filter_with_size(self, devour):
@@ -95,3 +124,98 @@ class TagTestCase(TestCase):
         tpl = Template('{% load oembed_tags %}{{ content|oembed_text:"foo" }}')
         with self.assertRaises(TemplateSyntaxError):
             tpl.render(Context({'content': 'http://foo.com'}))
+
+
+def make_resource(url, ttl=100, valid=True, stale=False):
+    return Mock(url=url, ttl=ttl, created=time.time(), is_valid=valid, is_stale=stale)
+
+
+class FragmentCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.settings = patch('monocle.templatetags.oembed_tags.settings').start()
+        self.settings.CACHE_RENDERED_CONTENT = True
+        self.settings.CONSUMER_STREAM_HTML = False
+        self.cache = patch('monocle.templatetags.oembed_tags.cache').start()
+        self.devour = patch('monocle.templatetags.oembed_tags.devour').start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_fragment_ttl(self):
+        self.assertEqual(0, _fragment_ttl([]))
+        self.assertEqual(0, _fragment_ttl([make_resource('a'), None]))
+        self.assertEqual(0, _fragment_ttl([make_resource('a'), make_resource('b', valid=False)]))
+        self.assertEqual(0, _fragment_ttl([make_resource('a', stale=True)]))
+        self.assertAlmostEqual(50, _fragment_ttl([make_resource('a'), make_resource('b', ttl=50)]),
+                               delta=1)
+
+    def test_disabled(self):
+        self.settings.CACHE_RENDERED_CONTENT = False
+        _devour('http://foo.com', html=False)
+
+        self.assertFalse(self.cache.get.called)
+        self.devour.assert_called_with('http://foo.com', html=False, maxwidth=None,
+                                       maxheight=None, timeout=None)
+
+    def test_hit(self):
+        self.cache.get.return_value = 'CACHED'
+
+        self.assertEqual('CACHED', _devour('http://foo.com', maxwidth=100))
+        self.assertFalse(self.devour.called)
+
+    def test_key_varies(self):
+        self.cache.get.return_value = None
+        _devour('http://foo.com', maxwidth=100)
+        _devour('http://foo.com', maxwidth=200)
+        _devour('http://foo.com', html=False, maxwidth=100)
+        _devour(u'http://foo.com/\xe9', maxwidth=100)
+
+        keys = [args[0][0] for args in self.cache.get.call_args_list]
+        self.assertEqual(4, len(set(keys)))
+
+    def test_miss_caches_and_records_dependents(self):
+        resources = [make_resource('http://foo.com', ttl=100),
+                     make_resource('http://bar.com', ttl=50)]
+
+        def devour(content, **kwargs):
+            kwargs['resources'].extend(resources)
+            return 'RENDERED'
+
+        self.cache.get.return_value = None
+        self.devour.side_effect = devour
+
+        self.assertEqual('RENDERED', _devour('http://foo.com http://bar.com'))
+
+        key, value = self.cache.set.call_args[0]
+        self.assertEqual('RENDERED', value)
+        self.assertAlmostEqual(50, self.cache.set.call_args[1]['timeout'], delta=1)
+
+        ttl = self.cache.add_dependent.call_args[1]['timeout']
+        self.assertAlmostEqual(50, ttl, delta=1)
+        self.cache.add_dependent.assert_any_call('fragment:http://foo.com', key, timeout=ttl)
+        self.cache.add_dependent.assert_any_call('fragment:http://bar.com', key, timeout=ttl)
+
+    def test_miss_not_cached_without_dependents(self):
+        def devour(content, **kwargs):
+            kwargs['resources'].append(make_resource('http://foo.com', ttl=100))
+            return 'RENDERED'
+
+        self.cache.get.return_value = None
+        self.cache.add_dependent.return_value = False
+        self.devour.side_effect = devour
+
+        self.assertEqual('RENDERED', _devour('http://foo.com'))
+        self.assertFalse(self.cache.set.called)
+
+    def test_miss_not_cached_with_unfetched_resource(self):
+        def devour(content, **kwargs):
+            kwargs['resources'].append(make_resource('http://foo.com', valid=False))
+            return 'http://foo.com'
+
+        self.cache.get.return_value = None
+        self.devour.side_effect = devour
+
+        self.assertEqual('http://foo.com', _devour('http://foo.com'))
+        self.assertFalse(self.cache.set.called)
+        self.assertFalse(self.cache.add_dependent.called)
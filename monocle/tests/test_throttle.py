@@ -0,0 +1,44 @@
+from mock import patch
+from unittest2 import TestCase
+
+from monocle.cache import cache
+from monocle.tests.utils import override_settings
+from monocle.throttle import consume
+
+
+@override_settings(MONOCLE_THROTTLE_RATE=2, MONOCLE_THROTTLE_PERIOD=10)
+class ConsumeTestCase(TestCase):
+
+    def setUp(self):
+        cache.delete('throttle:foo')
+
+    @override_settings(MONOCLE_THROTTLE_RATE=None)
+    def test_not_throttled(self):
+        for i in range(10):
+            self.assertEqual(0, consume('foo'))
+
+    @patch('monocle.throttle.time')
+    def test_bucket_empties_and_refills(self, time):
+        time.time.return_value = 1000
+        self.assertEqual(0, consume('foo'))
+        self.assertEqual(0, consume('foo'))
+        self.assertEqual(5, consume('foo'))
+
+        # Other clients have their own bucket
+        self.assertEqual(0, consume('bar'))
+
+        time.time.return_value = 1005
+        self.assertEqual(0, consume('foo'))
+        self.assertEqual(5, consume('foo'))
+
+        # Never refills beyond capacity
+        time.time.return_value = 2000
+        self.assertEqual(0, consume('foo', 2))
+        self.assertEqual(5, consume('foo'))
+
+    @patch('monocle.throttle.time')
+    def test_many_tokens(self, time):
+        time.time.return_value = 1000
+        self.assertEqual(0, consume('foo'))
+        self.assertEqual(5, consume('foo', 2))
+        self.assertEqual(10, consume('foo', 3))
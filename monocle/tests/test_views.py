@@ -1,13 +1,23 @@
+import hashlib
+import json
+import time
+
 from mock import Mock, patch
 from unittest2 import TestCase
 
-from monocle.views import oembed
+from django.http import QueryDict
+from django.utils.http import http_date
+
+from monocle import views
+from monocle.tests.utils import override_settings
+from monocle.views import oembed, oembed_batch, oembed_providers
 
 
 class ViewsTestCase(TestCase):
 
     def setUp(self):
         self.request = Mock()
+        self.request.META = {}
 
     def _oembed_status(self):
         return oembed(self.request).status_code
@@ -17,8 +27,34 @@ class ViewsTestCase(TestCase):
             self.request.GET = test
             self.assertEqual(400, self._oembed_status())
 
+    @override_settings(MONOCLE_API_KEYS=['secret'])
+    def test_oembed_requires_api_key(self):
+        for test in [{'url': 'foo'}, {'url': 'foo', 'key': 'wrong'}]:
+            self.request.GET = test
+            self.assertEqual(403, self._oembed_status())
+
+        self.request.GET = {'url': 'foo', 'format': 'yaml', 'key': 'secret'}
+        self.assertEqual(501, self._oembed_status())
+
+        self.request.GET = {'url': 'foo', 'format': 'yaml'}
+        self.request.META = {'HTTP_X_API_KEY': 'secret'}
+        self.assertEqual(501, self._oembed_status())
+
+    @patch('monocle.views.registry')
+    @patch('monocle.views.consume')
+    def test_oembed_throttled(self, consume, registry):
+        consume.return_value = 30
+        self.request.GET = {'url': 'foo'}
+        self.request.META = {'REMOTE_ADDR': '127.0.0.1'}
+
+        response = oembed(self.request)
+        self.assertEqual(429, response.status_code)
+        self.assertEqual('30', response['Retry-After'])
+        consume.assert_called_with('addr:127.0.0.1', 1)
+        self.assertFalse(registry.match.called)
+
     def test_oembed_not_implemented_format(self):
-        self.request.GET = {'url': 'foo', 'format': 'xml'}
+        self.request.GET = {'url': 'foo', 'format': 'yaml'}
         self.assertEqual(501, self._oembed_status())
 
     @patch('monocle.views.registry')
@@ -37,6 +73,7 @@ class ViewsTestCase(TestCase):
     def test_oembed_handles_max_dim_params_valid(self, registry):
         provider = Mock()
         provider.expose = True
+        provider.get_resource.return_value.is_valid = False
         registry.match.return_value = provider
 
         self.request.GET = {'url': 'foo', 'maxwidth': '100', 'maxheight': '200'}
@@ -47,6 +84,7 @@ class ViewsTestCase(TestCase):
     def test_oembed_handles_max_dim_params_filter_none(self, registry):
         provider = Mock()
         provider.expose = True
+        provider.get_resource.return_value.is_valid = False
         registry.match.return_value = provider
 
         # Filter None
@@ -58,6 +96,7 @@ class ViewsTestCase(TestCase):
     def test_oembed_handles_max_dim_params_filter_invalid(self, registry):
         provider = Mock()
         provider.expose = True
+        provider.get_resource.return_value.is_valid = False
         registry.match.return_value = provider
 
         # Filter Invalid
@@ -65,15 +104,236 @@ class ViewsTestCase(TestCase):
         oembed(self.request)
         provider.get_resource.assert_called_with('foo', maxwidth=100)
 
-    @patch('monocle.views.registry')
-    def test_oembed_handles_jsonp_callbacks(self, registry):
+    def mock_resource(self, registry):
         resource = Mock()
         resource.json = '{"foo": "bar"}'
+        resource.created = time.time()
+        resource.ttl = 100
         provider = Mock()
         provider.expose = True
         provider.get_resource.return_value = resource
         registry.match.return_value = provider
+        return resource
+
+    @patch('monocle.views.registry')
+    def test_oembed_handles_jsonp_callbacks(self, registry):
+        self.mock_resource(registry)
 
         self.request.GET = {'url': 'foo', 'callback': 'acallback'}
         response = oembed(self.request)
         self.assertEqual('acallback({"foo": "bar"});', response.content)
+
+    @patch('monocle.views.registry')
+    def test_oembed_xml(self, registry):
+        resource = self.mock_resource(registry)
+        resource.xml = '<oembed/>'
+
+        self.request.GET = {'url': 'foo', 'format': 'xml', 'callback': 'acallback'}
+        response = oembed(self.request)
+
+        self.assertEqual('<oembed/>', response.content)
+        self.assertEqual('text/xml', response['Content-Type'])
+
+    @patch('monocle.views.registry')
+    def test_oembed_caching_headers(self, registry):
+        resource = self.mock_resource(registry)
+        resource.created -= 40
+
+        self.request.GET = {'url': 'foo'}
+        response = oembed(self.request)
+
+        self.assertEqual('"%s"' % hashlib.md5('{"foo": "bar"}').hexdigest(), response['ETag'])
+        self.assertIn(response['Cache-Control'], ['public, max-age=59', 'public, max-age=60'])
+        self.assertFalse(response.has_header('Vary'))
+        self.assertEqual(http_date(resource.created), response['Last-Modified'])
+
+    @patch('monocle.views.registry')
+    @override_settings(MONOCLE_API_KEYS=['secret'])
+    def test_oembed_private_with_api_keys(self, registry):
+        self.mock_resource(registry)
+
+        self.request.GET = {'url': 'foo'}
+        self.request.META = {'HTTP_X_API_KEY': 'secret'}
+        response = oembed(self.request)
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response['Cache-Control'].startswith('private, '))
+        self.assertEqual('X-Api-Key', response['Vary'])
+
+    @patch('monocle.views.registry')
+    def test_oembed_not_modified(self, registry):
+        self.mock_resource(registry)
+        self.request.GET = {'url': 'foo'}
+        etag = oembed(self.request)['ETag']
+
+        self.request.META = {'HTTP_IF_NONE_MATCH': etag}
+        response = oembed(self.request)
+
+        self.assertEqual(304, response.status_code)
+        self.assertEqual('', response.content)
+        self.assertEqual(etag, response['ETag'])
+
+        self.request.META = {'HTTP_IF_NONE_MATCH': '"other"'}
+        self.assertEqual(200, oembed(self.request).status_code)
+
+
+class BatchViewTestCase(TestCase):
+
+    def setUp(self):
+        self.request = Mock()
+        self.request.method = 'GET'
+        self.request.GET = QueryDict('')
+
+    def make_resource(self, data, valid=True, stale=False):
+        return Mock(data=data, is_valid=valid, is_stale=stale)
+
+    def make_provider(self, internal=False, expose=True):
+        provider = Mock()
+        provider._internal = internal
+        provider.expose = expose
+        provider.get_resource_url.side_effect = lambda url, **kwargs: 'REQUEST %s' % url
+        return provider
+
+    def test_bad_request(self):
+        self.assertEqual(400, oembed_batch(self.request).status_code)
+
+        self.request.method = 'POST'
+        for body in ['foo', '{"urls": "foo"}', '[]']:
+            self.request.body = body
+            self.assertEqual(400, oembed_batch(self.request).status_code)
+
+    @patch('monocle.views.settings')
+    def test_too_many_urls(self, settings):
+        settings.BATCH_MAX_URLS = 1
+        self.request.GET = QueryDict('url=a&url=b')
+        self.assertEqual(400, oembed_batch(self.request).status_code)
+
+    @patch('monocle.views.registry')
+    @patch('monocle.views.consume')
+    def test_throttled_per_url(self, consume, registry):
+        consume.return_value = 5
+        self.request.GET = QueryDict('url=a&url=b&url=a&key=secret')
+
+        with override_settings(MONOCLE_API_KEYS=['secret']):
+            self.assertEqual(429, oembed_batch(self.request).status_code)
+
+        consume.assert_called_with('key:secret', 3)
+        self.assertFalse(registry.match_many.called)
+
+    def test_not_allowed(self):
+        self.request.method = 'PUT'
+        self.assertEqual(405, oembed_batch(self.request).status_code)
+
+    @patch('monocle.views.fetch_resources')
+    @patch('monocle.views.cache')
+    @patch('monocle.views.registry')
+    def test_batch(self, registry, cache, fetch_resources):
+        external = self.make_provider()
+        internal = self.make_provider(internal=True)
+        hidden = self.make_provider(expose=False)
+        providers = {'a': external, 'b': external, 'c': internal, 'd': hidden, 'e': None}
+        registry.match_many.return_value = providers
+
+        cache.get_many.side_effect = [{'REQUEST a': self.make_resource({'title': 'A'})},
+                                      {'REQUEST b': self.make_resource({'title': 'B'})}]
+        fetch_resources.return_value = ['REQUEST b']
+        internal.get_resource.return_value = self.make_resource({'title': 'C'})
+
+        self.request.GET = QueryDict('url=a&url=b&url=c&url=d&url=e&maxwidth=100')
+        response = oembed_batch(self.request)
+
+        self.assertEqual({'a': {'title': 'A'}, 'b': {'title': 'B'}, 'c': {'title': 'C'},
+                          'd': None, 'e': None}, json.loads(response.content))
+
+        # One lookup for all external resources, then one for those fetched
+        self.assertEqual(sorted(cache.get_many.call_args_list[0][0][0]), ['REQUEST a', 'REQUEST b'])
+        cache.get_many.assert_called_with(['REQUEST b'])
+        fetch_resources.assert_called_with(['REQUEST b'], 3)
+
+        external.get_resource_url.assert_any_call('a', maxwidth=100)
+        internal.get_resource.assert_called_with('c', maxwidth=100)
+        self.assertFalse(external.get_resource.called)
+
+    @patch('monocle.views.fetch_resources')
+    @patch('monocle.views.cache')
+    @patch('monocle.views.registry')
+    def test_batch_post_unavailable(self, registry, cache, fetch_resources):
+        provider = self.make_provider()
+        provider.get_resource.return_value = self.make_resource({}, valid=False)
+        registry.match_many.return_value = {'a': provider}
+
+        cache.get_many.return_value = {}
+        fetch_resources.return_value = []
+
+        self.request.method = 'POST'
+        self.request.body = '{"urls": ["a"], "maxheight": 200}'
+        response = oembed_batch(self.request)
+
+        self.assertEqual({'a': None}, json.loads(response.content))
+        provider.get_resource.assert_called_with('a', maxheight=200)
+
+    @patch('monocle.views.registry')
+    def test_batch_post_raw_post_data(self, registry):
+        # Requests of Django 1.3 have no body attribute
+        registry.match_many.return_value = {'a': None}
+
+        request = Mock(spec=['method', 'GET', 'META', 'raw_post_data'])
+        request.method, request.GET, request.META = 'POST', QueryDict(''), {}
+        request.raw_post_data = '["a"]'
+
+        self.assertEqual({'a': None}, json.loads(oembed_batch(request).content))
+
+
+class ProvidersViewTestCase(TestCase):
+
+    def setUp(self):
+        self.request = Mock()
+        self.request.GET = {}
+        self.request.META = {}
+
+        views._providers_document = None
+        self.registry = patch('monocle.views.registry').start()
+        self.registry._version = 1
+        self.registry.exposed.return_value = [self.make_provider('Foo')]
+
+    def tearDown(self):
+        patch.stopall()
+        views._providers_document = None
+
+    def make_provider(self, name):
+        return Mock(__unicode__=Mock(return_value=name), resource_type='photo',
+                    url_schemes=['http://%s.com/*' % name.lower()])
+
+    def test_providers(self):
+        response = oembed_providers(self.request)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'providers': [{'name': 'Foo', 'type': 'photo',
+                                         'url_schemes': ['http://foo.com/*']}]},
+                         json.loads(response.content))
+        self.assertEqual('"%s"' % hashlib.md5(response.content).hexdigest(), response['ETag'])
+
+    def test_serialized_once_per_version(self):
+        etag = oembed_providers(self.request)['ETag']
+        self.assertEqual(etag, oembed_providers(self.request)['ETag'])
+        self.assertEqual(1, self.registry.exposed.call_count)
+
+        self.registry._version = 2
+        self.registry.exposed.return_value = [self.make_provider('Bar')]
+        response = oembed_providers(self.request)
+
+        self.assertEqual(2, self.registry.exposed.call_count)
+        self.assertNotEqual(etag, response['ETag'])
+        self.assertEqual('Bar', json.loads(response.content)['providers'][0]['name'])
+
+    def test_not_modified(self):
+        etag = oembed_providers(self.request)['ETag']
+
+        self.request.META = {'HTTP_IF_NONE_MATCH': etag}
+        response = oembed_providers(self.request)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(etag, response['ETag'])
+
+        self.registry._version = 2
+        self.registry.exposed.return_value = [self.make_provider('Bar')]
+        self.assertEqual(200, oembed_providers(self.request).status_code)
@@ -0,0 +1,56 @@
+"""
+Test helpers that work on all supported Django versions
+"""
+from functools import wraps
+
+from django.conf import settings as _settings
+
+from monocle.settings import settings
+
+
+_missing = object()
+
+
+class override_settings(object):
+    """
+    Overrides Django settings and resolves monocle settings again. This is like
+    Django's own ``override_settings``, which only exists since Django 1.4 and
+    can't decorate plain unittest test cases. Acts as a context manager or as a
+    decorator of test functions and test case classes.
+    """
+
+    def __init__(self, **kwargs):
+        self.options = kwargs
+        self.previous = []
+
+    def __enter__(self):
+        self.previous.append(dict((key, getattr(_settings, key, _missing)) for key in self.options))
+        for key, value in self.options.items():
+            setattr(_settings, key, value)
+        settings.resolve()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for key, value in self.previous.pop().items():
+            if value is _missing:
+                delattr(_settings, key)
+            else:
+                setattr(_settings, key, value)
+        settings.resolve()
+
+    def __call__(self, func):
+        if isinstance(func, type):
+            setUp = func.setUp
+
+            def _setUp(test):
+                self.__enter__()
+                test.addCleanup(self.__exit__, None, None, None)
+                setUp(test)
+
+            func.setUp = _setUp
+            return func
+
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return inner
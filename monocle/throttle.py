@@ -0,0 +1,51 @@
+"""
+Token bucket rate limiting for the provider endpoints in :mod:`monocle.views`.
+Buckets are kept in the Django cache so that limits are shared by all processes
+using the same cache backend::
+
+    from monocle.throttle import consume
+"""
+import math
+import time
+
+from monocle.cache import cache
+from monocle.settings import settings
+
+
+def consume(ident, tokens=1):
+    """
+    Takes tokens from the bucket of a client. Buckets hold at most ``THROTTLE_RATE``
+    tokens and refill at ``THROTTLE_RATE`` tokens per ``THROTTLE_PERIOD`` seconds,
+    both from :mod:`monocle.settings`. If ``THROTTLE_RATE`` is None, nothing is throttled.
+
+    Reading and updating a bucket is not atomic, so concurrent requests of the same
+    client may occasionally get a few tokens more than allowed. A rejected request
+    does not write to the cache at all.
+
+    :param string ident: Identifies the client, e.g. an API key or address
+    :param integer tokens: Number of tokens to take
+    :returns: 0 if the tokens were taken, otherwise the number of seconds until
+              enough tokens are available
+    """
+    rate = settings.THROTTLE_RATE
+    if not rate:
+        return 0
+
+    period = float(settings.THROTTLE_PERIOD)
+    key = 'throttle:%s' % ident
+    now = time.time()
+
+    bucket = cache.get(key)
+    if bucket is None:
+        available = rate
+    else:
+        available, updated = bucket
+        available = min(rate, available + (now - updated) * rate / period)
+
+    if tokens > available:
+        # More tokens than a full bucket holds can never be taken at once
+        wait = period if tokens > rate else (tokens - available) * period / rate
+        return max(1, int(math.ceil(wait)))
+
+    cache.set(key, (available - tokens, now), timeout=int(math.ceil(period)))
+    return 0
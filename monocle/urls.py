@@ -2,4 +2,6 @@ from django.conf.urls.defaults import *
 
 urlpatterns = patterns('monocle.views',
     url(r'^$', 'oembed', name='oembed'),
+    url(r'^batch/$', 'oembed_batch', name='oembed_batch'),
+    url(r'^providers/$', 'oembed_providers', name='oembed_providers'),
 )
@@ -1,4 +1,42 @@
-from urlparse import urlparse, parse_qs
+from urllib import urlencode
+from urlparse import parse_qs, parse_qsl, urlparse, urlsplit, urlunsplit
+
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Query parameters that only track how a link was shared and never identify content
+TRACKING_PARAMS = frozenset(['utm_source', 'utm_medium', 'utm_campaign', 'utm_term',
+                             'utm_content', 'fbclid', 'gclid'])
+
+# Alternative hosts of providers in the bundled fixtures, mapped to their canonical host
+HOST_ALIASES = {
+    'youtube.com': 'www.youtube.com',
+    'm.youtube.com': 'www.youtube.com',
+    'instagr.am': 'instagram.com',
+    'www.vimeo.com': 'vimeo.com',
+    'hulu.com': 'www.hulu.com',
+    'scribd.com': 'www.scribd.com',
+}
+
+
+def _youtube(scheme, host, path, params):
+    """
+    Rewrites short youtu.be links to watch URLs and drops the ``feature`` parameter
+    that only tells where a video was shared from
+    """
+    if host == 'youtu.be' and path.strip('/'):
+        params = [('v', path.strip('/'))] + params
+        host, path = 'www.youtube.com', '/watch'
+
+    return scheme, host, path, [(k, v) for k, v in params if k != 'feature']
+
+
+# Rewrites of content URLs by host, after host aliases are applied. Rewrites take and
+# return a tuple of (scheme, host, path, query params as a list of pairs)
+HOST_REWRITES = {
+    'www.youtube.com': _youtube,
+    'youtu.be': _youtube,
+}
 
 
 def extract_content_url(endpoint_url):
@@ -13,6 +51,73 @@ def extract_content_url(endpoint_url):
         return url
 
 
+def canonical_url(url):
+    """
+    Returns a canonical form of a URL so that equivalent URLs are equal. The scheme
+    and host are lowercased, default ports and fragments are dropped, an empty path
+    becomes ``/`` and query parameters are sorted and encoded consistently
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname or ''
+
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+
+    if port and port != _DEFAULT_PORTS.get(scheme):
+        netloc = '%s:%s' % (netloc, port)
+
+    if '@' in parts.netloc:
+        netloc = '%s@%s' % (parts.netloc.rsplit('@', 1)[0], netloc)
+
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def canonical_content_url(url):
+    """
+    Returns a canonical form of a content URL so that URLs of the same content are
+    equal. The scheme and host are lowercased, default ports and ``TRACKING_PARAMS``
+    are dropped, ``HOST_ALIASES`` are replaced by their canonical host and any
+    ``HOST_REWRITES`` are applied. Unlike :func:`canonical_url`, fragments, the
+    order of query parameters and any user info are kept, since some sites depend
+    on them.
+    """
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.hostname:
+        return url
+
+    params = parse_qsl(parts.query, keep_blank_values=True)
+    kept = [(k, v) for k, v in params if k.lower() not in TRACKING_PARAMS]
+
+    scheme, path = parts.scheme.lower(), parts.path or '/'
+    host = HOST_ALIASES.get(parts.hostname, parts.hostname)
+
+    rewrite = HOST_REWRITES.get(host)
+    if rewrite is not None:
+        scheme, host, path, kept = rewrite(scheme, host, path, kept)
+
+    # Leave the query as it is unless parameters changed
+    query = parts.query if kept == params else urlencode(kept)
+
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+
+    if port and port != _DEFAULT_PORTS.get(scheme):
+        host = '%s:%s' % (host, port)
+
+    userinfo = parts.netloc.rpartition('@')[0]
+    if userinfo:
+        host = '%s@%s' % (userinfo, host)
+
+    return urlunsplit((scheme, host, path, query, parts.fragment))
+
+
 def synced(*models):
     """
     Returns True if all model tables are in the full table list.
@@ -1,43 +1,63 @@
+import hashlib
+import json
+import time
+
 from django.http import (HttpResponse,
                          HttpResponseBadRequest,
-                         HttpResponseNotFound)
+                         HttpResponseForbidden,
+                         HttpResponseNotAllowed,
+                         HttpResponseNotFound,
+                         HttpResponseNotModified)
+from django.utils.http import http_date, parse_etags, quote_etag
+from django.views.decorators.csrf import csrf_exempt
 
-from monocle.providers import registry
+from monocle.cache import cache
+from monocle.providers import fetch_resources, registry
+from monocle.settings import settings
+from monocle.throttle import consume
 
 
 class HttpResponseNotImplemented(HttpResponse):
     status_code = 501
 
 
-def oembed(request):
-    """
-    A view that adheres to `OEmbed Spec <http://oembed.com>`_ of what a provider
-    endpoint should do. Any :class:`monocle.providers.Provider` that is configured
-    to be exposed can be provided via this view.
+class HttpResponseTooManyRequests(HttpResponse):
+    status_code = 429
 
-    Both ``maxwidth`` and ``maxheight`` are honored, but no other URL parameter is.
-    This implies that all responses are delivered as JSON (i.e. ``format=json``).
-    XML is not supported. If a request specifies ``format=xml`` or some other unknown
-    format other than JSON, a 501 response is returned.
 
-    If no provider is found, or a provider is not exposed, a 404 is returned.
-    If no resource can be retrieved from the found provider, or it is invalid, a 404
-    is also returned. Else the resource is returned as JSON.
+def _check_access(request, cost=1):
     """
-    url = request.GET.get('url')
-    format = request.GET.get('format', 'json').lower()
+    Checks the API key of a request if ``API_KEYS`` are configured in :mod:`monocle.settings`
+    and takes ``cost`` tokens from the client's rate limit (see :mod:`monocle.throttle`).
 
-    if not url:
-        return HttpResponseBadRequest('Paramater URL is missing')
+    :returns: A 403 or 429 response if the request is rejected, otherwise None
+    """
+    if settings.API_KEYS is not None:
+        key = request.GET.get('key') or request.META.get('HTTP_X_API_KEY')
+        if not key or key not in settings.API_KEYS:
+            return HttpResponseForbidden('A valid API key is required')
+        ident = 'key:%s' % key
+    else:
+        ident = 'addr:%s' % request.META.get('REMOTE_ADDR', '')
+
+    retry_after = consume(ident, cost)
+    if retry_after:
+        response = HttpResponseTooManyRequests('Rate limit exceeded')
+        response['Retry-After'] = str(retry_after)
+        return response
+
+    return None
 
-    # TODO: Support xml
-    if format != 'json':
-        return HttpResponseNotImplemented('OEmbed format %s not implemented' % format)
 
+def _dimension_params(query):
+    """
+    Returns a dict of ``maxwidth`` and ``maxheight`` from a query dict, leaving
+    out any that are missing or not numbers
+    """
     # Get optional and trim None
     params = {
-        'maxwidth': request.GET.get('maxwidth'),
-        'maxheight': request.GET.get('maxheight')
+        'maxwidth': query.get('maxwidth'),
+        'maxheight': query.get('maxheight')
     }
 
     # Filter nones and non-numbers
@@ -48,9 +68,117 @@ def oembed(request):
             # Coerce
             try:
                 params[k] = int(v)
-            except ValueError:
+            except (TypeError, ValueError):
                 del params[k]
 
+    return params
+
+
+def _json_response(request, content):
+    """
+    Returns a JSON response, wrapped in a JSONP callback if one is requested
+    """
+    callback = request.GET.get('callback')
+    if callback:
+        return HttpResponse('%s(%s);' % (callback, content), mimetype='application/json')
+    return HttpResponse(content, mimetype='application/json')
+
+
+def _cacheable(request, response, resource):
+    """
+    Adds HTTP caching headers to a response for a resource. Clients and proxies may
+    cache it for the remaining TTL of the resource. The ETag is a hash of the response
+    content, and a request that already has it gets an empty 304 response instead.
+
+    If ``API_KEYS`` are configured, responses are only cacheable by the client, so
+    shared caches can't serve them to clients without a key.
+    """
+    digest = hashlib.md5(response.content).hexdigest()
+    max_age = max(0, int(resource.created + resource.ttl - time.time()))
+
+    if digest in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        response['Last-Modified'] = http_date(resource.created)
+
+    if settings.API_KEYS is not None:
+        response['Cache-Control'] = 'private, max-age=%d' % max_age
+        response['Vary'] = 'X-Api-Key'
+    else:
+        response['Cache-Control'] = 'public, max-age=%d' % max_age
+
+    response['ETag'] = quote_etag(digest)
+    return response
+
+
+# Serialized list of exposed providers and its ETag, with the registry version
+# they were built from. Rebuilt whenever the registry changes
+_providers_document = None
+
+
+def _get_providers_document():
+    """
+    Returns a three-tuple (registry version, JSON document, digest) describing all
+    exposed providers. The document is only serialized again once the registry changes
+    """
+    global _providers_document
+
+    registry.ensure_populated()
+    document = _providers_document
+
+    if document is None or document[0] != registry._version:
+        version = registry._version
+        providers = []
+
+        for provider in registry.exposed():
+            name = provider.__name__ if isinstance(provider, type) else unicode(provider)
+            providers.append({
+                'name': name,
+                'type': provider.resource_type,
+                'url_schemes': list(provider.url_schemes or []),
+            })
+
+        content = json.dumps({'providers': providers})
+        document = _providers_document = (version, content, hashlib.md5(content).hexdigest())
+
+    return document
+
+
+def oembed(request):
+    """
+    A view that adheres to `OEmbed Spec <http://oembed.com>`_ of what a provider
+    endpoint should do. Any :class:`monocle.providers.Provider` that is configured
+    to be exposed can be provided via this view.
+
+    Both ``maxwidth`` and ``maxheight`` are honored, as is ``format`` which may be
+    ``json`` (the default) or ``xml``. If a request specifies some other unknown format,
+    a 501 response is returned. JSON responses may be wrapped in a JSONP ``callback``.
+
+    If no provider is found, or a provider is not exposed, a 404 is returned.
+    If no resource can be retrieved from the found provider, or it is invalid, a 404
+    is also returned. Else the resource is returned as JSON.
+
+    Responses with a resource carry ``Cache-Control``, ``ETag`` and ``Last-Modified``
+    headers, and conditional requests with ``If-None-Match`` are answered with a 304
+    if the resource is unchanged.
+
+    If ``API_KEYS`` are configured, requests without a valid key get a 403. Clients over
+    the ``THROTTLE_RATE`` limit get a 429. Both are checked before anything else.
+    """
+    rejected = _check_access(request)
+    if rejected is not None:
+        return rejected
+
+    url = request.GET.get('url')
+    format = request.GET.get('format', 'json').lower()
+
+    if not url:
+        return HttpResponseBadRequest('Paramater URL is missing')
+
+    if format not in ('json', 'xml'):
+        return HttpResponseNotImplemented('OEmbed format %s not implemented' % format)
+
+    params = _dimension_params(request.GET)
     provider = registry.match(url)
 
     # 404 on resource not found on non-exposed endpoint
@@ -59,10 +187,130 @@ def oembed(request):
 
     resource = provider.get_resource(url, **params)
 
-    if resource.is_valid:
-        callback = request.GET.get('callback')
-        if callback:
-            return HttpResponse('%s(%s);' % (callback, resource.json), mimetype='application/json')
-        return HttpResponse(resource.json, mimetype='application/json')
-    else:
+    if not resource.is_valid:
         return HttpResponseNotFound('OEmbed resource is invalid or unavailable')
+
+    if format == 'xml':
+        response = HttpResponse(resource.xml, mimetype='text/xml')
+    else:
+        response = _json_response(request, resource.json)
+
+    return _cacheable(request, response, resource)
+
+
+@csrf_exempt
+def oembed_batch(request):
+    """
+    A batch version of :func:`oembed` that provides resources for many URLs in one
+    request. URLs are given either as repeated ``url`` parameters of a GET request::
+
+        /oembed/batch/?url=http://foo.com/1&url=http://foo.com/2&maxwidth=400
+
+    or as the JSON body of a POST request, either a list of URLs or an object with
+    ``urls`` and optionally ``maxwidth`` and ``maxheight``::
+
+        {"urls": ["http://foo.com/1", "http://foo.com/2"], "maxwidth": 400}
+
+    All external resources are looked up in cache at once. Those missing are fetched
+    concurrently, waiting no longer than ``HTTP_TIMEOUT`` from :mod:`monocle.settings`
+    overall. At most ``BATCH_MAX_URLS`` may be requested at a time.
+
+    The response is a JSON object keyed by requested URL. Values are resource data,
+    or null if the URL has no exposed provider or its resource is invalid or unavailable.
+    Only JSON is supported. API keys are required as for :func:`oembed`, and each URL
+    counts as one request against the ``THROTTLE_RATE`` limit.
+    """
+    if request.method == 'POST':
+        # Django 1.3 only has raw_post_data
+        content = getattr(request, 'body', None)
+        if content is None:
+            content = request.raw_post_data
+
+        try:
+            body = json.loads(content)
+        except ValueError:
+            return HttpResponseBadRequest('Request body is not valid JSON')
+
+        if isinstance(body, dict):
+            urls, params = body.get('urls'), _dimension_params(body)
+        else:
+            urls, params = body, {}
+
+        if not isinstance(urls, list):
+            return HttpResponseBadRequest('Request body must be a list of URLs')
+    elif request.method == 'GET':
+        urls, params = request.GET.getlist('url'), _dimension_params(request.GET)
+    else:
+        return HttpResponseNotAllowed(['GET', 'POST'])
+
+    urls = [url for url in urls if url and isinstance(url, basestring)]
+
+    if not urls:
+        return HttpResponseBadRequest('Paramater URL is missing')
+
+    if len(urls) > settings.BATCH_MAX_URLS:
+        return HttpResponseBadRequest('At most %s URLs may be requested' % settings.BATCH_MAX_URLS)
+
+    rejected = _check_access(request, cost=len(urls))
+    if rejected is not None:
+        return rejected
+
+    format = request.GET.get('format', 'json').lower()
+    if format != 'json':
+        return HttpResponseNotImplemented('OEmbed format %s not implemented' % format)
+
+    # Request URLs of exposed providers, keyed by content URL
+    lookups = {}
+
+    for url, provider in registry.match_many(urls).items():
+        if provider and provider.expose:
+            lookups[url] = (provider, provider.get_resource_url(url, **params))
+
+    # Internal resources are built directly. All external ones are checked at once
+    external = [request_url for provider, request_url in lookups.values() if not provider._internal]
+    cached = cache.get_many(external) if external else {}
+
+    missing = [request_url for request_url in external if request_url not in cached]
+    if missing:
+        fetched = fetch_resources(missing, settings.HTTP_TIMEOUT)
+        if fetched:
+            cached.update(cache.get_many(fetched))
+
+    results = dict((url, None) for url in urls)
+
+    for url, (provider, request_url) in lookups.items():
+        resource = cached.get(request_url)
+
+        # Let the provider handle anything not found, stale or internal
+        if resource is None or resource.is_stale:
+            resource = provider.get_resource(url, **params)
+
+        if resource.is_valid:
+            results[url] = resource.data
+
+    return _json_response(request, json.dumps(results))
+
+
+def oembed_providers(request):
+    """
+    Lists every provider exposed via :func:`oembed` along with its URL schemes, so
+    that clients can match URLs themselves and only request those that can be served::
+
+        {"providers": [{"name": "Flickr", "type": "photo",
+                        "url_schemes": ["http://*.flickr.com/photos/*"]}]}
+
+    The document is serialized once and kept until providers are changed in the
+    registry. Its ETag changes along with it, so clients should revalidate with
+    ``If-None-Match`` and get an empty 304 response while providers are unchanged.
+    JSON responses may be wrapped in a JSONP ``callback``.
+    """
+    version, content, digest = _get_providers_document()
+
+    if digest in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = _json_response(request, content)
+
+    response['ETag'] = quote_etag(digest)
+    response['Cache-Control'] = 'public, no-cache'
+    return response